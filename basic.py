@@ -3,6 +3,7 @@ import re
 import unicodedata
 import os
 from pathlib import Path
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
 
 def is_admin(id):
     admins = TELEGRAM_ADMIN.split(',')
@@ -36,6 +37,28 @@ def clean_youtube_link(url):
 
     return url
 
+# Parámetros de seguimiento que no cambian el contenido enlazado
+TRACKING_PARAMS = {'fbclid', 'gclid', 'igsh', 'igshid', 'si', 'feature', 'is_from_webapp', 'sender_device', 'share_id', 'ref_src'}
+
+# Hosts de YouTube (ya sin "www." / "m.") cuyos enlaces a vídeo se unifican
+YOUTUBE_HOSTS = {'youtube.com', 'youtu.be', 'music.youtube.com'}
+
+def canonical_url(url):
+    # Misma URL para el mismo contenido aunque se comparta con distinto formato
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower()
+    if host.startswith('www.') or host.startswith('m.'):
+        host = host.split('.', 1)[1]
+    if host == 'twitter.com':
+        host = 'x.com'
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+             if k not in TRACKING_PARAMS and not k.startswith('utm_')]
+    url = urlunsplit((parts.scheme.lower(), host, parts.path.rstrip('/') or '/', urlencode(query), ''))
+    # Sin lista: el enlace de YouTube se reduce al vídeo (con lista es una playlist)
+    if not any(k == 'list' for k, _ in query) and host in YOUTUBE_HOSTS:
+        return clean_youtube_link(url)
+    return url
+
 def is_compressed_file(file_path):
     lower = file_path.lower()
     
@@ -46,6 +46,15 @@ DOWNLOAD_EBOOK = "/ebook"
 # Carpeta temporal para archivos de conversión, descargas, thumbnails, etc.
 TEMP_DIR = "/tmp/dropbot_conversions"
 
+# Carpeta para descargas de Telegram reanudables (fichero parcial + manifiesto
+# `.parts`). No se vacía al arrancar para poder continuar tras un reinicio; los
+# parciales sin actividad durante RESUME_MAX_AGE_HOURS se eliminan. Solo se usa
+# para documentos de más de FAST_TRANSFER_MIN_BYTES (los pequeños se repiten
+# enteros en un momento) y el manifiesto se guarda cada RESUME_CHECKPOINT_SECONDS.
+RESUME_DIR = "/tmp/dropbot_resume"
+RESUME_MAX_AGE_HOURS = 48
+RESUME_CHECKPOINT_SECONDS = 5
+
 # Fichero de heartbeat para healthcheck de Docker (mtime actualizado periódicamente)
 HEARTBEAT_FILE = "/tmp/dropbot_heartbeat"
 HEARTBEAT_INTERVAL = 15  # segundos entre escrituras
@@ -73,10 +82,48 @@ PARALLEL_DOWNLOADS = int(os.environ.get("PARALLEL_DOWNLOADS", 2))
 # (usa el método estándar de Telethon). Recomendado 4-8 para cuentas de bot.
 FAST_CONNECTIONS = int(os.environ.get("FAST_CONNECTIONS", 8))
 
-# Tamaño mínimo (bytes) para activar la transferencia paralela. Por debajo de
-# este umbral el coste de abrir varias conexiones no compensa.
+# Peticiones de parte simultáneas en vuelo por cada conexión paralela. Con
+# valores >1 se solapan las latencias de ida y vuelta y menos conexiones logran
+# el mismo caudal (útil en enlaces con mucha latencia). 1 = una parte cada vez.
+FAST_INFLIGHT = max(1, int(os.environ.get("FAST_INFLIGHT", 2)))
+
+# Presupuesto global compartido por TODAS las transferencias paralelas
+# simultáneas (descargas y subidas): conexiones abiertas a la vez y memoria (MB)
+# para partes en vuelo o pendientes de escribir. Una transferencia sola puede
+# usarlo entero; con varias se reparte a partes iguales.
+FAST_TOTAL_CONNECTIONS = max(1, int(os.environ.get("FAST_TOTAL_CONNECTIONS", 16)))
+FAST_BUFFER_MB = max(1, int(os.environ.get("FAST_BUFFER_MB", 64)))
+
+# Verificación de integridad de las descargas paralelas: cada parte se compara
+# con los SHA-256 que publica Telegram antes de escribirla a disco y, si no
+# coincide, se vuelve a descargar solo esa parte. Cuesta algunas peticiones
+# extra por fichero. 0 = desactivada (solo se comprueba el tamaño).
+FAST_VERIFY = bool(int(os.environ.get("FAST_VERIFY", 0)))
+
+# Ajustes aprendidos por la transferencia paralela (conexiones y tamaño de parte
+# por datacenter), junto a la sesión de Telethon. FAST_CONNECTIONS actúa como
+# techo: el número real de conexiones se adapta al caudal medido.
+FAST_TUNING_FILE = "dropbot_fast_tuning.json"
+
+# Caché de ficheros que Telegram ya tiene (recibidos o enviados por el bot):
+# reenviar un fichero local sin cambios (misma ruta, tamaño y fecha de
+# modificación) reutiliza el documento existente en lugar de subirlo otra vez.
+FILE_ID_CACHE_FILE = "dropbot_file_ids.json"
+
+# Tamaño mínimo (bytes) para activar la transferencia paralela de documentos.
+# Por debajo de este umbral el coste de abrir varias conexiones no compensa. Las
+# fotos van siempre por la vía paralela (comparten las conexiones persistentes).
 FAST_TRANSFER_MIN_BYTES = 10 * 1024 * 1024  # 10 MB
 
+# Subida anticipada: al terminar una descarga de URL que ofrece enviarse a
+# Telegram, sus partes se suben en segundo plano (prioridad baja) mientras el
+# usuario decide, de modo que "Enviar" solo tiene que publicar el fichero. Los
+# vídeos no se anticipan porque se recodifican justo antes de enviarse. Las
+# subidas no usadas se descartan pasado PRE_UPLOAD_TTL (Telegram no conserva
+# las partes sueltas indefinidamente).
+PRE_UPLOAD = bool(int(os.environ.get("PRE_UPLOAD", 0)))
+PRE_UPLOAD_TTL = 3600  # segundos
+
 # Rutas y filtros para descargas desde URLs (YouTube, Instagram, TikTok, etc.)
 DOWNLOAD_URL_VIDEO = os.environ.get("DOWNLOAD_URL_VIDEO", "/url_video")
 DOWNLOAD_URL_AUDIO = os.environ.get("DOWNLOAD_URL_AUDIO", "/url_audio")
@@ -86,11 +133,30 @@ FILTER_URL_AUDIO = bool(int(os.environ.get("FILTER_URL_AUDIO", 0)))
 # Cookies opcionales para sitios que requieren una sesión autenticada
 YTDLP_COOKIES_FILE = "/app/cookies/cookies.txt"
 
+# Procesos de yt-dlp que se mantienen arrancados (con yt_dlp ya importado) para
+# sondear y descargar enlaces sin pagar el arranque en frío en cada uno
+YTDLP_WORKERS = 2
+
+# Entradas máximas que se enumeran al sondear una playlist que no indica su
+# tamaño (canales con miles de vídeos tardarían minutos en listarse enteros)
+PROBE_MAX_ENTRIES = 5000
+
+# Caché de lo averiguado sobre cada enlace (descarga directa, playlist, tipo de
+# contenido): el mismo enlace reenviado no repite la petición HEAD ni el sondeo
+# de yt-dlp mientras no caduque. URL_CACHE_TTL = 0 la desactiva. Los cambios se
+# escriben en disco en segundo plano como mucho cada URL_CACHE_SAVE_DELAY segundos.
+URL_CACHE_FILE = "dropbot_url_cache.json"
+URL_CACHE_TTL = int(os.environ.get("URL_CACHE_TTL", 6 * 3600))  # segundos
+URL_CACHE_MAX_ENTRIES = 500
+URL_CACHE_SAVE_DELAY = 30  # segundos
+
 # Descarga automática de URLs sin preguntar
 # Valores posibles: "ASK" (preguntar), "VIDEO" (descargar video automáticamente), "AUDIO" (descargar audio automáticamente)
 AUTO_DOWNLOAD_FORMAT = os.environ.get("AUTO_DOWNLOAD_FORMAT", "ASK").upper()
 
 # Configuración interna de la cola de mensajes para evitar FloodWaitError
 # Valores conservadores para evitar problemas con la API de Telegram
-MESSAGE_QUEUE_DELAY = 0.5  # Delay entre mensajes en segundos
+MESSAGE_QUEUE_WORKERS = 4  # Llamadas simultáneas (cada una respeta los límites por chat y global)
 MESSAGE_QUEUE_MAX_RETRIES = 5  # Número máximo de reintentos
+MESSAGE_QUEUE_MAX_WAIT = 10  # Segundos máximos que un mensaje de baja prioridad cede el turno
+MESSAGE_QUEUE_HEAVY_WORKERS = max(2, PARALLEL_DOWNLOADS)  # Subidas de archivos simultáneas (carril aparte del texto)
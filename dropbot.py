@@ -12,6 +12,7 @@ import json
 import warnings
 from urllib.parse import urlparse, unquote
 from telethon import TelegramClient, events, functions, types, Button
+from telethon.errors import RPCError
 from telethon.tl.types import (
     BotCommand, Document, Photo,
     DocumentAttributeFilename, DocumentAttributeVideo, DocumentAttributeAudio
@@ -19,18 +20,24 @@ from telethon.tl.types import (
 from config import *
 from translations import get_text, load_locale, PARSE_MODE
 from basic import *
-from message_queue import TelegramMessageQueue
+from message_queue import TelegramMessageQueue, PRIORITY_INTERACTIVE
 from utils.file_helpers import (
     format_file_size, get_directory_size, get_unique_filename, get_file_icon
 )
 from utils import fast_telethon
+from utils.part_manifest import PartManifest
 from utils import telegram_helpers
+from utils import flood_control
 from utils.telegram_helpers import (
     safe_edit, safe_reply, safe_respond, safe_answer,
     safe_delete, safe_send_message, safe_send_file,
 )
 from services.extraction_service import extract_file
 from services.donors_service import print_donors
+from services import file_cache_service
+from services import progress_service
+from services import ytdlp_service
+from services import url_cache_service
 from services.video_service import (
     get_video_metadata, generate_video_thumbnail, format_duration
 )
@@ -118,6 +125,19 @@ except Exception as e:
     # Si falla, al menos intentar crear la carpeta
     os.makedirs(TEMP_DIR, exist_ok=True)
 
+# Las descargas reanudables se conservan entre reinicios; solo se eliminan las
+# que llevan demasiado tiempo sin actividad (nadie va a reintentarlas ya).
+os.makedirs(RESUME_DIR, exist_ok=True)
+try:
+    stale_before = time.time() - RESUME_MAX_AGE_HOURS * 3600
+    for name in os.listdir(RESUME_DIR):
+        path = os.path.join(RESUME_DIR, name)
+        if os.path.isfile(path) and os.path.getmtime(path) < stale_before:
+            os.remove(path)
+            debug(f"[STARTUP] Removed stale partial download: {name}")
+except Exception as e:
+    warning(f"[STARTUP] Could not prune resume directory: {e}")
+
 # Configurar rarfile para usar unrar
 try:
     # Intentar configurar la herramienta de extracción RAR
@@ -131,6 +151,10 @@ except Exception as e:
     warning(f"[STARTUP] Error configuring RAR tool: {e}")
 
 bot = TelegramClient("dropbot", TELEGRAM_API_ID, TELEGRAM_API_HASH).start(bot_token=TELEGRAM_TOKEN)
+# Ya iniciada la sesión, Telethon no duerme ningún FloodWait por su cuenta: todos
+# llegan a la cola, al progreso o a flood_control.call() y quedan anotados para
+# que ninguna otra vía siga llamando al mismo método y chat mientras dura
+bot.flood_sleep_threshold = 0
 active_tasks = {}
 cancelled_conversions = set()  # Para rastrear conversiones canceladas por el usuario
 send_original_requests = set()  # Para rastrear solicitudes de envío de archivo original sin conversión
@@ -138,28 +162,34 @@ pending_file_actions = {}  # Para almacenar archivos pendientes de renombrar/eli
 pending_renames = {}  # Para almacenar archivos esperando nuevo nombre (lista por usuario)
 list_messages = {}  # Para rastrear mensajes de /list y /manage que deben borrarse juntos: {user_id: [msg1, msg2, ...]}
 
-# Intervalo de actualización de progreso adaptativo
-# Evita anti-spam cuando hay múltiples descargas paralelas
-# Telegram permite ~20 mensajes/minuto en grupos, pero con ediciones es más restrictivo
-# Usamos un intervalo muy conservador para evitar FloodWaitError
-# Fórmula: max(10, PARALLEL_DOWNLOADS * 1.5) segundos
-# Ejemplos: 1 descarga = 10s (6 ediciones/min), 5 descargas = 10s (30 ediciones/min), 10 descargas = 15s (40 ediciones/min)
-PROGRESS_UPDATE_INTERVAL = max(10, PARALLEL_DOWNLOADS * 1.5)
 pending_files = {}
 pending_urls = {}
 playlist_downloads = {}  # Para rastrear descargas de playlist en progreso: {event_id: {"is_full_playlist": bool, "final_output_dir": str, "downloaded_files": []}}
 download_semaphore = asyncio.Semaphore(PARALLEL_DOWNLOADS)
+_resume_paths_in_use = set()  # Parciales de RESUME_DIR con una descarga en curso
+pre_uploads = {}  # Subidas anticipadas en curso o listas: {file_path: {"task", "size", "mtime_ns", "progress"}}
 
 # Inicializar cola de mensajes para evitar FloodWaitError
-# delay_between_messages: tiempo entre mensajes (configurable, default: 0.5s)
+# workers: llamadas simultáneas, dentro de los límites por chat y global (default: 4)
 # max_retries: número de reintentos en caso de error (configurable, default: 5)
+# heavy_workers: subidas de archivos simultáneas, en un carril aparte (default: 2)
 message_queue = TelegramMessageQueue(
-    delay_between_messages=MESSAGE_QUEUE_DELAY,
-    max_retries=MESSAGE_QUEUE_MAX_RETRIES
+    workers=MESSAGE_QUEUE_WORKERS,
+    max_retries=MESSAGE_QUEUE_MAX_RETRIES,
+    max_wait=MESSAGE_QUEUE_MAX_WAIT,
+    heavy_workers=MESSAGE_QUEUE_HEAVY_WORKERS
 )
 
 # Inyectar dependencias (cola + bot) en el módulo de helpers
 telegram_helpers.init(message_queue, bot)
+# Ajustes de conexiones/tamaño de parte aprendidos por DC en ejecuciones anteriores
+fast_telethon.configure_tuning(FAST_TUNING_FILE)
+fast_telethon.configure_governor(FAST_TOTAL_CONNECTIONS, FAST_BUFFER_MB * 1024 * 1024)
+# Documentos que Telegram ya tiene, para reenviarlos sin volver a subirlos
+file_cache_service.init(FILE_ID_CACHE_FILE)
+ytdlp_service.init(YTDLP_WORKERS)
+# Resultados de sondeos de enlaces ya vistos
+url_cache_service.init(URL_CACHE_FILE, URL_CACHE_TTL, URL_CACHE_MAX_ENTRIES, URL_CACHE_SAVE_DELAY)
 
 async def handle_list_files(event):
     """Lista los archivos descargados en el servidor"""
@@ -350,95 +380,77 @@ def _make_transfer_progress_callback(status_message, file_name, text_key, log_ta
     """
     Crea un callback de progreso reutilizable para descargas y subidas.
 
-    Actualiza `status_message` cada PROGRESS_UPDATE_INTERVAL segundos (y siempre
-    al llegar al 100%) para evitar anti-spam. `text_key` selecciona el texto
-    ("downloading_progress"/"uploading_progress"), `log_tag` el prefijo de logs
-    y `buttons` los botones a mostrar en cada edición (None = sin botones).
+    El callback solo publica los bytes transferidos en un trabajo de
+    progress_service, que decide cuándo repintar `status_message`. `text_key`
+    selecciona el texto ("downloading_progress"/"uploading_progress"), `log_tag`
+    el prefijo de logs y `buttons` los botones a mostrar en cada edición
+    (None = sin botones).
     """
-    last_update_time = [0]  # Lista para poder modificar en closure
-    message_deleted = [False]  # Flag para detectar si el mensaje fue eliminado
-
-    async def progress_callback(current, total):
-        # Si no hay mensaje de estado o fue eliminado, no hacer nada
-        if status_message is None or message_deleted[0]:
-            return
-        try:
-            current_time = asyncio.get_running_loop().time()
-            # Siempre actualizar si llegamos al 100%, sin importar el intervalo
-            is_complete = (current >= total)
-            should_update = (current_time - last_update_time[0] >= PROGRESS_UPDATE_INTERVAL) or is_complete
-
-            # Log cuando llegamos al 100%
-            if is_complete and not hasattr(progress_callback, 'logged_100'):
-                debug(f"[{log_tag} PROGRESS] Reached 100% ({current}/{total} bytes)")
-                progress_callback.logged_100 = True
-
-            if should_update:
-                last_update_time[0] = current_time
-
-                # Calcular progreso
-                percent = (current / total) * 100
-
-                # Convertir bytes a formato legible
-                def format_bytes(bytes_val):
-                    for unit in ['B', 'KB', 'MB', 'GB']:
-                        if bytes_val < 1024.0:
-                            return f"{bytes_val:.1f}{unit}"
-                        bytes_val /= 1024.0
-                    return f"{bytes_val:.1f}TB"
-
-                size_current = format_bytes(current)
-                size_total = format_bytes(total)
-
-                # Calcular velocidad (aproximada basada en el intervalo).
-                # Se ignora un bytes_diff negativo (p. ej. al pasar de descarga
-                # rápida a estándar, que reinicia el contador en 0).
-                bytes_diff = current - getattr(progress_callback, 'last_current', 0)
-                time_diff = current_time - getattr(progress_callback, 'last_time', current_time)
-                if bytes_diff >= 0 and time_diff > 0:
-                    speed = format_bytes(bytes_diff / time_diff) + "/s"
-                else:
-                    speed = "N/A"
-
-                progress_callback.last_current = current
-                progress_callback.last_time = current_time
+    last_sample = [None]  # (instante, bytes) del último repintado, para la velocidad
+
+    def format_bytes(bytes_val):
+        for unit in ['B', 'KB', 'MB', 'GB']:
+            if bytes_val < 1024.0:
+                return f"{bytes_val:.1f}{unit}"
+            bytes_val /= 1024.0
+        return f"{bytes_val:.1f}TB"
+
+    def render(counters):
+        current, total = counters["current"], counters["total"]
+        current_time = asyncio.get_running_loop().time()
+        percent = counters["percent"]
+
+        size_current = format_bytes(current)
+        size_total = format_bytes(total)
+
+        # Calcular velocidad (aproximada, desde el repintado anterior).
+        # Se ignora un bytes_diff negativo (p. ej. al pasar de descarga
+        # rápida a estándar, que reinicia el contador en 0).
+        last_time, last_current = last_sample[0] or (current_time, 0)
+        bytes_diff = current - last_current
+        time_diff = current_time - last_time
+        if bytes_diff >= 0 and time_diff > 0:
+            speed = format_bytes(bytes_diff / time_diff) + "/s"
+        else:
+            speed = "N/A"
+        last_sample[0] = (current_time, current)
+
+        # Calcular ETA
+        if speed != "N/A" and bytes_diff > 0 and time_diff > 0:
+            remaining_bytes = total - current
+            eta_seconds = int(remaining_bytes / (bytes_diff / time_diff))
+            eta = f"{eta_seconds // 60:02d}:{eta_seconds % 60:02d}"
+        else:
+            eta = "N/A"
 
-                # Calcular ETA
-                if speed != "N/A" and bytes_diff > 0 and time_diff > 0:
-                    remaining_bytes = total - current
-                    eta_seconds = int(remaining_bytes / (bytes_diff / time_diff))
-                    eta = f"{eta_seconds // 60:02d}:{eta_seconds % 60:02d}"
-                else:
-                    eta = "N/A"
+        # Crear barra de progreso visual
+        bar_length = 20
+        filled = int(bar_length * percent / 100)
+        bar = "█" * filled + "░" * (bar_length - filled)
 
-                # Crear barra de progreso visual
-                bar_length = 20
-                filled = int(bar_length * percent / 100)
-                bar = "█" * filled + "░" * (bar_length - filled)
+        return get_text(text_key, bar, f"{percent:.1f}", f"{size_current}/{size_total}", speed, eta, file_name)
 
-                message = get_text(text_key, bar, f"{percent:.1f}", f"{size_current}/{size_total}", speed, eta, file_name)
+    job = progress_service.Job(status_message, render, buttons=buttons) if status_message else None
 
-                # Usar edición directa sin cola para actualizaciones de progreso (más rápido)
-                try:
-                    if buttons is not None:
-                        await status_message.edit(message, buttons=buttons, parse_mode=PARSE_MODE)
-                    else:
-                        await status_message.edit(message, parse_mode=PARSE_MODE)
-                except Exception as edit_error:
-                    # Si el mensaje fue eliminado o es inválido, marcar como eliminado y dejar de intentar
-                    error_msg = str(edit_error)
-                    if "message ID is invalid" in error_msg or "MESSAGE_ID_INVALID" in error_msg:
-                        debug(f"[{log_tag} PROGRESS] Message was deleted, stopping progress updates")
-                        message_deleted[0] = True
-                    else:
-                        # Otros errores (FloodWaitError, mensaje no modificado, etc.) - solo log
-                        warning(f"[{log_tag}] Error editing progress message: {edit_error}")
-        except Exception as e:
-            # Ignorar errores de actualización (FloodWaitError, etc.)
-            warning(f"[{log_tag}] Error updating progress: {e}")
+    async def progress_callback(current, total):
+        # Si no hay mensaje de estado, no hacer nada
+        if job is None or not total:
+            return
+        # Log cuando llegamos al 100%
+        if current >= total and not hasattr(progress_callback, 'logged_100'):
+            debug(f"[{log_tag} PROGRESS] Reached 100% ({current}/{total} bytes)")
+            progress_callback.logged_100 = True
+        job.update(current=current, total=total, percent=(current / total) * 100, name=file_name)
 
+    progress_callback.job = job
     return progress_callback
 
+async def stop_transfer_progress(progress_callback):
+    """Termina el trabajo de progreso de un callback de _make_transfer_progress_callback
+    (hay que llamarlo al acabar la transferencia, vaya como vaya)."""
+    if progress_callback is not None:
+        await progress_service.stop(progress_callback.job)
+
 def create_upload_progress_callback(status_message, file_name):
     """Callback de progreso para envíos a Telegram (sin botones)."""
     return _make_transfer_progress_callback(
@@ -452,41 +464,221 @@ def create_progress_callback(status_message, event, file_name):
         status_message, file_name, "downloading_progress", "DOWNLOAD", buttons=buttons
     )
 
-async def _download_to_file(message, temp_file_path, progress_callback):
+def _resume_manifest(message):
+    """
+    Devuelve el PartManifest de la descarga reanudable del documento del
+    mensaje (fichero parcial estable en RESUME_DIR, identificado por el id del
+    documento), o None si no aplica: no es un documento, es tan pequeño que
+    no compensa reanudarlo (FAST_TRANSFER_MIN_BYTES) o ya hay otra descarga
+    del mismo documento en curso (esa seguirá por la ruta temporal normal).
+    """
+    document = message.document
+    if document is None or not document.size or document.size <= FAST_TRANSFER_MIN_BYTES:
+        return None
+    data_path = os.path.join(RESUME_DIR, f"{document.id}_download")
+    if data_path in _resume_paths_in_use:
+        return None
+    _resume_paths_in_use.add(data_path)
+    return PartManifest.load(
+        data_path, document.id, document.size, fast_telethon.part_size_for(document.size, document.dc_id)
+    )
+
+
+def _release_resume_manifest(manifest):
+    if manifest:
+        _resume_paths_in_use.discard(manifest.data_path)
+
+
+async def _download_resumable_standard(document, manifest, progress_callback):
+    """
+    Descarga estándar (una conexión) que continúa desde la primera parte que
+    falta según el manifiesto, marcando y persistiendo las partes según llegan.
+    Las escrituras van al executor para no bloquear el event loop.
+    """
+    loop = asyncio.get_running_loop()
+    part_size = manifest.part_size
+    first_part = manifest.contiguous_parts()
+    offset = first_part * part_size
+    size = manifest.size
+    if first_part:
+        debug(f"[DOWNLOAD] Resuming standard download at {offset / (1024*1024):.1f} MB")
+
+    mode = "r+b" if os.path.exists(manifest.data_path) else "wb"
+    with open(manifest.data_path, mode) as out:
+        out.seek(offset)
+        part = first_part
+        last_checkpoint = time.time()
+
+        def _checkpoint():
+            out.flush()
+            os.fsync(out.fileno())
+            manifest.save()
+
+        try:
+            async for chunk in bot.iter_download(
+                document, offset=offset, request_size=part_size,
+                limit=manifest.part_count - first_part, file_size=size
+            ):
+                await loop.run_in_executor(None, out.write, chunk)
+                manifest.mark(part)
+                part += 1
+                offset += len(chunk)
+                if time.time() - last_checkpoint >= RESUME_CHECKPOINT_SECONDS:
+                    last_checkpoint = time.time()
+                    await loop.run_in_executor(None, _checkpoint)
+                if progress_callback:
+                    await progress_callback(offset, size)
+        finally:
+            await loop.run_in_executor(None, _checkpoint)
+
+    if offset != size:
+        raise ValueError(f"Incomplete download: got {offset} of {size} bytes")
+
+
+async def _refetch_media(message):
+    """
+    Vuelve a pedir `message` a Telegram para obtener su media con una
+    referencia de fichero válida (las referencias caducan en descargas largas).
+    """
+    debug(f"[DOWNLOAD] File reference expired, refetching message {message.id}")
+    fresh = await flood_control.call("get", message.chat_id, bot.get_messages, message.chat_id, ids=message.id)
+    media = fresh and (fresh.document or fresh.photo)
+    if media is None:
+        raise ValueError(f"Message {message.id} no longer has media")
+    return media
+
+
+async def _download_to_file(message, temp_file_path, progress_callback, manifest=None):
     """
     Descarga el media del mensaje a `temp_file_path`.
 
-    Intenta primero la descarga paralela (FastTelethon) para ficheros grandes;
-    si falla por cualquier motivo, recurre al método estándar de Telethon.
+    Intenta primero la descarga paralela (FastTelethon) para ficheros grandes
+    y para fotos (que, aunque pequeñas, comparten las conexiones persistentes
+    con el resto de descargas en curso); si falla por cualquier motivo,
+    recurre al método estándar de Telethon.
+    Con `manifest` (documentos) ambas rutas continúan desde las partes ya
+    descargadas en lugar de empezar de cero.
     """
     document = message.document
+    photo = message.photo if document is None else None
     file_size = message.file.size if message.file and message.file.size else 0
-    use_fast = (
-        FAST_CONNECTIONS > 1
-        and document is not None
-        and file_size > FAST_TRANSFER_MIN_BYTES
+    use_fast = FAST_CONNECTIONS > 1 and (
+        photo is not None
+        or (document is not None and file_size > FAST_TRANSFER_MIN_BYTES)
     )
 
     if use_fast:
         try:
             conns = fast_telethon.connection_count(file_size, FAST_CONNECTIONS)
             debug(f"[DOWNLOAD] Parallel download: {conns} connection(s) for this file")
-            with open(temp_file_path, "wb") as out:
+            mode = "r+b" if manifest and os.path.exists(temp_file_path) else "wb"
+            with open(temp_file_path, mode) as out:
                 await fast_telethon.download_file(
-                    bot, document, out, FAST_CONNECTIONS, progress_callback
+                    bot, document or photo, out, FAST_CONNECTIONS, progress_callback,
+                    manifest=manifest, inflight=FAST_INFLIGHT,
+                    refresh=lambda: _refetch_media(message), verify=FAST_VERIFY
                 )
             return
         except asyncio.CancelledError:
             raise
         except Exception as fast_err:
             warning(f"[DOWNLOAD] ⚠️ Parallel download failed ({fast_err}); falling back to standard download")
-            if os.path.exists(temp_file_path):
+            if not manifest and os.path.exists(temp_file_path):
                 try:
                     os.remove(temp_file_path)
                 except Exception:
                     pass
 
-    await bot.download_media(message, file=temp_file_path, progress_callback=progress_callback)
+    # Un FloodWait a mitad de descarga se espera y se repite (la reanudable
+    # continúa desde las partes ya marcadas)
+    if manifest:
+        await flood_control.call("download", None, _download_resumable_standard, document, manifest, progress_callback)
+        return
+
+    await flood_control.call("download", None, bot.download_media, message, file=temp_file_path, progress_callback=progress_callback)
+
+
+def _start_pre_upload(file_path):
+    """
+    Empieza a subir `file_path` a Telegram en segundo plano, con prioridad
+    baja para no frenar las transferencias que el usuario está esperando. Si
+    después se envía sin cambios, _send_file_fast reutiliza el handle en lugar
+    de subirlo otra vez.
+    """
+    if file_path in pre_uploads:
+        return
+    st = os.stat(file_path)
+    entry = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "progress": None}
+
+    async def _progress(current, total):
+        # Hasta que alguien pulsa "Enviar" no hay mensaje de progreso que actualizar
+        if entry["progress"]:
+            await entry["progress"](current, total)
+
+    async def _upload():
+        with open(file_path, "rb") as f:
+            return await fast_telethon.upload_file(
+                bot, f, entry["size"], FAST_CONNECTIONS, _progress,
+                inflight=FAST_INFLIGHT, priority=fast_telethon.PRIORITY_LOW
+            )
+
+    def _done(task):
+        if task.cancelled():
+            return
+        if task.exception():
+            debug(f"[PRE_UPLOAD] Background upload failed for {os.path.basename(file_path)}: {task.exception()}")
+            _discard_pre_upload(file_path)
+        else:
+            debug(f"[PRE_UPLOAD] ✅ {os.path.basename(file_path)} ready to send")
+
+    debug(f"[PRE_UPLOAD] Starting background upload of {os.path.basename(file_path)}")
+    entry["task"] = asyncio.create_task(_upload())
+    entry["task"].add_done_callback(_done)
+    entry["expiry"] = asyncio.get_running_loop().call_later(
+        PRE_UPLOAD_TTL, _discard_pre_upload, file_path
+    )
+    pre_uploads[file_path] = entry
+
+
+def _discard_pre_upload(file_path):
+    """Descarta la subida anticipada de `file_path` (cancelándola si sigue en
+    curso). Las partes ya subidas simplemente caducan en Telegram."""
+    entry = pre_uploads.pop(file_path, None)
+    if entry is None:
+        return
+    entry["expiry"].cancel()
+    if not entry["task"].done():
+        debug(f"[PRE_UPLOAD] Cancelling background upload of {os.path.basename(file_path)}")
+        entry["task"].cancel()
+
+
+async def _take_pre_upload(file_path, progress_callback):
+    """Devuelve el handle de la subida anticipada de `file_path` (esperando a
+    que termine, con progreso en `progress_callback`), o None si no hay o el
+    fichero ha cambiado desde que empezó."""
+    entry = pre_uploads.get(file_path)
+    if entry is None:
+        return None
+    try:
+        st = os.stat(file_path)
+    except OSError:
+        st = None
+    if st is None or (st.st_size, st.st_mtime_ns) != (entry["size"], entry["mtime_ns"]):
+        _discard_pre_upload(file_path)
+        return None
+    entry["progress"] = progress_callback
+    try:
+        return await asyncio.shield(entry["task"])
+    except asyncio.CancelledError:
+        if entry["task"].cancelled():
+            return None
+        raise
+    except Exception:
+        return None  # Ya registrado en _done: se sube por la vía normal
+    finally:
+        entry["progress"] = None
+        if entry["task"].done():
+            _discard_pre_upload(file_path)
 
 
 async def _send_file_fast(entity, file_path, filename, attributes, thumb_path, is_video, progress_callback):
@@ -494,8 +686,9 @@ async def _send_file_fast(entity, file_path, filename, attributes, thumb_path, i
     Envía un fichero a Telegram.
 
     Para ficheros grandes usa subida paralela (FastTelethon) y, si falla por
-    cualquier motivo, recurre al método estándar de Telethon. Devuelve el
-    mensaje enviado.
+    cualquier motivo, recurre al método estándar de Telethon. El envío pasa
+    por el carril pesado de la cola (límites de velocidad y FloodWait del
+    chat). Devuelve el mensaje enviado.
     """
     file_size = os.path.getsize(file_path)
 
@@ -511,15 +704,36 @@ async def _send_file_fast(entity, file_path, filename, attributes, thumb_path, i
 
     use_fast = FAST_CONNECTIONS > 1 and file_size > FAST_TRANSFER_MIN_BYTES
 
+    # Subida anticipada en segundo plano (PRE_UPLOAD): solo falta publicarla
+    handle = await _take_pre_upload(file_path, progress_callback)
+    if handle is not None:
+        try:
+            debug(f"[UPLOAD] Using background upload for {filename}")
+            return await safe_send_file(
+                entity,
+                file=handle,
+                attributes=attributes,
+                thumb=thumb_path if thumb_path else None,
+                mime_type=mime_type,
+                supports_streaming=supports_streaming,
+                force_document=force_document,
+                progress_callback=None,
+                wait_for_result=True
+            )
+        except RPCError as pre_err:
+            # Partes caducadas en Telegram: subir de nuevo
+            warning(f"[UPLOAD] ⚠️ Background upload no longer usable ({pre_err}); uploading again")
+
     if use_fast:
         try:
             conns = fast_telethon.connection_count(file_size, FAST_CONNECTIONS)
             debug(f"[UPLOAD] Parallel upload: {conns} connection(s) for {filename}")
             with open(file_path, "rb") as f:
                 handle = await fast_telethon.upload_file(
-                    bot, f, file_size, FAST_CONNECTIONS, progress_callback
+                    bot, f, file_size, FAST_CONNECTIONS, progress_callback,
+                    inflight=FAST_INFLIGHT
                 )
-            return await bot.send_file(
+            return await safe_send_file(
                 entity,
                 file=handle,
                 attributes=attributes,
@@ -528,13 +742,14 @@ async def _send_file_fast(entity, file_path, filename, attributes, thumb_path, i
                 supports_streaming=supports_streaming,
                 force_document=force_document,
                 progress_callback=None,
+                wait_for_result=True
             )
         except asyncio.CancelledError:
             raise
         except Exception as fast_err:
             warning(f"[UPLOAD] ⚠️ Parallel upload failed ({fast_err}); falling back to standard send")
 
-    return await bot.send_file(
+    return await safe_send_file(
         entity,
         file_path,
         attributes=attributes,
@@ -543,8 +758,28 @@ async def _send_file_fast(entity, file_path, filename, attributes, thumb_path, i
         supports_streaming=supports_streaming,
         force_document=force_document,
         progress_callback=progress_callback,
+        wait_for_result=True
     )
 
+async def _send_cached_file(entity, file_path, log_tag):
+    """
+    Reenvía `file_path` sin convertirlo ni subirlo si Telegram ya tiene ese
+    mismo fichero (caché de ficheros). Devuelve el mensaje enviado, o None si
+    no está en la caché o la referencia guardada ya no vale (y entonces se
+    envía como siempre).
+    """
+    cached = file_cache_service.get(file_path)
+    if cached is None:
+        return None
+    try:
+        debug(f"{log_tag} File already on Telegram, re-sending without upload: {os.path.basename(file_path)}")
+        return await safe_send_file(entity, cached, wait_for_result=True)
+    except RPCError as e:
+        # Referencia caducada o documento ya no disponible: subida normal
+        warning(f"{log_tag} ⚠️ Cached file no longer valid ({e}); uploading again")
+        file_cache_service.forget(file_path)
+        return None
+
 
 async def download_media(event):
     debug(f"[DOWNLOAD] download_media() called for event.id={event.id}")
@@ -562,9 +797,15 @@ async def download_media(event):
     if unique_file_name != file_name:
         debug(f"[DOWNLOAD] Duplicate file detected. Renaming: {file_name} -> {unique_file_name}")
 
-    # Descargar primero a /tmp para que no aparezca en /list mientras se descarga
-    timestamp_ms = int(time.time() * 1000)
-    temp_file_path = os.path.join(TEMP_DIR, f"{unique_file_name}_{timestamp_ms}_download")
+    # Descargar primero a /tmp para que no aparezca en /list mientras se descarga.
+    # Los documentos grandes van a un parcial estable en RESUME_DIR (con su manifiesto
+    # de partes) para que reintentos y reinicios continúen donde se quedaron.
+    manifest = _resume_manifest(message)
+    if manifest:
+        temp_file_path = manifest.data_path
+    else:
+        timestamp_ms = int(time.time() * 1000)
+        temp_file_path = os.path.join(TEMP_DIR, f"{unique_file_name}_{timestamp_ms}_download")
     final_file_path = os.path.join(download_path, unique_file_name)
 
     debug(f"[DOWNLOAD] Temporary path: {temp_file_path}")
@@ -587,237 +828,186 @@ async def download_media(event):
         progress_callback = create_progress_callback(status_message, event, file_name)
 
     # Intentar descargar con reintentos
-    for attempt in range(1, MAX_DOWNLOAD_RETRIES + 1):
-        try:
-            # Descargar a archivo temporal con timeout
-            # Timeout dinámico: 10 minutos base + 2 minutos por cada 100MB de archivo
-            # Esto previene que descargas se queden colgadas indefinidamente
-            # Ejemplos: 100MB=12min, 500MB=20min, 1GB=30min, 2GB=50min
-            # Basado en datos reales: descargas normales tardan 2-22min para archivos de 1-2GB
-            file_size_mb = message.file.size / (1024 * 1024) if message.file and message.file.size else 100
-            download_timeout = 600 + (file_size_mb / 100) * 120  # 10 min base + 2 min por cada 100MB
-            debug(f"[DOWNLOAD] Download timeout set to {int(download_timeout)}s ({int(download_timeout/60)}min) for {file_size_mb:.1f}MB file")
-            debug(f"[DOWNLOAD] Starting download to: {temp_file_path}")
-            debug(f"[DOWNLOAD] Progress callback enabled: {progress_callback is not None}")
-
-            await asyncio.wait_for(
-                _download_to_file(message, temp_file_path, progress_callback),
-                timeout=download_timeout
-            )
-
-            debug(f"[DOWNLOAD] ✅ bot.download_media() completed successfully")
-            debug(f"[DOWNLOAD] Checking if temp file exists...")
-
-            # Mover archivo de /tmp a carpeta final
-            debug(f"[DOWNLOAD] Moving file from temp to final location...")
-            debug(f"[DOWNLOAD] Source: {temp_file_path}")
-            debug(f"[DOWNLOAD] Destination: {final_file_path}")
-
+    try:
+        for attempt in range(1, MAX_DOWNLOAD_RETRIES + 1):
             try:
-                # Verificar que el archivo temporal existe antes de mover
-                if not os.path.exists(temp_file_path):
-                    error(f"[DOWNLOAD] ❌ Temporary file not found: {temp_file_path}")
-                    raise FileNotFoundError(f"Temporary file not found: {temp_file_path}")
-
-                debug(f"[DOWNLOAD] ✅ Temporary file exists")
-                temp_size = os.path.getsize(temp_file_path)
-                debug(f"[DOWNLOAD] Temporary file size: {temp_size} bytes ({temp_size / (1024*1024):.2f} MB)")
-
-                # Verificar permisos de lectura
-                if not os.access(temp_file_path, os.R_OK):
-                    error(f"[DOWNLOAD] ❌ No read permission for temp file: {temp_file_path}")
-                    raise PermissionError(f"No read permission for temp file")
-
-                debug(f"[DOWNLOAD] ✅ Temp file is readable")
-
-                # Verificar que el directorio de destino existe
-                dest_dir = os.path.dirname(final_file_path)
-                if not os.path.exists(dest_dir):
-                    error(f"[DOWNLOAD] ❌ Destination directory does not exist: {dest_dir}")
-                    raise FileNotFoundError(f"Destination directory not found: {dest_dir}")
-
-                debug(f"[DOWNLOAD] ✅ Destination directory exists: {dest_dir}")
-
-                # Verificar permisos de escritura en destino
-                if not os.access(dest_dir, os.W_OK):
-                    error(f"[DOWNLOAD] ❌ No write permission for destination directory: {dest_dir}")
-                    raise PermissionError(f"No write permission for destination directory")
-
-                debug(f"[DOWNLOAD] ✅ Destination directory is writable")
-
-                # Mover archivo de forma asíncrona para no bloquear el event loop
-                # Usar copyfile + remove en lugar de move/copy para evitar problemas de permisos
-                # copyfile() solo copia el contenido, NO intenta copiar permisos/metadata
-                debug(f"[DOWNLOAD] Copying file asynchronously (content only, no metadata)...")
-                loop = asyncio.get_running_loop()
-
-                # Copiar solo el contenido del archivo (sin permisos/metadata)
-                await loop.run_in_executor(None, shutil.copyfile, temp_file_path, final_file_path)
-                debug(f"[DOWNLOAD] ✅ File content copied successfully")
-
-                # Eliminar archivo temporal
-                await loop.run_in_executor(None, os.remove, temp_file_path)
-                debug(f"[DOWNLOAD] ✅ Temporary file removed")
-
-                # Verificar que el archivo final existe
-                # Para archivos .torrent, el gestor puede procesarlos inmediatamente
-                is_torrent = final_file_path.lower().endswith('.torrent')
-                file_exists = os.path.exists(final_file_path)
-
-                if not file_exists:
-                    if is_torrent:
-                        debug(f"[DOWNLOAD] Torrent file was processed by torrent manager (expected behavior)")
-                        # Continuar normalmente, el archivo fue procesado correctamente
-                    else:
-                        error(f"[DOWNLOAD] ❌ Final file not found after move: {final_file_path}")
-                        raise FileNotFoundError(f"Final file not found after move: {final_file_path}")
-
-                if file_exists:
-                    debug(f"[DOWNLOAD] ✅ Final file exists")
-                    final_size = os.path.getsize(final_file_path)
-                    debug(f"[DOWNLOAD] Final file size: {final_size} bytes ({final_size / (1024*1024):.2f} MB)")
+                # Descargar a archivo temporal con timeout
+                # Timeout dinámico: 10 minutos base + 2 minutos por cada 100MB de archivo
+                # Esto previene que descargas se queden colgadas indefinidamente
+                # Ejemplos: 100MB=12min, 500MB=20min, 1GB=30min, 2GB=50min
+                # Basado en datos reales: descargas normales tardan 2-22min para archivos de 1-2GB
+                file_size_mb = message.file.size / (1024 * 1024) if message.file and message.file.size else 100
+                download_timeout = 600 + (file_size_mb / 100) * 120  # 10 min base + 2 min por cada 100MB
+                debug(f"[DOWNLOAD] Download timeout set to {int(download_timeout)}s ({int(download_timeout/60)}min) for {file_size_mb:.1f}MB file")
+                debug(f"[DOWNLOAD] Starting download to: {temp_file_path}")
+                debug(f"[DOWNLOAD] Progress callback enabled: {progress_callback is not None}")
+
+                await asyncio.wait_for(
+                    _download_to_file(message, temp_file_path, progress_callback, manifest),
+                    timeout=download_timeout
+                )
 
-                    # Verificar que los tamaños coinciden
-                    if temp_size != final_size:
-                        warning(f"[DOWNLOAD] ⚠️ File size mismatch! Temp: {temp_size}, Final: {final_size}")
-                    else:
-                        debug(f"[DOWNLOAD] ✅ File sizes match")
+                debug(f"[DOWNLOAD] ✅ bot.download_media() completed successfully")
+                debug(f"[DOWNLOAD] Checking if temp file exists...")
 
-            except Exception as move_error:
-                error(f"[DOWNLOAD] ❌ Error moving file: {move_error}")
-                error(f"[DOWNLOAD] Error type: {type(move_error).__name__}")
-                import traceback
-                error(f"[DOWNLOAD] Traceback: {traceback.format_exc()}")
-                # Re-lanzar la excepción para que se maneje en el except general
-                raise
+                # Mover archivo de /tmp a carpeta final
+                debug(f"[DOWNLOAD] Moving file from temp to final location...")
+                debug(f"[DOWNLOAD] Source: {temp_file_path}")
+                debug(f"[DOWNLOAD] Destination: {final_file_path}")
 
-            # Descarga exitosa - borrar mensaje de progreso
-            debug(f"[DOWNLOAD] Deleting progress message...")
-            if status_message:
                 try:
-                    debug(f"[DOWNLOAD] Calling safe_delete with wait_for_result=True...")
-                    delete_result = await safe_delete(status_message, wait_for_result=True)
-                    debug(f"[DOWNLOAD] safe_delete returned: {delete_result}")
-                    debug(f"[DOWNLOAD] ✅ Progress message deleted successfully")
-                except asyncio.TimeoutError:
-                    warning(f"[DOWNLOAD] ⚠️ Timeout deleting progress message (waited 5 minutes)")
-                except Exception as delete_error:
-                    warning(f"[DOWNLOAD] ⚠️ Could not delete progress message: {delete_error}")
-                    warning(f"[DOWNLOAD] Delete error type: {type(delete_error).__name__}")
-                    # Continuar aunque falle el borrado
-            else:
-                debug(f"[DOWNLOAD] No status message to delete")
-
-            # Mostrar información detallada del archivo descargado (sin botones de acción)
-            debug(f"[DOWNLOAD] Calling handle_success for: {final_file_path}")
-            try:
-                await handle_success(event, final_file_path, show_action_buttons=False)
-                debug(f"[DOWNLOAD] ✅ handle_success completed")
-            except Exception as success_error:
-                error(f"[DOWNLOAD] ❌ Error in handle_success: {success_error}")
-                error(f"[DOWNLOAD] Success error type: {type(success_error).__name__}")
-                import traceback
-                error(f"[DOWNLOAD] Traceback: {traceback.format_exc()}")
-                # Re-lanzar para que se capture en el except general
-                raise
-
-            debug(f"[DOWNLOAD] ✅ File {file_name} - Downloaded successfully")
-
-            # Salir del bucle si la descarga fue exitosa
-            debug(f"[DOWNLOAD] Breaking from retry loop")
-            break
+                    # Verificar que el archivo temporal existe antes de mover
+                    if not os.path.exists(temp_file_path):
+                        error(f"[DOWNLOAD] ❌ Temporary file not found: {temp_file_path}")
+                        raise FileNotFoundError(f"Temporary file not found: {temp_file_path}")
+
+                    debug(f"[DOWNLOAD] ✅ Temporary file exists")
+                    temp_size = os.path.getsize(temp_file_path)
+                    debug(f"[DOWNLOAD] Temporary file size: {temp_size} bytes ({temp_size / (1024*1024):.2f} MB)")
+
+                    # Verificar permisos de lectura
+                    if not os.access(temp_file_path, os.R_OK):
+                        error(f"[DOWNLOAD] ❌ No read permission for temp file: {temp_file_path}")
+                        raise PermissionError(f"No read permission for temp file")
+
+                    debug(f"[DOWNLOAD] ✅ Temp file is readable")
+
+                    # Verificar que el directorio de destino existe
+                    dest_dir = os.path.dirname(final_file_path)
+                    if not os.path.exists(dest_dir):
+                        error(f"[DOWNLOAD] ❌ Destination directory does not exist: {dest_dir}")
+                        raise FileNotFoundError(f"Destination directory not found: {dest_dir}")
+
+                    debug(f"[DOWNLOAD] ✅ Destination directory exists: {dest_dir}")
+
+                    # Verificar permisos de escritura en destino
+                    if not os.access(dest_dir, os.W_OK):
+                        error(f"[DOWNLOAD] ❌ No write permission for destination directory: {dest_dir}")
+                        raise PermissionError(f"No write permission for destination directory")
+
+                    debug(f"[DOWNLOAD] ✅ Destination directory is writable")
+
+                    # Mover archivo de forma asíncrona para no bloquear el event loop
+                    # Usar copyfile + remove en lugar de move/copy para evitar problemas de permisos
+                    # copyfile() solo copia el contenido, NO intenta copiar permisos/metadata
+                    debug(f"[DOWNLOAD] Copying file asynchronously (content only, no metadata)...")
+                    loop = asyncio.get_running_loop()
+
+                    # Copiar solo el contenido del archivo (sin permisos/metadata)
+                    await loop.run_in_executor(None, shutil.copyfile, temp_file_path, final_file_path)
+                    debug(f"[DOWNLOAD] ✅ File content copied successfully")
+
+                    # Eliminar archivo temporal
+                    await loop.run_in_executor(None, os.remove, temp_file_path)
+                    if manifest:
+                        manifest.remove()
+                    debug(f"[DOWNLOAD] ✅ Temporary file removed")
+
+                    # Verificar que el archivo final existe
+                    # Para archivos .torrent, el gestor puede procesarlos inmediatamente
+                    is_torrent = final_file_path.lower().endswith('.torrent')
+                    file_exists = os.path.exists(final_file_path)
+
+                    if not file_exists:
+                        if is_torrent:
+                            debug(f"[DOWNLOAD] Torrent file was processed by torrent manager (expected behavior)")
+                            # Continuar normalmente, el archivo fue procesado correctamente
+                        else:
+                            error(f"[DOWNLOAD] ❌ Final file not found after move: {final_file_path}")
+                            raise FileNotFoundError(f"Final file not found after move: {final_file_path}")
 
-        except asyncio.CancelledError:
-            if status_message:
-                await safe_edit(status_message, get_text("cancelled"), buttons=None, parse_mode=PARSE_MODE)
-            # Limpiar archivo temporal si existe
-            if os.path.exists(temp_file_path):
-                os.remove(temp_file_path)
-                debug(f"[DOWNLOAD] Temporary file deleted after cancellation: {temp_file_path}")
-            # Limpiar archivo final si se movió
-            if os.path.exists(final_file_path):
-                os.remove(final_file_path)
-                debug(f"[DOWNLOAD] Final file deleted after cancellation: {final_file_path}")
-            debug(f"[DOWNLOAD] File {file_name} - Cancelled")
-            raise
+                    if file_exists:
+                        debug(f"[DOWNLOAD] ✅ Final file exists")
+                        final_size = os.path.getsize(final_file_path)
+                        debug(f"[DOWNLOAD] Final file size: {final_size} bytes ({final_size / (1024*1024):.2f} MB)")
 
-        except asyncio.TimeoutError:
-            # Timeout específico de asyncio.wait_for
-            error(f"[DOWNLOAD] Download timeout after {int(download_timeout)}s for {file_name}")
+                        # Verificar que los tamaños coinciden
+                        if temp_size != final_size:
+                            warning(f"[DOWNLOAD] ⚠️ File size mismatch! Temp: {temp_size}, Final: {final_size}")
+                        else:
+                            debug(f"[DOWNLOAD] ✅ File sizes match")
+                            # Telegram ya tiene este fichero: reenviarlo luego no requiere subirlo
+                            file_cache_service.put(final_file_path, message.document)
+
+                except Exception as move_error:
+                    error(f"[DOWNLOAD] ❌ Error moving file: {move_error}")
+                    error(f"[DOWNLOAD] Error type: {type(move_error).__name__}")
+                    import traceback
+                    error(f"[DOWNLOAD] Traceback: {traceback.format_exc()}")
+                    # Re-lanzar la excepción para que se maneje en el except general
+                    raise
+
+                # Descarga exitosa - borrar mensaje de progreso
+                debug(f"[DOWNLOAD] Deleting progress message...")
+                if status_message:
+                    try:
+                        debug(f"[DOWNLOAD] Calling safe_delete with wait_for_result=True...")
+                        delete_result = await safe_delete(status_message, wait_for_result=True)
+                        debug(f"[DOWNLOAD] safe_delete returned: {delete_result}")
+                        debug(f"[DOWNLOAD] ✅ Progress message deleted successfully")
+                    except asyncio.TimeoutError:
+                        warning(f"[DOWNLOAD] ⚠️ Timeout deleting progress message (waited 5 minutes)")
+                    except Exception as delete_error:
+                        warning(f"[DOWNLOAD] ⚠️ Could not delete progress message: {delete_error}")
+                        warning(f"[DOWNLOAD] Delete error type: {type(delete_error).__name__}")
+                        # Continuar aunque falle el borrado
+                else:
+                    debug(f"[DOWNLOAD] No status message to delete")
 
-            # Eliminar archivo parcialmente descargado (temporal)
-            if os.path.exists(temp_file_path):
+                # Mostrar información detallada del archivo descargado (sin botones de acción)
+                debug(f"[DOWNLOAD] Calling handle_success for: {final_file_path}")
                 try:
-                    os.remove(temp_file_path)
-                    debug(f"[DOWNLOAD] Partial temp file deleted after timeout: {temp_file_path}")
-                except Exception as cleanup_error:
-                    warning(f"[DOWNLOAD] Error deleting {temp_file_path}: {cleanup_error}")
+                    await handle_success(event, final_file_path, show_action_buttons=False)
+                    debug(f"[DOWNLOAD] ✅ handle_success completed")
+                except Exception as success_error:
+                    error(f"[DOWNLOAD] ❌ Error in handle_success: {success_error}")
+                    error(f"[DOWNLOAD] Success error type: {type(success_error).__name__}")
+                    import traceback
+                    error(f"[DOWNLOAD] Traceback: {traceback.format_exc()}")
+                    # Re-lanzar para que se capture en el except general
+                    raise
+
+                debug(f"[DOWNLOAD] ✅ File {file_name} - Downloaded successfully")
+
+                # Salir del bucle si la descarga fue exitosa
+                debug(f"[DOWNLOAD] Breaking from retry loop")
+                break
 
-            # Si aún quedan intentos, reintentar
-            if attempt < MAX_DOWNLOAD_RETRIES:
-                debug(f"[DOWNLOAD] Retrying download of {file_name} (attempt {attempt + 1} of {MAX_DOWNLOAD_RETRIES}) after timeout")
-                if status_message:
-                    try:
-                        await safe_edit(
-                            status_message,
-                            get_text("warning_retrying_download", attempt + 1, MAX_DOWNLOAD_RETRIES),
-                            buttons=[Button.inline(get_text("button_cancel"), data=f"cancel:{event.id}")],
-                            parse_mode=PARSE_MODE
-                        )
-                    except Exception as msg_error:
-                        error(f"[DOWNLOAD] Error updating status message: {msg_error}")
-
-                # Esperar antes de reintentar
-                await asyncio.sleep(RETRY_DELAY_SECONDS)
-            else:
-                # Último intento fallido
-                error(f"[DOWNLOAD] Download failed after {MAX_DOWNLOAD_RETRIES} attempts due to timeout")
+            except asyncio.CancelledError:
                 if status_message:
-                    try:
-                        await safe_edit(
-                            status_message,
-                            get_text("error_telegram_timeout_user", file_name),
-                            buttons=None,
-                            parse_mode=PARSE_MODE
-                        )
-                    except Exception as msg_error:
-                        error(f"[DOWNLOAD] Error updating status message: {msg_error}")
-
-        except Exception as e:
-            error_msg = str(e)
-            error_type = type(e).__name__
-
-            # Loguear SIEMPRE el error antes de decidir qué hacer
-            error(f"[DOWNLOAD] ❌ Exception caught in download loop: {error_type} - {error_msg}")
-            import traceback
-            error(f"[DOWNLOAD] Traceback: {traceback.format_exc()}")
-
-            # Errores que deben reintentar: TimeoutError, ValueError, errores de red, errores internos de Telegram
-            should_retry = (
-                isinstance(e, (TimeoutError, ValueError)) or
-                "timeout" in error_msg.lower() or
-                "unsuccessful" in error_msg.lower() or
-                "internal" in error_msg.lower() or
-                "getfilerequest" in error_msg.lower() or
-                "too slow" in error_msg.lower() or
-                "connection" in error_msg.lower() or
-                "network" in error_msg.lower()
-            )
+                    await safe_edit(status_message, get_text("cancelled"), buttons=None, parse_mode=PARSE_MODE)
+                # Limpiar archivo temporal (y manifiesto) si existe
+                if manifest:
+                    manifest.remove(with_data=True)
+                    _release_resume_manifest(manifest)
+                if os.path.exists(temp_file_path):
+                    os.remove(temp_file_path)
+                    debug(f"[DOWNLOAD] Temporary file deleted after cancellation: {temp_file_path}")
+                # Limpiar archivo final si se movió
+                if os.path.exists(final_file_path):
+                    os.remove(final_file_path)
+                    debug(f"[DOWNLOAD] Final file deleted after cancellation: {final_file_path}")
+                debug(f"[DOWNLOAD] File {file_name} - Cancelled")
+                raise
 
-            debug(f"[DOWNLOAD] should_retry={should_retry} for error type {error_type}")
+            except asyncio.TimeoutError:
+                # Timeout específico de asyncio.wait_for
+                error(f"[DOWNLOAD] Download timeout after {int(download_timeout)}s for {file_name}")
 
-            if should_retry:
-                # Eliminar archivo parcialmente descargado (temporal)
-                if os.path.exists(temp_file_path):
+                # Eliminar archivo parcialmente descargado (temporal), salvo que sea
+                # reanudable: el siguiente intento continuará desde las partes hechas
+                if manifest:
+                    debug(f"[DOWNLOAD] Keeping partial file for resume: {manifest.completed_parts()}/{manifest.part_count} parts")
+                elif os.path.exists(temp_file_path):
                     try:
                         os.remove(temp_file_path)
-                        debug(f"[DOWNLOAD] Partial temp file deleted after error: {temp_file_path}")
+                        debug(f"[DOWNLOAD] Partial temp file deleted after timeout: {temp_file_path}")
                     except Exception as cleanup_error:
                         warning(f"[DOWNLOAD] Error deleting {temp_file_path}: {cleanup_error}")
 
                 # Si aún quedan intentos, reintentar
                 if attempt < MAX_DOWNLOAD_RETRIES:
-                    debug(f"[DOWNLOAD] Retrying download of {file_name} (attempt {attempt + 1} of {MAX_DOWNLOAD_RETRIES}) after error: {error_msg}")
+                    debug(f"[DOWNLOAD] Retrying download of {file_name} (attempt {attempt + 1} of {MAX_DOWNLOAD_RETRIES}) after timeout")
                     if status_message:
                         try:
                             await safe_edit(
@@ -833,7 +1023,7 @@ async def download_media(event):
                     await asyncio.sleep(RETRY_DELAY_SECONDS)
                 else:
                     # Último intento fallido
-                    error(f"[DOWNLOAD] Telegram timeout while downloading {file_name}: {error_msg}")
+                    error(f"[DOWNLOAD] Download failed after {MAX_DOWNLOAD_RETRIES} attempts due to timeout")
                     if status_message:
                         try:
                             await safe_edit(
@@ -844,15 +1034,84 @@ async def download_media(event):
                             )
                         except Exception as msg_error:
                             error(f"[DOWNLOAD] Error updating status message: {msg_error}")
-            else:
-                # Error que NO debe reintentar - loguear y re-lanzar
-                error(f"[DOWNLOAD] ❌ Non-retryable error, re-raising: {error_type} - {error_msg}")
-                raise
+
+            except Exception as e:
+                error_msg = str(e)
+                error_type = type(e).__name__
+
+                # Loguear SIEMPRE el error antes de decidir qué hacer
+                error(f"[DOWNLOAD] ❌ Exception caught in download loop: {error_type} - {error_msg}")
+                import traceback
+                error(f"[DOWNLOAD] Traceback: {traceback.format_exc()}")
+
+                # Errores que deben reintentar: TimeoutError, ValueError, errores de red, errores internos de Telegram
+                should_retry = (
+                    isinstance(e, (TimeoutError, ValueError)) or
+                    "timeout" in error_msg.lower() or
+                    "unsuccessful" in error_msg.lower() or
+                    "internal" in error_msg.lower() or
+                    "getfilerequest" in error_msg.lower() or
+                    "too slow" in error_msg.lower() or
+                    "connection" in error_msg.lower() or
+                    "network" in error_msg.lower()
+                )
+
+                debug(f"[DOWNLOAD] should_retry={should_retry} for error type {error_type}")
+
+                if should_retry:
+                    # Eliminar archivo parcialmente descargado (temporal), salvo que sea reanudable
+                    if manifest:
+                        debug(f"[DOWNLOAD] Keeping partial file for resume: {manifest.completed_parts()}/{manifest.part_count} parts")
+                    elif os.path.exists(temp_file_path):
+                        try:
+                            os.remove(temp_file_path)
+                            debug(f"[DOWNLOAD] Partial temp file deleted after error: {temp_file_path}")
+                        except Exception as cleanup_error:
+                            warning(f"[DOWNLOAD] Error deleting {temp_file_path}: {cleanup_error}")
+
+                    # Si aún quedan intentos, reintentar
+                    if attempt < MAX_DOWNLOAD_RETRIES:
+                        debug(f"[DOWNLOAD] Retrying download of {file_name} (attempt {attempt + 1} of {MAX_DOWNLOAD_RETRIES}) after error: {error_msg}")
+                        if status_message:
+                            try:
+                                await safe_edit(
+                                    status_message,
+                                    get_text("warning_retrying_download", attempt + 1, MAX_DOWNLOAD_RETRIES),
+                                    buttons=[Button.inline(get_text("button_cancel"), data=f"cancel:{event.id}")],
+                                    parse_mode=PARSE_MODE
+                                )
+                            except Exception as msg_error:
+                                error(f"[DOWNLOAD] Error updating status message: {msg_error}")
+
+                        # Esperar antes de reintentar
+                        await asyncio.sleep(RETRY_DELAY_SECONDS)
+                    else:
+                        # Último intento fallido
+                        error(f"[DOWNLOAD] Telegram timeout while downloading {file_name}: {error_msg}")
+                        if status_message:
+                            try:
+                                await safe_edit(
+                                    status_message,
+                                    get_text("error_telegram_timeout_user", file_name),
+                                    buttons=None,
+                                    parse_mode=PARSE_MODE
+                                )
+                            except Exception as msg_error:
+                                error(f"[DOWNLOAD] Error updating status message: {msg_error}")
+                else:
+                    # Error que NO debe reintentar - loguear y re-lanzar
+                    error(f"[DOWNLOAD] ❌ Non-retryable error, re-raising: {error_type} - {error_msg}")
+                    _release_resume_manifest(manifest)
+                    raise
+    finally:
+        # El progreso no debe seguir pintándose acabe como acabe la descarga
+        await stop_transfer_progress(progress_callback)
 
     # Si llegamos aquí, el bucle terminó sin break (todos los intentos fallaron)
     debug(f"[DOWNLOAD] Exited retry loop for {file_name}")
 
     # Limpiar tareas activas
+    _release_resume_manifest(manifest)
     active_tasks.pop(event.id, None)
     debug(f"[DOWNLOAD] Cleaned up active task for event.id={event.id}")
 
@@ -1027,8 +1286,8 @@ async def handle_start(event):
     # Borrar el comando del usuario para mantener el chat limpio
     try:
         await event.delete()
-    except:
-        pass
+    except Exception as e:
+        flood_control.record_error("delete", event.chat_id, e)
 
     if not is_admin(event.sender_id):
         debug(f"[AUTH] User {event.sender_id} is not an admin and tried to use the bot")
@@ -1058,8 +1317,8 @@ async def handle_start(event):
         # Borrar el comando del usuario
         try:
             await event.delete()
-        except:
-            pass
+        except Exception as e:
+            flood_control.record_error("delete", event.chat_id, e)
 
         # Mostrar menú de categorías para gestionar
         # Crear botones de categorías pero con callback "managecat:" en lugar de "listcat:"
@@ -1148,7 +1407,7 @@ async def cancel_download(event):
             if moved_count > 0:
                 has_partial_playlist = True
                 partial_count = moved_count
-                partial_total = total_videos
+                partial_total = total_videos or "?"  # Desconocido si el sondeo se cortó
                 debug(f"[CANCEL] Successfully moved {moved_count} files before cancelling")
         else:
             debug(f"[CANCEL] No completed files found to move")
@@ -1157,7 +1416,7 @@ async def cancel_download(event):
         playlist_downloads.pop(msg_id, None)
 
     # Terminar el proceso
-    if isinstance(task, asyncio.subprocess.Process):
+    if isinstance(task, (asyncio.subprocess.Process, ytdlp_service.YtdlpJob)):
         task.terminate()
         await safe_answer(event, get_text("cancelling"))
     elif isinstance(task, asyncio.Task) and not task.done():
@@ -1180,12 +1439,14 @@ async def cancel_download(event):
 async def is_direct_download_url(url):
     """
     Detecta si una URL es un enlace directo a un archivo descargable.
-    Retorna (is_direct, filename, content_type, download_path, icon) donde:
+    Retorna (is_direct, filename, content_type, download_path, icon, definitive) donde:
     - is_direct: True si es descarga directa
     - filename: Nombre del archivo extraído de la URL
     - content_type: Tipo de contenido detectado
     - download_path: Ruta de descarga según el tipo
     - icon: Icono según el tipo de archivo
+    - definitive: True si la respuesta no depende de un fallo pasajero (se
+      reconoció la extensión o el servidor respondió a la petición HEAD)
     """
     try:
         # Combinar todas las extensiones conocidas
@@ -1236,11 +1497,14 @@ async def is_direct_download_url(url):
                     icon = DEF_ICO
 
                 debug(f"[DIRECT_DOWNLOAD] Detected direct download: {filename} (type: {content_type}) -> {download_path}")
-                return True, filename, content_type, download_path, icon
+                return True, filename, content_type, download_path, icon, True
 
         # Si no es directo, intentar HEAD request para verificar Content-Type
+        definitive = False
         try:
             response = requests.head(url, allow_redirects=True, timeout=5)
+            # Un 5xx o un 429 pueden cambiar en el siguiente intento
+            definitive = response.status_code < 500 and response.status_code != 429
             content_type_header = response.headers.get('Content-Type', '').lower()
             content_disposition = response.headers.get('Content-Disposition', '')
 
@@ -1277,15 +1541,15 @@ async def is_direct_download_url(url):
                     icon = DEF_ICO
 
                 debug(f"[DIRECT_DOWNLOAD] Detected via headers: {filename} (type: {content_type}) -> {download_path}")
-                return True, filename, content_type, download_path, icon
+                return True, filename, content_type, download_path, icon, True
         except:
             pass
 
-        return False, None, None, None, None
+        return False, None, None, None, None, definitive
 
     except Exception as e:
         debug(f"[DIRECT_DOWNLOAD] Error detecting direct download: {e}")
-        return False, None, None, None, None
+        return False, None, None, None, None, False
 
 def calculate_ytdlp_sleep_interval(playlist_count):
     """
@@ -1336,52 +1600,104 @@ def add_ytdlp_cookies(cmd):
 
     return cmd
 
-async def detect_playlist(url):
-    """Detecta si una URL es una playlist y retorna (is_playlist, playlist_count, playlist_title)"""
+def _content_type_of(data):
+    """Tipo de contenido ("video", "audio", "image" o "unknown") de un JSON de yt-dlp"""
+    vcodec = data.get("vcodec")
+    acodec = data.get("acodec")
+    ext = (data.get("ext") or "").lower()
+
+    debug(f"[YT-DLP] Content type detected - vcodec: {vcodec}, acodec: {acodec}, ext: {ext}")
+
+    if vcodec and vcodec != "none":
+        return "video"  # Tiene video
+    elif acodec and acodec != "none":
+        return "audio"  # Solo audio
+    elif ext in ["jpg", "jpeg", "png", "gif", "webp", "bmp"]:
+        return "image"  # Solo imagen
+    return "unknown"
+
+async def probe_url(url):
+    """
+    Sondea una URL con una sola ejecución de yt-dlp (--flat-playlist --dump-json),
+    leyendo las entradas a medida que llegan en lugar de esperar a todas.
+
+    - Vídeo suelto: la primera (y única) línea es su extracción completa, de la
+      que sale el tipo de contenido.
+    - Playlist: la primera entrada ya trae título y, casi siempre, el número de
+      entradas (playlist_count); en ese caso se corta el proceso ahí. Si no lo
+      trae, se cuentan líneas hasta el final o hasta PROBE_MAX_ENTRIES (y
+      entonces playlist_truncated indica que hay más).
+
+    Retorna {"is_playlist", "playlist_count", "playlist_truncated", "playlist_title", "content_type"}.
+    """
+    result = {"is_playlist": False, "playlist_count": 1, "playlist_truncated": False, "playlist_title": None, "content_type": "unknown"}
     try:
         cmd = ["yt-dlp", "--flat-playlist", "--dump-json", "--no-warnings", url]
         cmd = add_ytdlp_cookies(cmd)
 
-        proc = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
+        proc = await ytdlp_service.run(cmd[1:])
+        stderr_task = asyncio.create_task(proc.stderr.read())
 
-        stdout, stderr = await proc.communicate()
+        first_item = None
+        count = 0
+        stopped = False
+        truncated = False
+        async for line in proc.stdout:
+            if not line.strip():
+                continue
+            count += 1
+            if first_item is None:
+                first_item = json.loads(line)
+                if first_item.get("_type") not in ("url", "url_transparent"):
+                    break  # Extracción completa de un vídeo suelto
+                announced = first_item.get("playlist_count")
+                if isinstance(announced, int) and announced > 0:
+                    count = announced
+                    stopped = True
+                    break
+            if count >= PROBE_MAX_ENTRIES:
+                debug(f"[YT-DLP] Probe stopped after {count} playlist entries")
+                stopped = True
+                truncated = True
+                break
+
+        if stopped:
+            proc.terminate()  # Ya tenemos lo necesario: no enumerar el resto
+        await proc.wait()
 
         # Mostrar stderr si hay contenido
-        stderr_output = stderr.decode().strip()
-        if stderr_output:
+        stderr_output = (await stderr_task).decode().strip()
+        if stderr_output and not stopped:
             for line in stderr_output.splitlines():
-                debug(f"[YT-DLP] Playlist detect stderr: {line}")
-
-        if proc.returncode == 0:
-            lines = stdout.decode().splitlines()
-
-            if len(lines) > 1:
-                # Múltiples líneas JSON = playlist
-                debug(f"[YT-DLP] Playlist detected with {len(lines)} items")
-
-                # Intentar obtener el título de la playlist del primer item
-                try:
-                    first_item = json.loads(lines[0])
-                    playlist_title = first_item.get("playlist_title", first_item.get("playlist", "Playlist"))
-                except:
-                    playlist_title = "Playlist"
-
-                return True, len(lines), playlist_title
-            elif len(lines) == 1:
-                # Una sola línea = video individual
-                debug(f"[YT-DLP] Single video detected")
-                return False, 1, None
-        else:
-            warning(f"[YT-DLP] Playlist detect failed with code {proc.returncode}")
+                debug(f"[YT-DLP] Probe stderr: {line}")
+
+        if first_item is None:
+            warning(f"[YT-DLP] Probe: no JSON received (code {proc.returncode})")
+            return result
+
+        if first_item.get("_type") not in ("url", "url_transparent"):
+            debug(f"[YT-DLP] Single video detected")
+            result["content_type"] = _content_type_of(first_item)
+            return result
+
+        if count > 1:
+            debug(f"[YT-DLP] Playlist detected with {count} items")
+            result.update(
+                is_playlist=True,
+                playlist_count=count,
+                playlist_truncated=truncated,
+                playlist_title=first_item.get("playlist_title", first_item.get("playlist", "Playlist")) or "Playlist"
+            )
+            return result
 
-        return False, 1, None
+        # Playlist de una sola entrada: se trata como vídeo suelto, pero la
+        # entrada plana no trae formatos y hay que extraerla
+        debug(f"[YT-DLP] Single-entry playlist, probing its content type")
+        result["content_type"] = await detect_content_type(url)
+        return result
     except Exception as e:
-        error(f"[YT-DLP] Error detecting playlist: {e}")
-        return False, 1, None
+        error(f"[YT-DLP] Error probing URL: {e}")
+        return result
 
 async def detect_content_type(url):
     """Detecta el tipo de contenido sin descargarlo usando yt-dlp --dump-json"""
@@ -1389,11 +1705,7 @@ async def detect_content_type(url):
         cmd = ["yt-dlp", "--dump-json", "--no-warnings", "--skip-download", "--playlist-items", "1", url]
         cmd = add_ytdlp_cookies(cmd)
 
-        proc = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
+        proc = await ytdlp_service.run(cmd[1:])
 
         stdout, stderr = await proc.communicate()
 
@@ -1408,20 +1720,7 @@ async def detect_content_type(url):
 
             # Analizar primer item para detectar tipo
             if lines:
-                data = json.loads(lines[0])
-                vcodec = data.get("vcodec")
-                acodec = data.get("acodec")
-                ext = data.get("ext", "").lower()
-
-                debug(f"[YT-DLP] Content type detected - vcodec: {vcodec}, acodec: {acodec}, ext: {ext}")
-
-                # Detectar tipo de contenido
-                if vcodec and vcodec != "none":
-                    return "video"  # Tiene video
-                elif acodec and acodec != "none":
-                    return "audio"  # Solo audio
-                elif ext in ["jpg", "jpeg", "png", "gif", "webp", "bmp"]:
-                    return "image"  # Solo imagen
+                return _content_type_of(json.loads(lines[0]))
             else:
                 warning("[YT-DLP] Detect: No JSON received in stdout")
         else:
@@ -1449,8 +1748,14 @@ async def handle_url_link(event):
     if analyzing_msg is None:
         analyzing_msg = await safe_reply(event, get_text("analyzing_url"), wait_for_result=False, parse_mode=PARSE_MODE)
 
-    # Primero detectar si es descarga directa
-    is_direct, filename, direct_type, download_path, icon = await is_direct_download_url(url)
+    # Primero detectar si es descarga directa (salvo que este enlace ya se haya visto)
+    direct_info = url_cache_service.get("direct", url)
+    if direct_info is None:
+        *direct_info, definitive = await is_direct_download_url(url)
+        if definitive:
+            # Un fallo de red en la petición HEAD no se recuerda
+            url_cache_service.put("direct", url, direct_info)
+    is_direct, filename, direct_type, download_path, icon = direct_info
 
     if is_direct:
         # Es descarga directa - descargar inmediatamente
@@ -1480,13 +1785,21 @@ async def handle_url_link(event):
         active_tasks[event.id] = task
         return
 
-    # No es descarga directa - detectar si es playlist
-    is_playlist, playlist_count, playlist_title = await detect_playlist(url)
+    # No es descarga directa - un único sondeo dice si es playlist y, si no, el tipo de contenido.
+    # El resultado queda en pending_urls para que los botones no vuelvan a sondear
+    probe = url_cache_service.get("probe", url)
+    if probe is None:
+        probe = await probe_url(url)
+        if probe["is_playlist"] or probe["content_type"] != "unknown":
+            # Un sondeo fallido puede ser algo pasajero: no se guarda
+            url_cache_service.put("probe", url, probe)
+    pending_urls[url_id].update(probe)
+    is_playlist = probe["is_playlist"]
+    playlist_count = probe["playlist_count"]
+    playlist_title = probe["playlist_title"]
 
     if is_playlist:
         debug(f"[PLAYLIST] Detected playlist with {playlist_count} videos: {playlist_title}")
-        # Almacenar el playlist_count para usarlo después
-        pending_urls[url_id]["playlist_count"] = playlist_count
 
         # Preguntar al usuario si quiere descargar toda la playlist o solo el primero
         buttons = [
@@ -1495,7 +1808,9 @@ async def handle_url_link(event):
             [Button.inline(get_text("button_cancel"), data=f"simplecancel:{url_id}")]
         ]
 
-        message = get_text("playlist_detected", playlist_title, playlist_count)
+        # Sondeo cortado en PROBE_MAX_ENTRIES: el total real es mayor
+        shown_count = f"{playlist_count}+" if probe["playlist_truncated"] else playlist_count
+        message = get_text("playlist_detected", playlist_title, shown_count)
 
         if analyzing_msg:
             await safe_edit(analyzing_msg, message, buttons=buttons, parse_mode=PARSE_MODE)
@@ -1503,8 +1818,8 @@ async def handle_url_link(event):
             await safe_reply(event, message, buttons=buttons, parse_mode=PARSE_MODE)
         return
 
-    # No es descarga directa ni playlist - usar yt-dlp para detectar tipo de contenido
-    content_type = await detect_content_type(url)
+    # No es descarga directa ni playlist - tipo de contenido del sondeo
+    content_type = probe["content_type"]
 
     # Si AUTO_DOWNLOAD_FORMAT está configurado, descargar automáticamente sin preguntar
     if AUTO_DOWNLOAD_FORMAT in ["VIDEO", "AUDIO"]:
@@ -1854,8 +2169,8 @@ async def handle_playlist_selection(event):
         if is_audio:
             cmd.extend(["--extract-audio", "--audio-format", "mp3"])
 
-        # Pasar el número total de vídeos solo si es playlist completa
-        total_vids = playlist_count if download_full_playlist else 1
+        # Pasar el número total de vídeos solo si es playlist completa (y se conoce)
+        total_vids = (None if url_data.get("playlist_truncated") else playlist_count) if download_full_playlist else 1
         task = asyncio.create_task(run_url_download(event, cmd, status_message, final_output_dir, is_full_playlist=download_full_playlist, total_videos=total_vids))
         active_tasks[event.id] = task
         return
@@ -1950,8 +2265,8 @@ async def handle_playlist_format_selection(event):
     if is_audio:
         cmd.extend(["--extract-audio", "--audio-format", "mp3"])
 
-    # Pasar el número total de vídeos solo si es playlist completa
-    total_vids = playlist_count if download_full_playlist else 1
+    # Pasar el número total de vídeos solo si es playlist completa (y se conoce)
+    total_vids = (None if url_data.get("playlist_truncated") else playlist_count) if download_full_playlist else 1
     task = asyncio.create_task(run_url_download(event, cmd, status_message, final_output_dir, is_full_playlist=download_full_playlist, total_videos=total_vids))
     active_tasks[event.id] = task
 
@@ -2048,63 +2363,63 @@ def parse_progress(line):
         warning(f"[URL_DOWNLOAD] Error parsing progress: {e}")
     return None
 
-async def update_progress_message(status_message, progress_info, event, file_name=None, playlist_info=None):
-    """Actualiza el mensaje de Telegram con el progreso de descarga
+def render_url_progress(progress_info, file_name=None, playlist_info=None):
+    """Texto de progreso de una descarga de URL (yt-dlp o wget)
 
     Args:
-        status_message: Mensaje de Telegram a actualizar
         progress_info: Diccionario con percent, size, speed, eta
-        event: Evento de Telegram
         file_name: Nombre del archivo actual (opcional)
         playlist_info: Diccionario con {"current": int, "total": int} para playlists (opcional)
     """
-    # Si no hay mensaje de estado, no hacer nada
+    percent = progress_info["percent"]
+    size = progress_info["size"]
+    speed = progress_info["speed"]
+    eta = progress_info["eta"]
+
+    # Crear barra de progreso visual del vídeo actual
+    bar_length = 20
+    filled = int(bar_length * float(percent) / 100)
+    bar = "█" * filled + "░" * (bar_length - filled)
+
+    # Si no hay nombre de archivo, intentar extraerlo del progreso o usar placeholder
+    if not file_name:
+        file_name = progress_info.get("filename", "...")
+
+    # Si es una playlist, añadir información de progreso de la playlist
+    if playlist_info:
+        current = playlist_info["current"]
+        total = playlist_info["total"]
+        # Calcular progreso global de la playlist
+        playlist_percent = ((current - 1) / total * 100) + (float(percent) / total)
+        return get_text("downloading_progress_playlist",
+                        bar, percent, size, speed, eta, file_name,
+                        current, total, f"{playlist_percent:.1f}")
+    return get_text("downloading_progress", bar, percent, size, speed, eta, file_name)
+
+def _url_progress_job(status_message, event):
+    """Trabajo de progress_service para el mensaje de estado de una descarga de URL"""
     if status_message is None:
-        return
+        return None
+    return progress_service.Job(
+        status_message,
+        lambda counters: render_url_progress(counters["progress_info"], counters["file_name"], counters["playlist_info"]),
+        buttons=[Button.inline(get_text("button_cancel"), data=f"cancel:{event.id}")]
+    )
 
+def _publish_url_progress(job, progress_info, file_name, playlist_info=None):
+    """Publica el progreso de una descarga de URL (el repintado lo decide progress_service)"""
+    if job is None:
+        return
     try:
-        percent = progress_info["percent"]
-        size = progress_info["size"]
-        speed = progress_info["speed"]
-        eta = progress_info["eta"]
-
-        # Crear barra de progreso visual del vídeo actual
-        bar_length = 20
-        filled = int(bar_length * float(percent) / 100)
-        bar = "█" * filled + "░" * (bar_length - filled)
-
-        # Si no hay nombre de archivo, intentar extraerlo del progreso o usar placeholder
-        if not file_name:
-            file_name = progress_info.get("filename", "...")
-
-        # Si es una playlist, añadir información de progreso de la playlist
-        if playlist_info:
-            current = playlist_info["current"]
-            total = playlist_info["total"]
-            # Calcular progreso global de la playlist
-            playlist_percent = ((current - 1) / total * 100) + (float(percent) / total)
-            message = get_text("downloading_progress_playlist",
-                             bar, percent, size, speed, eta, file_name,
-                             current, total, f"{playlist_percent:.1f}")
-        else:
-            message = get_text("downloading_progress", bar, percent, size, speed, eta, file_name)
-
-        # Usar edición directa sin cola para actualizaciones de progreso (más rápido)
-        try:
-            await status_message.edit(
-                message,
-                buttons=[Button.inline(get_text("button_cancel"), data=f"cancel:{event.id}")],
-                parse_mode=PARSE_MODE
-            )
-        except Exception as edit_error:
-            # Ignorar errores de edición (FloodWaitError, mensaje no modificado, etc.)
-            warning(f"[URL_DOWNLOAD] Error editing progress message: {edit_error}")
-    except Exception as e:
-        # Ignorar errores de actualización (puede ser FloodWaitError)
-        warning(f"[URL_DOWNLOAD] Error updating progress: {e}")
+        percent = float(progress_info["percent"])
+    except (TypeError, ValueError):
+        percent = None
+    job.update(progress_info=progress_info, file_name=file_name, playlist_info=playlist_info,
+               name=file_name or progress_info.get("filename", "..."), percent=percent)
 
 async def run_direct_download(event, url, filename, status_message, final_output_dir, icon, content_type):
     """Descarga un archivo directo usando wget"""
+    progress_job = None
     try:
         debug(f"[DIRECT_DOWNLOAD] Starting direct download: {filename}")
         debug(f"[DIRECT_DOWNLOAD] Final output directory: {final_output_dir}")
@@ -2133,9 +2448,8 @@ async def run_direct_download(event, url, filename, status_message, final_output
         )
         active_tasks[event.id] = proc
 
-        # Variables para control de progreso
-        last_update_time = 0
-        update_interval = PROGRESS_UPDATE_INTERVAL
+        # Progreso: se publica en cada línea y progress_service decide cuándo repintar
+        progress_job = _url_progress_job(status_message, event)
 
         # Leer stderr (wget muestra progreso en stderr)
         async def read_stderr():
@@ -2146,39 +2460,29 @@ async def run_direct_download(event, url, filename, status_message, final_output
 
                 # Parsear progreso de wget
                 # Formato: 45% [=====>     ] 123.45M  1.23MB/s    eta 30s
-                if '%' in line_str and status_message:
-                    nonlocal last_update_time
-                    current_time = time.time()
-
-                    # Detectar si llegamos al 100%
-                    percent_match_check = re.search(r'(\d+)%', line_str)
-                    is_complete = percent_match_check and int(percent_match_check.group(1)) >= 100
-                    should_update = (current_time - last_update_time >= update_interval) or is_complete
-
-                    if should_update:
-                        try:
-                            # Extraer porcentaje
-                            percent_match = re.search(r'(\d+)%', line_str)
-                            # Extraer tamaño descargado
-                            size_match = re.search(r'\]\s+([\d\.]+[KMG]?)', line_str)
-                            # Extraer velocidad
-                            speed_match = re.search(r'([\d\.]+[KMG]?B/s)', line_str)
-                            # Extraer ETA
-                            eta_match = re.search(r'eta\s+([\dhms]+)', line_str)
-
-                            if percent_match:
-                                progress_info = {
-                                    "percent": percent_match.group(1),
-                                    "size": size_match.group(1) if size_match else "N/A",
-                                    "speed": speed_match.group(1) if speed_match else "N/A",
-                                    "eta": eta_match.group(1) if eta_match else "N/A",
-                                    "filename": filename
-                                }
-
-                                await update_progress_message(status_message, progress_info, event, filename)
-                                last_update_time = current_time
-                        except Exception as e:
-                            debug(f"[DIRECT_DOWNLOAD] Error parsing wget progress: {e}")
+                if '%' in line_str and progress_job:
+                    try:
+                        # Extraer porcentaje
+                        percent_match = re.search(r'(\d+)%', line_str)
+                        # Extraer tamaño descargado
+                        size_match = re.search(r'\]\s+([\d\.]+[KMG]?)', line_str)
+                        # Extraer velocidad
+                        speed_match = re.search(r'([\d\.]+[KMG]?B/s)', line_str)
+                        # Extraer ETA
+                        eta_match = re.search(r'eta\s+([\dhms]+)', line_str)
+
+                        if percent_match:
+                            progress_info = {
+                                "percent": percent_match.group(1),
+                                "size": size_match.group(1) if size_match else "N/A",
+                                "speed": speed_match.group(1) if speed_match else "N/A",
+                                "eta": eta_match.group(1) if eta_match else "N/A",
+                                "filename": filename
+                            }
+
+                            _publish_url_progress(progress_job, progress_info, filename)
+                    except Exception as e:
+                        debug(f"[DIRECT_DOWNLOAD] Error parsing wget progress: {e}")
 
                 if line_str:
                     debug(f"[WGET] {line_str}")
@@ -2199,6 +2503,7 @@ async def run_direct_download(event, url, filename, status_message, final_output
         await stderr_task
         await stdout_task
         await proc.wait()
+        await progress_service.stop(progress_job)
 
         debug(f"[DIRECT_DOWNLOAD] Process finished with code {proc.returncode}")
 
@@ -2243,6 +2548,7 @@ async def run_direct_download(event, url, filename, status_message, final_output
                 os.remove(temp_file_path)
 
     except asyncio.CancelledError:
+        await progress_service.stop(progress_job)
         await handle_cancel(status_message)
         # Limpiar archivo temporal
         if os.path.exists(temp_file_path):
@@ -2250,6 +2556,7 @@ async def run_direct_download(event, url, filename, status_message, final_output
         raise
     except Exception as e:
         # Eliminar mensaje de progreso antes de mostrar error
+        await progress_service.stop(progress_job)
         if status_message:
             await safe_delete(status_message)
 
@@ -2266,16 +2573,14 @@ async def run_direct_download(event, url, filename, status_message, final_output
         active_tasks.pop(event.id, None)
 
 async def run_url_download(event, cmd, status_message, final_output_dir, is_full_playlist=False, total_videos=None):
+    progress_job = None
     try:
         debug("[URL_DOWNLOAD] Creating URL download subprocess...")
         debug(f"[URL_DOWNLOAD] Final output directory: {final_output_dir}")
         debug(f"[URL_DOWNLOAD] Is full playlist: {is_full_playlist}")
         debug(f"[URL_DOWNLOAD] Total videos in playlist: {total_videos}")
-        proc = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
+        # En un worker ya inicializado del pool (o con el CLI si no hay pool)
+        proc = await ytdlp_service.run(cmd[1:])
         active_tasks[event.id] = proc
 
         # Registrar información de playlist si es necesario
@@ -2289,17 +2594,17 @@ async def run_url_download(event, cmd, status_message, final_output_dir, is_full
             }
             debug(f"[URL_DOWNLOAD] Playlist download registered with ID {event.id}")
 
-        # Variables para control de progreso
+        # Variables para control de progreso (se publica en cada línea y
+        # progress_service decide cuándo repintar)
         stdout_lines = []
-        last_update_time = 0
-        update_interval = PROGRESS_UPDATE_INTERVAL  # Intervalo dinámico basado en PARALLEL_DOWNLOADS
+        progress_job = _url_progress_job(status_message, event)
         current_filename = None  # Almacenar el nombre del archivo actual (solo nombre, no path completo)
         current_filepath = None  # Almacenar el path completo del archivo actual
         current_video_index = None  # Índice del vídeo actual en la playlist
 
         # Leer stdout línea por línea en tiempo real
         async def read_stdout():
-            nonlocal last_update_time, current_filename, current_filepath, current_video_index
+            nonlocal current_filename, current_filepath, current_video_index
             async for line in proc.stdout:
                 line_str = line.decode().strip()
                 stdout_lines.append(line_str)
@@ -2335,27 +2640,15 @@ async def run_url_download(event, cmd, status_message, final_output_dir, is_full
 
                 # Detectar líneas de progreso: [download]  45.2% of 123.45MiB at 1.23MiB/s ETA 00:30
                 if "[download]" in line_str and "%" in line_str:
-                    current_time = asyncio.get_running_loop().time()
-                    time_diff = current_time - last_update_time
-                    debug(f"[URL_DOWNLOAD] Progress detected. Time since last update: {time_diff:.2f}s (interval: {update_interval}s)")
-
-                    # Detectar si llegamos al 100%
-                    is_complete = "[download] 100%" in line_str
-                    should_update = (time_diff >= update_interval) or is_complete
-
-                    if should_update:
-                        last_update_time = current_time
-                        # Parsear y actualizar mensaje
-                        progress_info = parse_progress(line_str)
-                        if progress_info:
-                            debug(f"[URL_DOWNLOAD] Updating progress message: {progress_info}")
-                            # Pasar información de playlist si está disponible
-                            playlist_info = None
-                            if is_full_playlist and current_video_index and total_videos:
-                                playlist_info = {"current": current_video_index, "total": total_videos}
-                            await update_progress_message(status_message, progress_info, event, current_filename, playlist_info)
-                        else:
-                            debug(f"[URL_DOWNLOAD] Could not parse progress from: {line_str}")
+                    progress_info = parse_progress(line_str)
+                    if progress_info:
+                        # Pasar información de playlist si está disponible
+                        playlist_info = None
+                        if is_full_playlist and current_video_index and total_videos:
+                            playlist_info = {"current": current_video_index, "total": total_videos}
+                        _publish_url_progress(progress_job, progress_info, current_filename, playlist_info)
+                    else:
+                        debug(f"[URL_DOWNLOAD] Could not parse progress from: {line_str}")
 
         # Leer stderr en paralelo
         async def read_stderr():
@@ -2374,6 +2667,7 @@ async def run_url_download(event, cmd, status_message, final_output_dir, is_full
 
         # Esperar a que termine el proceso
         await proc.wait()
+        await progress_service.stop(progress_job)
         debug(f"[URL_DOWNLOAD] Exiting URL download subprocess. Code {proc.returncode}")
 
         if proc.returncode == -15:
@@ -2466,6 +2760,7 @@ async def run_url_download(event, cmd, status_message, final_output_dir, is_full
 
     except asyncio.CancelledError:
         # No limpiar playlist_downloads aquí si fue cancelada - se limpia en handle_playlist_cancel_confirmation
+        await progress_service.stop(progress_job)
         await handle_cancel(status_message)
         raise
     except Exception as e:
@@ -2473,6 +2768,7 @@ async def run_url_download(event, cmd, status_message, final_output_dir, is_full
         error(f"[URL_DOWNLOAD] Exception type: {type(e).__name__}")
         import traceback
         error(f"[URL_DOWNLOAD] Traceback: {traceback.format_exc()}")
+        await progress_service.stop(progress_job)
         # Intentar notificar al usuario
         try:
             if status_message:
@@ -2656,12 +2952,25 @@ async def get_file_info(file_path):
             "type": "document"
         }
 
+def is_telegram_compatible_video(file_path, file_info):
+    """
+    Indica si el video ya está en el formato al que lo convertiría
+    convert_video_to_telegram_compatible (MP4 con H.264 y AAC o sin audio),
+    según la información de get_file_info.
+    """
+    return (
+        os.path.splitext(file_path)[1].lower() == ".mp4"
+        and file_info.get("codec_video") == "H264"
+        and file_info.get("codec_audio") in (None, "AAC")
+    )
+
 async def convert_video_to_telegram_compatible(input_path, status_message=None):
     """
     Convierte un video a formato compatible con Telegram (MP4 con H.264 + AAC).
     Retorna la ruta del archivo convertido (temporal en /tmp) o el original si falla.
     IMPORTANTE: El archivo convertido debe ser eliminado después de enviarlo.
     """
+    progress_job = None
     try:
         debug(f"[CONVERSION] Starting video conversion: {input_path}")
 
@@ -2708,11 +3017,13 @@ async def convert_video_to_telegram_compatible(input_path, status_message=None):
                 msg = get_text("converting_video_progress")
 
             debug(f"[CONVERSION] Updating status message with cancel button" + (" and send original button" if is_long_video else ""))
+            # Esperar a que salga: el progreso posterior no pasa por la cola
             await safe_edit(
                 status_message,
                 msg,
                 buttons=buttons,
-                parse_mode=PARSE_MODE
+                parse_mode=PARSE_MODE,
+                wait_for_result=True
             )
 
         cmd = [
@@ -2740,8 +3051,25 @@ async def convert_video_to_telegram_compatible(input_path, status_message=None):
         active_tasks[conversion_id] = proc
         debug(f"[CONVERSION] Process saved in active_tasks with ID: {conversion_id}")
 
-        # Leer progreso en tiempo real
-        last_update = 0
+        # Leer progreso en tiempo real: se publica cada línea y progress_service
+        # decide cuándo repintar el mensaje de estado
+        def render_conversion(counters):
+            percentage = counters["percent"]
+            time_seconds = counters["time_seconds"]
+
+            # Crear barra de progreso
+            bar_length = 20
+            filled = int(bar_length * percentage / 100)
+            bar = "█" * filled + "░" * (bar_length - filled)
+
+            # Usar mensaje específico para videos largos con advertencia
+            if is_long_video:
+                duration_minutes = int(duration_seconds / 60)
+                return get_text("converting_video_long_progress_bar", duration_minutes, bar, percentage, int(time_seconds), int(duration_seconds))
+            return get_text("converting_video_progress_bar", bar, percentage, int(time_seconds), int(duration_seconds))
+
+        progress_job = progress_service.Job(status_message, render_conversion, buttons=buttons) if status_message else None
+        last_logged = 0
         debug(f"[CONVERSION] Starting progress reading...")
         while True:
             # Verificar si la conversión fue cancelada o si se solicitó enviar original
@@ -2752,6 +3080,9 @@ async def convert_video_to_telegram_compatible(input_path, status_message=None):
             line = await proc.stdout.readline()
             if not line:
                 break
+            # Cancelada mientras se leía: no volver a pintar progreso sobre su mensaje
+            if conversion_id in cancelled_conversions or conversion_id in send_original_requests:
+                continue
 
             line = line.decode().strip()
 
@@ -2762,52 +3093,18 @@ async def convert_video_to_telegram_compatible(input_path, status_message=None):
                     time_seconds = time_ms / 1000000  # Convertir microsegundos a segundos
 
                     # Calcular porcentaje si conocemos la duración
-                    if duration_seconds > 0 and status_message:
+                    if duration_seconds > 0 and progress_job:
                         percentage = min(int((time_seconds / duration_seconds) * 100), 100)
+                        progress_job.update(percent=percentage, time_seconds=time_seconds,
+                                            name=os.path.basename(input_path))
 
-                        # Actualizar cada 5% para no saturar
-                        if percentage >= last_update + 5:
-                            last_update = percentage
+                        if percentage >= last_logged + 5:
+                            last_logged = percentage
                             debug(f"[CONVERSION] Progress: {percentage}% ({int(time_seconds)}s / {int(duration_seconds)}s)")
-
-                            # Crear barra de progreso
-                            bar_length = 20
-                            filled = int(bar_length * percentage / 100)
-                            bar = "█" * filled + "░" * (bar_length - filled)
-
-                            # Usar mensaje específico para videos largos con advertencia
-                            if is_long_video:
-                                duration_minutes = int(duration_seconds / 60)
-                                msg = get_text("converting_video_long_progress_bar", duration_minutes, bar, percentage, int(time_seconds), int(duration_seconds))
-                            else:
-                                msg = get_text("converting_video_progress_bar", bar, percentage, int(time_seconds), int(duration_seconds))
-
-                            # Preparar botones según si es video largo o no
-                            if is_long_video:
-                                buttons = [
-                                    [Button.inline(get_text("button_cancel_conversion"), data=f"cancelconv:{conversion_id}")],
-                                    [Button.inline(get_text("button_send_original"), data=f"sendoriginal:{conversion_id}")]
-                                ]
-                            else:
-                                buttons = [Button.inline(get_text("button_cancel_conversion"), data=f"cancelconv:{conversion_id}")]
-
-                            try:
-                                await safe_edit(
-                                    status_message,
-                                    msg,
-                                    buttons=buttons,
-                                    parse_mode=PARSE_MODE
-                                )
-                            except Exception as e:
-                                warning(f"[CONVERSION] Error updating progress message: {e}")
-                                # Si falla la edición, puede ser que el mensaje fue eliminado/editado
-                                # Verificar si fue cancelado o se solicitó enviar original
-                                if conversion_id in cancelled_conversions or conversion_id in send_original_requests:
-                                    debug(f"[CONVERSION] Message edit failed because conversion was cancelled or send original requested")
-                                    break
                 except Exception as e:
                     warning(f"[CONVERSION] Error processing progress line: {e}")
 
+        await progress_service.stop(progress_job)
         debug(f"[CONVERSION] Waiting for process completion...")
         await proc.wait()
 
@@ -2885,6 +3182,7 @@ async def convert_video_to_telegram_compatible(input_path, status_message=None):
     except asyncio.CancelledError:
         # La tarea fue cancelada (por ejemplo, el usuario canceló la conversión)
         debug(f"[CONVERSION] ❌ Conversion task cancelled")
+        await progress_service.stop(progress_job)
         # Limpiar el proceso de active_tasks
         active_tasks.pop(conversion_id, None)
         debug(f"[CONVERSION] Process removed from active_tasks after cancellation")
@@ -2899,6 +3197,7 @@ async def convert_video_to_telegram_compatible(input_path, status_message=None):
         return None
     except Exception as e:
         error(f"[CONVERSION] ❌ Exception during video conversion: {e}")
+        await progress_service.stop(progress_job)
         # Limpiar el proceso de active_tasks
         active_tasks.pop(conversion_id, None)
         debug(f"[CONVERSION] Process removed from active_tasks after exception")
@@ -3016,6 +3315,13 @@ async def handle_success(event, file_path, show_action_buttons=True, icon=None,
         if show_action_buttons and file_type in ["video", "audio"]:
             if file_size <= 2 * 1024 * 1024 * 1024:
                 pending_files[event.id] = file_path
+                # Adelantar la subida mientras el usuario decide. Los vídeos solo
+                # si ya son compatibles con Telegram: los demás se convierten
+                # antes de enviarse y lo subido no serviría
+                is_video_file = os.path.splitext(file_path)[1].lower() in EXTENSIONS_VIDEO
+                if (PRE_UPLOAD and FAST_CONNECTIONS > 1 and file_size > FAST_TRANSFER_MIN_BYTES
+                        and (not is_video_file or is_telegram_compatible_video(file_path, file_info))):
+                    _start_pre_upload(file_path)
                 buttons = [
                     [
                         Button.inline(get_text("button_send"), data=f"send:{event.id}"),
@@ -3502,116 +3808,125 @@ async def handle_download_file(event):
     try:
         debug(f"[SEND /manage] Preparing file send: {filename}")
 
-        # Determinar si es video para agregar atributos
-        file_ext = os.path.splitext(filename)[1].lower()
-        is_video = file_ext in EXTENSIONS_VIDEO
-        is_audio = file_ext in EXTENSIONS_AUDIO
-
-        debug(f"[SEND /manage] File type: {'video' if is_video else 'audio' if is_audio else 'document'}")
-
-        attributes = [DocumentAttributeFilename(file_name=filename)]
         thumb_path = None
         original_file_path = file_path  # Guardar ruta original
         converted_file_path = None  # Para rastrear si se creó un archivo convertido
 
-        if is_video:
-            debug(f"[SEND /manage] Starting video conversion...")
-            # Convertir el video a formato compatible con Telegram antes de enviarlo
-            converted_file_path = await convert_video_to_telegram_compatible(file_path, sending_msg)
-
-            # Si la conversión fue cancelada (retorna None), salir
-            if converted_file_path is None:
-                debug("[SEND /manage] ❌ Conversion cancelled, aborting send")
-                # El mensaje ya fue actualizado por el handler de cancelación
-                # No necesitamos hacer nada más, solo salir
-                return
-
-            # Si la conversión creó un archivo diferente, usarlo para enviar
-            if converted_file_path != file_path:
-                debug(f"[SEND /manage] Using converted file: {converted_file_path}")
-                file_path = converted_file_path
-                # Actualizar filename para que muestre .mp4 en lugar de la extensión original
-                filename = os.path.splitext(filename)[0] + ".mp4"
-                debug(f"[SEND /manage] Name updated to: {filename}")
-                # Actualizar el atributo de nombre de archivo
-                attributes = [DocumentAttributeFilename(file_name=filename)]
-            else:
-                debug(f"[SEND /manage] Video already compatible, using original")
-
-            # Obtener metadatos del video
-            debug(f"[SEND /manage] Getting video metadata...")
-            duration, width, height = await get_video_metadata(file_path)
-            if duration and width and height:
-                debug(f"[SEND /manage] Metadata: {duration}s, {width}x{height}")
-                from telethon.tl.types import DocumentAttributeVideo
-                attributes.append(DocumentAttributeVideo(
-                    duration=duration,
-                    w=width,
-                    h=height,
-                    supports_streaming=True
-                ))
-            else:
-                debug(f"[SEND /manage] ⚠️ Could not get video metadata")
+        # Si Telegram ya tiene este fichero, reenviarlo sin convertirlo ni subirlo
+        message = await _send_cached_file(event.chat_id, file_path, "[SEND /manage]")
+        if message is None:
+            # Determinar si es video para agregar atributos
+            file_ext = os.path.splitext(filename)[1].lower()
+            is_video = file_ext in EXTENSIONS_VIDEO
+            is_audio = file_ext in EXTENSIONS_AUDIO
 
-            # Generar thumbnail
-            debug(f"[SEND /manage] Generating thumbnail...")
-            thumb_path = await generate_video_thumbnail(file_path)
-            if thumb_path:
-                debug(f"[SEND /manage] Thumbnail generated: {thumb_path}")
-            else:
-                debug(f"[SEND /manage] ⚠️ Could not generate thumbnail")
-
-        elif is_audio:
-            debug(f"[SEND /manage] Getting audio metadata...")
-            # Obtener metadatos del audio
-            duration, _, _ = await get_video_metadata(file_path)
-            if duration:
-                debug(f"[SEND /manage] Audio duration: {duration}s")
-                from telethon.tl.types import DocumentAttributeAudio
-                attributes.append(DocumentAttributeAudio(
-                    duration=duration
-                ))
-            else:
-                debug(f"[SEND /manage] ⚠️ Could not get audio duration")
+            debug(f"[SEND /manage] File type: {'video' if is_video else 'audio' if is_audio else 'document'}")
 
-        # Crear callback de progreso para el envío
-        upload_progress = create_upload_progress_callback(sending_msg, filename)
+            attributes = [DocumentAttributeFilename(file_name=filename)]
 
-        debug(f"[SEND /manage] Starting send to Telegram...")
-        file_size = os.path.getsize(file_path)
-        debug(f"[SEND /manage] File size: {file_size} bytes")
-
-        # Enviar archivo con progreso
-        # NO usar wait_for_result=True para no bloquear el event loop
-        # Esto permite que el bot siga respondiendo a otros comandos mientras envía
-        await _send_file_fast(
-            event.chat_id,
-            file_path,
-            filename,
-            attributes,
-            thumb_path,
-            is_video,
-            upload_progress
-        )
+            if is_video:
+                debug(f"[SEND /manage] Starting video conversion...")
+                # Convertir el video a formato compatible con Telegram antes de enviarlo
+                converted_file_path = await convert_video_to_telegram_compatible(file_path, sending_msg)
 
-        debug(f"[SEND /manage] ✅ File sent successfully")
+                # Si la conversión fue cancelada (retorna None), salir
+                if converted_file_path is None:
+                    debug("[SEND /manage] ❌ Conversion cancelled, aborting send")
+                    # El mensaje ya fue actualizado por el handler de cancelación
+                    # No necesitamos hacer nada más, solo salir
+                    return
 
-        # Limpiar thumbnail temporal
-        if thumb_path and os.path.exists(thumb_path):
-            try:
-                debug(f"[SEND /manage] Deleting temporary thumbnail: {thumb_path}")
-                os.remove(thumb_path)
-            except Exception as e:
-                warning(f"[SEND /manage] ⚠️ Error deleting thumbnail: {e}")
+                # Si la conversión creó un archivo diferente, usarlo para enviar
+                if converted_file_path != file_path:
+                    debug(f"[SEND /manage] Using converted file: {converted_file_path}")
+                    file_path = converted_file_path
+                    # Actualizar filename para que muestre .mp4 en lugar de la extensión original
+                    filename = os.path.splitext(filename)[0] + ".mp4"
+                    debug(f"[SEND /manage] Name updated to: {filename}")
+                    # Actualizar el atributo de nombre de archivo
+                    attributes = [DocumentAttributeFilename(file_name=filename)]
+                else:
+                    debug(f"[SEND /manage] Video already compatible, using original")
 
-        # Limpiar archivo convertido temporal si se generó (diferente del original)
-        if converted_file_path and converted_file_path != original_file_path and os.path.exists(converted_file_path):
+                # Obtener metadatos del video
+                debug(f"[SEND /manage] Getting video metadata...")
+                duration, width, height = await get_video_metadata(file_path)
+                if duration and width and height:
+                    debug(f"[SEND /manage] Metadata: {duration}s, {width}x{height}")
+                    from telethon.tl.types import DocumentAttributeVideo
+                    attributes.append(DocumentAttributeVideo(
+                        duration=duration,
+                        w=width,
+                        h=height,
+                        supports_streaming=True
+                    ))
+                else:
+                    debug(f"[SEND /manage] ⚠️ Could not get video metadata")
+
+                # Generar thumbnail
+                debug(f"[SEND /manage] Generating thumbnail...")
+                thumb_path = await generate_video_thumbnail(file_path)
+                if thumb_path:
+                    debug(f"[SEND /manage] Thumbnail generated: {thumb_path}")
+                else:
+                    debug(f"[SEND /manage] ⚠️ Could not generate thumbnail")
+
+            elif is_audio:
+                debug(f"[SEND /manage] Getting audio metadata...")
+                # Obtener metadatos del audio
+                duration, _, _ = await get_video_metadata(file_path)
+                if duration:
+                    debug(f"[SEND /manage] Audio duration: {duration}s")
+                    from telethon.tl.types import DocumentAttributeAudio
+                    attributes.append(DocumentAttributeAudio(
+                        duration=duration
+                    ))
+                else:
+                    debug(f"[SEND /manage] ⚠️ Could not get audio duration")
+
+            # Crear callback de progreso para el envío
+            upload_progress = create_upload_progress_callback(sending_msg, filename)
+
+            debug(f"[SEND /manage] Starting send to Telegram...")
+            file_size = os.path.getsize(file_path)
+            debug(f"[SEND /manage] File size: {file_size} bytes")
+
+            # Enviar archivo con progreso
+            # NO usar wait_for_result=True para no bloquear el event loop
+            # Esto permite que el bot siga respondiendo a otros comandos mientras envía
             try:
-                debug(f"[SEND /manage] Deleting temporary converted file: {converted_file_path}")
-                os.remove(converted_file_path)
-                debug(f"[SEND /manage] ✅ Temporary converted file deleted")
-            except Exception as e:
-                warning(f"[SEND /manage] ⚠️ Error deleting temporary converted file: {e}")
+                message = await _send_file_fast(
+                    event.chat_id,
+                    file_path,
+                    filename,
+                    attributes,
+                    thumb_path,
+                    is_video,
+                    upload_progress
+                )
+            finally:
+                await stop_transfer_progress(upload_progress)
+
+            debug(f"[SEND /manage] ✅ File sent successfully")
+            # Telegram ya tiene el fichero ORIGINAL: reenviarlo después no requiere subirlo
+            file_cache_service.put(original_file_path, message.document)
+
+            # Limpiar thumbnail temporal
+            if thumb_path and os.path.exists(thumb_path):
+                try:
+                    debug(f"[SEND /manage] Deleting temporary thumbnail: {thumb_path}")
+                    os.remove(thumb_path)
+                except Exception as e:
+                    warning(f"[SEND /manage] ⚠️ Error deleting thumbnail: {e}")
+
+            # Limpiar archivo convertido temporal si se generó (diferente del original)
+            if converted_file_path and converted_file_path != original_file_path and os.path.exists(converted_file_path):
+                try:
+                    debug(f"[SEND /manage] Deleting temporary converted file: {converted_file_path}")
+                    os.remove(converted_file_path)
+                    debug(f"[SEND /manage] ✅ Temporary converted file deleted")
+                except Exception as e:
+                    warning(f"[SEND /manage] ⚠️ Error deleting temporary converted file: {e}")
 
         # Eliminar mensaje de progreso
         if sending_msg and sending_msg != event:
@@ -3677,7 +3992,8 @@ async def handle_close(event):
     if user_id in list_messages:
         for msg in list_messages[user_id]:
             try:
-                await safe_delete(msg)
+                # El usuario acaba de pulsar "Cerrar": no es limpieza de fondo
+                await safe_delete(msg, priority=PRIORITY_INTERACTIVE)
             except:
                 pass
         list_messages.pop(user_id, None)
@@ -3861,8 +4177,9 @@ async def handle_rename_input(event):
     # Borrar el mensaje del usuario con el nuevo nombre
     try:
         await event.delete()
-    except:
-        pass  # Si no se puede borrar, continuar de todos modos
+    except Exception as e:
+        # Si no se puede borrar, continuar de todos modos
+        flood_control.record_error("delete", event.chat_id, e)
 
     # Borrar el mensaje de "Renombrar archivo/carpeta"
     if rename_message:
@@ -3985,37 +4302,24 @@ async def handle_extract_file(event):
     # Extraer archivo en un executor para no bloquear (archivos grandes pueden tardar mucho)
     loop = asyncio.get_running_loop()
 
-    # Tarea para actualizar progreso cada 10 segundos
-    extraction_done = asyncio.Event()
+    # Progreso: tiempo transcurrido en pasos de 10 segundos, repintado por progress_service
+    started = time.monotonic()
 
-    async def update_progress():
-        """Actualiza el mensaje cada 10 segundos para mostrar que sigue extrayendo"""
-        elapsed = 0
-        while not extraction_done.is_set():
-            await asyncio.sleep(10)
-            if not extraction_done.is_set():
-                elapsed += 10
-                try:
-                    await safe_edit(
-                        progress_msg,
-                        get_text('decompressing_file_progress', filename, elapsed),
-                        parse_mode=PARSE_MODE
-                    )
-                    debug(f"[EXTRACT] Still extracting {filename} ({elapsed}s elapsed)")
-                except Exception as e:
-                    debug(f"[EXTRACT] Error updating progress message: {e}")
+    def render_extraction(counters):
+        elapsed = int(time.monotonic() - started) // 10 * 10
+        return get_text('decompressing_file_progress', filename, elapsed) if elapsed else None
 
-    # Iniciar tarea de progreso
-    progress_task = asyncio.create_task(update_progress())
+    progress_job = progress_service.Job(progress_msg, render_extraction, clock=True) if progress_msg else None
+    if progress_job:
+        progress_job.update(name=filename)
 
     try:
         # Ejecutar extracción en thread pool
         extract_result = await loop.run_in_executor(None, extract_file, file_path, extracted_path)
         debug(f"[EXTRACT] Extraction completed for {filename}, result: {extract_result}")
     finally:
-        # Detener tarea de progreso
-        extraction_done.set()
-        await progress_task
+        # Detener el progreso
+        await progress_service.stop(progress_job)
 
     # Usar función unificada para mensajes y botones
     msg, buttons = get_extraction_message_and_buttons(
@@ -4156,101 +4460,115 @@ async def handle_send_choice(event):
 
             debug(f"[SEND BUTTON] Preparing file send: {file_path}")
 
-            # Detectar si es un video y obtener metadatos
-            is_video = file_path.lower().endswith(('.mp4', '.mkv', '.avi', '.mov', '.webm', '.flv', '.wmv'))
             thumb_path = None
             original_file_path = file_path  # Guardar ruta original
             converted_file_path = None  # Para rastrear si se creó un archivo convertido
 
-            debug(f"[SEND BUTTON] File type: {'video' if is_video else 'document'}")
+            # Si Telegram ya tiene este fichero, reenviarlo sin convertirlo ni subirlo
+            message = await _send_cached_file(event.chat_id, file_path, "[SEND BUTTON]")
+            if message is None:
+                # Detectar si es un video y obtener metadatos
+                is_video = file_path.lower().endswith(('.mp4', '.mkv', '.avi', '.mov', '.webm', '.flv', '.wmv'))
 
-            # Inicializar attributes con el nombre del archivo original
-            original_filename = os.path.basename(file_path)
-            display_filename = original_filename  # Por defecto, usar el nombre original
-            attributes = [DocumentAttributeFilename(file_name=original_filename)]
+                debug(f"[SEND BUTTON] File type: {'video' if is_video else 'document'}")
 
-            if is_video:
-                debug(f"[SEND BUTTON] Starting video conversion...")
-                # Convertir el video a formato compatible con Telegram antes de enviarlo
-                converted_file_path = await convert_video_to_telegram_compatible(file_path, sending_msg)
+                # Inicializar attributes con el nombre del archivo original
+                original_filename = os.path.basename(file_path)
+                display_filename = original_filename  # Por defecto, usar el nombre original
+                attributes = [DocumentAttributeFilename(file_name=original_filename)]
 
-                # Si la conversión fue cancelada (retorna None), salir
-                if converted_file_path is None:
-                    debug("[SEND BUTTON] ❌ Conversion cancelled, aborting send")
-                    if sending_msg:
-                        await safe_delete(sending_msg)
-                    return
-
-                # Si la conversión creó un archivo diferente, usarlo para enviar
-                if converted_file_path != file_path:
-                    debug(f"[SEND BUTTON] Using converted file: {converted_file_path}")
-                    file_path = converted_file_path
-                    # Actualizar el nombre del archivo a .mp4 (sin _telegram)
-                    display_filename = os.path.splitext(original_filename)[0] + ".mp4"
-                    debug(f"[SEND BUTTON] Name updated to: {display_filename}")
-                    attributes = [DocumentAttributeFilename(file_name=display_filename)]
-                else:
-                    debug(f"[SEND BUTTON] Video already compatible, using original")
-
-                debug(f"[SEND BUTTON] Getting video metadata...")
-                duration, width, height = await get_video_metadata(file_path)
-                if duration and width and height:
-                    debug(f"[SEND BUTTON] Metadata: {duration}s, {width}x{height}")
-                    from telethon.tl.types import DocumentAttributeVideo
-                    attributes.append(DocumentAttributeVideo(
-                        duration=duration,
-                        w=width,
-                        h=height,
-                        supports_streaming=True
-                    ))
-                else:
-                    debug(f"[SEND BUTTON] ⚠️ Could not get video metadata")
+                if is_video:
+                    if file_path in pre_uploads:
+                        # Ya compatible y subiéndose en segundo plano (ver handle_success)
+                        debug(f"[SEND BUTTON] Video already compatible and pre-uploaded, skipping conversion")
+                        converted_file_path = file_path
+                    else:
+                        debug(f"[SEND BUTTON] Starting video conversion...")
+                        # Convertir el video a formato compatible con Telegram antes de enviarlo
+                        converted_file_path = await convert_video_to_telegram_compatible(file_path, sending_msg)
+
+                    # Si la conversión fue cancelada (retorna None), salir
+                    if converted_file_path is None:
+                        debug("[SEND BUTTON] ❌ Conversion cancelled, aborting send")
+                        if sending_msg:
+                            await safe_delete(sending_msg)
+                        return
+
+                    # Si la conversión creó un archivo diferente, usarlo para enviar
+                    if converted_file_path != file_path:
+                        debug(f"[SEND BUTTON] Using converted file: {converted_file_path}")
+                        file_path = converted_file_path
+                        # Actualizar el nombre del archivo a .mp4 (sin _telegram)
+                        display_filename = os.path.splitext(original_filename)[0] + ".mp4"
+                        debug(f"[SEND BUTTON] Name updated to: {display_filename}")
+                        attributes = [DocumentAttributeFilename(file_name=display_filename)]
+                    else:
+                        debug(f"[SEND BUTTON] Video already compatible, using original")
+
+                    debug(f"[SEND BUTTON] Getting video metadata...")
+                    duration, width, height = await get_video_metadata(file_path)
+                    if duration and width and height:
+                        debug(f"[SEND BUTTON] Metadata: {duration}s, {width}x{height}")
+                        from telethon.tl.types import DocumentAttributeVideo
+                        attributes.append(DocumentAttributeVideo(
+                            duration=duration,
+                            w=width,
+                            h=height,
+                            supports_streaming=True
+                        ))
+                    else:
+                        debug(f"[SEND BUTTON] ⚠️ Could not get video metadata")
 
-                # Generar thumbnail del video
-                debug(f"[SEND BUTTON] Generating thumbnail...")
-                thumb_path = await generate_video_thumbnail(file_path)
-                if thumb_path:
-                    debug(f"[SEND BUTTON] Thumbnail generated: {thumb_path}")
-                else:
-                    debug(f"[SEND BUTTON] ⚠️ Could not generate thumbnail")
+                    # Generar thumbnail del video
+                    debug(f"[SEND BUTTON] Generating thumbnail...")
+                    thumb_path = await generate_video_thumbnail(file_path)
+                    if thumb_path:
+                        debug(f"[SEND BUTTON] Thumbnail generated: {thumb_path}")
+                    else:
+                        debug(f"[SEND BUTTON] ⚠️ Could not generate thumbnail")
 
-            # Crear callback de progreso para el envío
-            upload_progress = create_upload_progress_callback(sending_msg, display_filename)
+                # Crear callback de progreso para el envío
+                upload_progress = create_upload_progress_callback(sending_msg, display_filename)
 
-            debug(f"[SEND BUTTON] Starting send to Telegram...")
-            file_size = os.path.getsize(file_path)
-            debug(f"[SEND BUTTON] File size: {file_size} bytes")
+                debug(f"[SEND BUTTON] Starting send to Telegram...")
+                file_size = os.path.getsize(file_path)
+                debug(f"[SEND BUTTON] File size: {file_size} bytes")
 
-            # NO usar wait_for_result=True para no bloquear el event loop
-            # Esto permite que el bot siga respondiendo a otros comandos mientras envía
-            message = await _send_file_fast(
-                event.chat_id,
-                file_path,
-                display_filename,
-                attributes,
-                thumb_path,
-                is_video,
-                upload_progress
-            )
+                # NO usar wait_for_result=True para no bloquear el event loop
+                # Esto permite que el bot siga respondiendo a otros comandos mientras envía
+                try:
+                    message = await _send_file_fast(
+                        event.chat_id,
+                        file_path,
+                        display_filename,
+                        attributes,
+                        thumb_path,
+                        is_video,
+                        upload_progress
+                    )
+                finally:
+                    await stop_transfer_progress(upload_progress)
 
-            debug(f"[SEND BUTTON] ✅ File sent successfully")
+                debug(f"[SEND BUTTON] ✅ File sent successfully")
+                # Telegram ya tiene el fichero ORIGINAL: reenviarlo después no requiere subirlo
+                file_cache_service.put(original_file_path, message.document)
 
-            # Limpiar thumbnail temporal si se generó
-            if thumb_path and os.path.exists(thumb_path):
-                try:
-                    debug(f"[SEND BUTTON] Deleting temporary thumbnail: {thumb_path}")
-                    os.remove(thumb_path)
-                except Exception as e:
-                    warning(f"[SEND BUTTON] ⚠️ Error deleting temporary thumbnail: {e}")
+                # Limpiar thumbnail temporal si se generó
+                if thumb_path and os.path.exists(thumb_path):
+                    try:
+                        debug(f"[SEND BUTTON] Deleting temporary thumbnail: {thumb_path}")
+                        os.remove(thumb_path)
+                    except Exception as e:
+                        warning(f"[SEND BUTTON] ⚠️ Error deleting temporary thumbnail: {e}")
 
-            # Limpiar archivo convertido temporal si se generó (diferente del original)
-            if converted_file_path and converted_file_path != original_file_path and os.path.exists(converted_file_path):
-                try:
-                    debug(f"[SEND BUTTON] Deleting temporary converted file: {converted_file_path}")
-                    os.remove(converted_file_path)
-                    debug(f"[SEND BUTTON] ✅ Temporary converted file deleted")
-                except Exception as e:
-                    warning(f"[SEND BUTTON] ⚠️ Error deleting temporary converted file: {e}")
+                # Limpiar archivo convertido temporal si se generó (diferente del original)
+                if converted_file_path and converted_file_path != original_file_path and os.path.exists(converted_file_path):
+                    try:
+                        debug(f"[SEND BUTTON] Deleting temporary converted file: {converted_file_path}")
+                        os.remove(converted_file_path)
+                        debug(f"[SEND BUTTON] ✅ Temporary converted file deleted")
+                    except Exception as e:
+                        warning(f"[SEND BUTTON] ⚠️ Error deleting temporary converted file: {e}")
 
             debug(f"[SEND BUTTON] ✅ File sent to Telegram: {original_file_path}")
             if sending_msg:
@@ -4259,6 +4577,7 @@ async def handle_send_choice(event):
             if action == "senddelete":
                 # Eliminar el archivo ORIGINAL, no el convertido
                 debug(f"[SEND BUTTON] Deleting original file from server: {original_file_path}")
+                file_cache_service.forget(original_file_path)
                 os.remove(original_file_path)
                 debug(f"[SEND BUTTON] ✅ File sent to Telegram and deleted from server: {original_file_path}")
                 await safe_respond(event, get_text("deleted_from_server"), reply_to=message.id, parse_mode=PARSE_MODE)
@@ -4292,6 +4611,7 @@ async def handle_send_choice(event):
             await safe_reply(event, get_text("error_sending_the_file_user"), parse_mode=PARSE_MODE)
             error(f"[SEND BUTTON] Error sending file: {e}")
     else:
+        _discard_pre_upload(file_path)
         await safe_delete(event)
 
 async def handle_cancel(status_message):
@@ -4323,7 +4643,7 @@ async def set_commands():
         BotCommand("donate", get_text("menu_donate")),
         BotCommand("donors", get_text("menu_donors")),
     ]
-    await bot(functions.bots.SetBotCommandsRequest(
+    await flood_control.call("commands", None, bot, functions.bots.SetBotCommandsRequest(
         scope=types.BotCommandScopeDefault(),
         lang_code=LANGUAGE.lower(),
         commands=commands
@@ -4388,6 +4708,7 @@ async def start_pot_provider():
 async def main():
     debug(f"[STARTUP] DropBot v{VERSION}")
     pot_proc = await start_pot_provider()
+    await ytdlp_service.start()  # Workers de yt-dlp listos antes del primer enlace
     await bot.start()
     await message_queue.start()  # Iniciar la cola de mensajes
     await set_commands()
@@ -4398,6 +4719,9 @@ async def main():
     finally:
         heartbeat_task.cancel()
         await message_queue.shutdown()  # Detener la cola al finalizar
+        await fast_telethon.close_pools()  # Cerrar conexiones paralelas persistentes
+        await ytdlp_service.close()  # Detener los workers de yt-dlp
+        url_cache_service.flush()  # Guardar los resultados de enlaces pendientes
         if pot_proc and pot_proc.returncode is None:
             pot_proc.terminate()
 
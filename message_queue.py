@@ -1,60 +1,309 @@
 import asyncio
+import collections
+import time
+from telethon import errors
 from debug import debug, error, warning
+from utils import flood_control
+
+# Clases de prioridad de la cola (número menor = se atiende antes)
+PRIORITY_INTERACTIVE = 0  # Respuestas a comandos y botones del usuario
+PRIORITY_STATUS = 1       # Mensajes de estado y progreso
+PRIORITY_BACKGROUND = 2   # Limpieza (borrado de mensajes de estado, etc.)
+
+# Nº de mensajes de los que se recuerda el último contenido enviado (para
+# descartar ediciones que no cambian nada)
+MAX_TRACKED_MESSAGES = 500
+
+# Límites documentados de Telegram para bots: ~1 mensaje/s por chat privado
+# (con ráfagas cortas), 20 mensajes/minuto por grupo y ~30 mensajes/s en total.
+CHAT_RATE = 1.0
+GROUP_RATE = 20 / 60
+CHAT_BURST = 3
+GLOBAL_RATE = 30
+GLOBAL_BURST = 30
+
+# Agrupación de operaciones con versión por lotes (p. ej. borrar mensajes): lo
+# que se encole para el mismo lote durante esta ventana sale en una sola llamada.
+# Telegram acepta como mucho 100 ids por DeleteMessagesRequest.
+BATCH_WINDOW = 0.25
+BATCH_MAX_ITEMS = 100
+
+class _TokenBucket:
+    """Cubo de tokens: `rate` tokens/s con capacidad para ráfagas de `burst`."""
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Segundos hasta que haya un token (0 si ya lo hay)."""
+        self._refill(now)
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+def _is_transient(e):
+    """Errores de red o internos de Telegram que pueden no repetirse al reintentar."""
+    return isinstance(e, (ConnectionError, OSError, asyncio.TimeoutError,
+                          errors.ServerError, errors.TimedOutError))
+
+def _freeze(value):
+    """Representación estable de los argumentos de una edición (texto, botones...)
+    para compararla con la anterior: los objetos de Telethon se comparan por
+    contenido, no por identidad."""
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if hasattr(value, 'to_dict'):
+        return repr(value.to_dict())
+    if type(value).__repr__ is object.__repr__ and hasattr(value, '__dict__'):
+        return (type(value).__name__, _freeze(sorted(vars(value).items())))
+    return repr(value)
 
 class TelegramMessageQueue:
     """
     Sistema de cola de mensajes asíncrono con rate limiting para evitar saturar Telegram.
     Implementa:
-    - Cola de mensajes con delays configurables
+    - Rate limiting con cubos de tokens por chat (más estricto en grupos) y
+      global, según los límites de Telegram
+    - Varios workers en paralelo: cada chat tiene como mucho una llamada en
+      curso (se conserva su orden), pero las ráfagas de un chat no retrasan
+      a los demás
+    - Clases de prioridad (PRIORITY_*): las respuestas interactivas no esperan
+      detrás de ráfagas de ediciones de progreso o borrados
+    - Protección contra inanición: un mensaje que lleva más de `max_wait`
+      segundos esperando se atiende antes que los de clases superiores
+    - Fusión de ediciones (`coalesce_key`): como mucho una edición pendiente
+      por mensaje, con el contenido más reciente, y sin repetir la que ya se
+      envió igual
+    - Agrupación por lotes (`batch_key`): p. ej. los borrados de un mismo chat
+      encolados en una ventana corta salen en un solo DeleteMessagesRequest
     - Reintentos con backoff exponencial
-    - Manejo de errores de rate limiting (FloodWaitError, 429)
+    - Manejo de errores de rate limiting (FloodWaitError, 429): la penalización
+      se anota en flood_control, compartido con las ediciones directas, y no se
+      despacha nada del mismo método y chat hasta que termine
+    - Carril aparte para operaciones pesadas (`heavy=True`, p. ej. subir un
+      archivo) con sus propios workers: no ocupan los de texto ni bloquean su
+      chat, así que respuestas, ediciones y borrados siguen saliendo
     """
-    def __init__(self, delay_between_messages=0.5, max_retries=5):
+    def __init__(self, workers=4, max_retries=5, max_wait=10, heavy_workers=2):
         """
         Inicializa la cola de mensajes.
 
         Args:
-            delay_between_messages: Tiempo en segundos entre mensajes (default: 0.5)
+            workers: Número de llamadas simultáneas a Telegram (default: 4)
             max_retries: Número máximo de reintentos por mensaje (default: 5)
+            max_wait: Espera máxima en segundos antes de adelantar un mensaje
+                de menor prioridad (default: 10)
+            heavy_workers: Número de operaciones pesadas simultáneas (default: 2)
         """
-        self.queue = asyncio.Queue()
-        self.delay_between_messages = delay_between_messages
+        self.queues = {
+            priority: collections.deque()
+            for priority in (PRIORITY_INTERACTIVE, PRIORITY_STATUS, PRIORITY_BACKGROUND)
+        }
+        self.not_empty = asyncio.Event()
+        self.pending_edits = {}  # {coalesce_key: mensaje pendiente en la cola}
+        self.pending_batches = {}  # {batch_key: lote pendiente que aún admite elementos}
+        self.last_sent = collections.OrderedDict()  # {coalesce_key: (firma, resultado)}
+        self.chat_buckets = {}  # {chat_id: _TokenBucket}
+        self.global_bucket = _TokenBucket(GLOBAL_RATE, GLOBAL_BURST)
+        self.busy_chats = set()  # Chats con una llamada en curso
+        self.heavy_queue = collections.deque()  # Carril de operaciones pesadas
+        self.heavy_ready = asyncio.Event()
+        self.workers = max(1, workers)
+        self.heavy_workers = max(1, heavy_workers)
         self.max_retries = max_retries
+        self.max_wait = max_wait
         self.running = True
-        self.worker_task = None
-        debug(f"[STARTUP] Message queue initialized (delay: {delay_between_messages}s, max_retries: {max_retries})")
+        self.worker_tasks = []
+        self.heavy_tasks = []
+        debug(f"[STARTUP] Message queue initialized (workers: {self.workers}, heavy workers: {self.heavy_workers}, max_retries: {max_retries}, max_wait: {max_wait}s)")
+
+    def qsize(self):
+        """Número total de mensajes pendientes (todas las prioridades y el carril pesado)"""
+        return sum(len(q) for q in self.queues.values()) + len(self.heavy_queue)
+
+    def _chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            # En Telethon los ids de grupos y canales son negativos
+            rate = GROUP_RATE if chat_id < 0 else CHAT_RATE
+            bucket = self.chat_buckets[chat_id] = _TokenBucket(rate, CHAT_BURST)
+        return bucket
+
+    def _next_message(self):
+        """
+        Saca el siguiente mensaje que se puede enviar ya, en este orden: los que
+        superan `max_wait` (inanición, el más antiguo primero) y después por
+        clase de prioridad. Se saltan los de chats con una llamada en curso o
+        sin tokens, para que un chat saturado no frene a los demás.
+
+        Devuelve (mensaje, None) o (None, segundos hasta que alguno pueda salir).
+        """
+        now = time.monotonic()
+        global_wait = self.global_bucket.wait_time(now)
+        if global_wait:
+            return None, global_wait
+
+        starving = sorted(
+            (m for q in self.queues.values() for m in q
+             if now - m['queued_at'] >= self.max_wait),
+            key=lambda m: m['queued_at']
+        )
+        in_order = [m for p in sorted(self.queues) for m in self.queues[p]]
+        retry_in = None
+        for message_data in starving + in_order:
+            if message_data['ready_at'] > now:
+                # Lote todavía abierto a más elementos
+                wait = message_data['ready_at'] - now
+                retry_in = wait if retry_in is None else min(retry_in, wait)
+                continue
+            chat_id = message_data['chat_id']
+            flood_wait = flood_control.wait_time(message_data['method'], chat_id)
+            if flood_wait:
+                retry_in = flood_wait if retry_in is None else min(retry_in, flood_wait)
+                continue
+            if chat_id is not None:
+                if chat_id in self.busy_chats:
+                    continue
+                wait = self._chat_bucket(chat_id).wait_time(now)
+                if wait:
+                    retry_in = wait if retry_in is None else min(retry_in, wait)
+                    continue
+                self._chat_bucket(chat_id).take()
+            self.global_bucket.take()
+            self.queues[message_data['priority']].remove(message_data)
+            if message_data['coalesce_key'] is not None:
+                # Las ediciones que lleguen a partir de ahora van en otra entrada
+                self.pending_edits.pop(message_data['coalesce_key'], None)
+            if self.pending_batches.get(message_data['batch_key']) is message_data:
+                self.pending_batches.pop(message_data['batch_key'])
+            return message_data, None
+        return None, retry_in
+
+    @staticmethod
+    def _signature(args, kwargs):
+        return _freeze((args, sorted(kwargs.items())))
+
+    def _already_sent(self, key, signature):
+        """Devuelve (True, resultado) si la última edición enviada de `key`
+        tenía exactamente este contenido."""
+        if key is not None and key in self.last_sent:
+            sent_signature, result = self.last_sent[key]
+            if sent_signature == signature:
+                return True, result
+        return False, None
+
+    def forget_message(self, key):
+        """Olvida el último contenido enviado de `key` (p. ej. al borrarlo)."""
+        self.last_sent.pop(key, None)
+
+    @staticmethod
+    def _resolve(message_data, result=None, exception=None):
+        for future in message_data['result_futures']:
+            if future.done():
+                continue
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
 
     async def start(self):
-        """Inicia el worker que procesa la cola"""
-        if self.worker_task is None or self.worker_task.done():
-            self.worker_task = asyncio.create_task(self._process_queue())
-            debug("[STARTUP] Message queue worker started")
+        """Inicia los workers que procesan la cola"""
+        self.worker_tasks = [task for task in self.worker_tasks if not task.done()]
+        self.heavy_tasks = [task for task in self.heavy_tasks if not task.done()]
+        while len(self.worker_tasks) < self.workers:
+            self.worker_tasks.append(asyncio.create_task(self._process_queue()))
+        while len(self.heavy_tasks) < self.heavy_workers:
+            self.heavy_tasks.append(asyncio.create_task(self._process_heavy_queue()))
+        debug(f"[STARTUP] Message queue started with {self.workers} worker(s) and {self.heavy_workers} heavy worker(s)")
 
     async def _process_queue(self):
         """Procesa la cola de mensajes de forma continua"""
         while self.running:
             try:
-                # Obtener el siguiente mensaje de la cola
-                message_data = await asyncio.wait_for(self.queue.get(), timeout=1.0)
-                
-                if message_data is None:  # Señal de parada
-                    break
+                # Obtener el siguiente mensaje de la cola (limpiar el aviso antes
+                # de mirar: así no se pierde uno que llegue mientras se espera)
+                self.not_empty.clear()
+                message_data, retry_in = self._next_message()
+                if message_data is None:
+                    await asyncio.wait_for(self.not_empty.wait(), timeout=min(retry_in or 1.0, 1.0))
+                    continue
+
+                # Edición idéntica a la última enviada: nada que hacer (evita
+                # la llamada y el error "message not modified")
+                skip, result = self._already_sent(message_data['coalesce_key'], message_data['signature'])
+                if skip:
+                    debug(f"[QUEUE] Skipping unchanged edit")
+                    self._resolve(message_data, result)
+                    continue
+
+                chat_id = message_data['chat_id']
+                if chat_id is not None:
+                    self.busy_chats.add(chat_id)
+                try:
+                    await self._execute_message(message_data)
+                finally:
+                    self.busy_chats.discard(chat_id)
+                    self.not_empty.set()  # El chat queda libre para otro worker
 
-                await self._execute_message(message_data)
-                await asyncio.sleep(self.delay_between_messages)
-                
             except asyncio.TimeoutError:
                 # Timeout normal, continuar esperando
                 continue
             except Exception as e:
                 error(f"Error in message queue: {str(e)}")
 
+    async def _take_tokens(self, chat_id):
+        """Espera a que el chat (si lo hay) y el límite global tengan un token y los consume"""
+        while True:
+            now = time.monotonic()
+            wait = self.global_bucket.wait_time(now)
+            if chat_id is not None:
+                wait = max(wait, self._chat_bucket(chat_id).wait_time(now))
+            if not wait:
+                break
+            await asyncio.sleep(wait)
+        if chat_id is not None:
+            self._chat_bucket(chat_id).take()
+        self.global_bucket.take()
+
+    async def _process_heavy_queue(self):
+        """Procesa el carril de operaciones pesadas. No marca el chat como
+        ocupado: la llamada final (el envío) sí respeta sus límites de velocidad."""
+        while self.running:
+            try:
+                self.heavy_ready.clear()
+                if not self.heavy_queue:
+                    await asyncio.wait_for(self.heavy_ready.wait(), timeout=1.0)
+                    continue
+                message_data = self.heavy_queue.popleft()
+                await self._take_tokens(message_data['chat_id'])
+                if message_data['cancelled']:
+                    continue
+                # En una tarea aparte para poder cancelar solo esta subida
+                message_data['task'] = asyncio.create_task(self._execute_message(message_data))
+                await asyncio.wait([message_data['task']])
+            except asyncio.TimeoutError:
+                continue
+            except Exception as e:
+                error(f"Error in heavy message queue: {str(e)}")
+
     async def _execute_message(self, message_data):
         """Ejecuta un mensaje con reintentos y backoff exponencial"""
         func = message_data['func']
         args = message_data['args']
         kwargs = message_data['kwargs']
-        result_future = message_data.get('result_future')
+        key = message_data['coalesce_key']
+        method = message_data['method']
+        chat_id = message_data['chat_id']
+        if message_data.get('batch_items') is not None:
+            # Los elementos del lote van como último argumento posicional
+            args = (*args, list(message_data['batch_items']))
 
         # Log para debug
         func_name = getattr(func, '__name__', str(func))
@@ -63,10 +312,20 @@ class TelegramMessageQueue:
         for attempt in range(self.max_retries):
             try:
                 debug(f"[QUEUE] Attempt {attempt + 1}/{self.max_retries} for {func_name}")
+                # Otra vía (p. ej. una edición directa) puede haber recibido un
+                # FloodWait para este método y chat mientras tanto
+                flood_wait = flood_control.wait_time(method, chat_id)
+                if flood_wait:
+                    debug(f"[QUEUE] {func_name} deferred {flood_wait:.0f}s by active FloodWait")
+                    await asyncio.sleep(flood_wait)
                 result = await func(*args, **kwargs)
                 debug(f"[QUEUE] ✅ {func_name} completed successfully")
-                if result_future and not result_future.done():
-                    result_future.set_result(result)
+                if key is not None:
+                    self.last_sent[key] = (message_data['signature'], result)
+                    self.last_sent.move_to_end(key)
+                    while len(self.last_sent) > MAX_TRACKED_MESSAGES:
+                        self.last_sent.popitem(last=False)
+                self._resolve(message_data, result)
                 return result
                 
             except Exception as e:
@@ -84,9 +343,10 @@ class TelegramMessageQueue:
                         except:
                             wait_time = (2 ** attempt) * 2
 
-                        # Esperar el tiempo que Telegram solicita
+                        # Anotar la penalización para todas las vías y esperar
+                        # el tiempo que Telegram solicita (al reintentar)
                         warning(f"[QUEUE] FloodWaitError detected for {func_name}. Waiting {wait_time}s ({wait_time // 60} minutes) before retrying...")
-                        await asyncio.sleep(wait_time)
+                        flood_control.record(method, chat_id, wait_time)
                         continue
                     else:
                         error(f"[QUEUE] FloodWaitError persists after {self.max_retries} attempts for {func_name}")
@@ -101,8 +361,11 @@ class TelegramMessageQueue:
                     else:
                         error(f"[QUEUE] Rate limit persists after {self.max_retries} attempts for {func_name}")
 
-                # Otros errores: reintento con delay lineal
-                elif attempt < self.max_retries - 1:
+                # Otros errores: reintento con delay lineal. Una operación
+                # pesada (subida) solo se repite si el error es pasajero: un
+                # RPCError (p. ej. referencia de fichero caducada) no va a
+                # cambiar y quien llamó tiene su propia alternativa
+                elif attempt < self.max_retries - 1 and (not message_data['heavy'] or _is_transient(e)):
                     wait_time = 1 * (attempt + 1)
                     warning(f"[QUEUE] Retry {attempt + 1}/{self.max_retries} for {func_name} in {wait_time}s due to: {error_msg}")
                     await asyncio.sleep(wait_time)
@@ -110,11 +373,13 @@ class TelegramMessageQueue:
 
                 # Último intento fallido
                 error(f"[QUEUE] ❌ Final error for {func_name} after {self.max_retries} attempts: {error_msg}")
-                if result_future and not result_future.done():
-                    result_future.set_exception(e)
+                self.forget_message(key)
+                self._resolve(message_data, exception=e)
                 break
 
-    async def add_message(self, func, *args, wait_for_result=False, **kwargs):
+    async def add_message(self, func, *args, wait_for_result=False, priority=PRIORITY_STATUS,
+                          coalesce_key=None, chat_id=None, heavy=False, batch_key=None,
+                          batch_item=None, **kwargs):
         """
         Añade un mensaje a la cola.
 
@@ -122,6 +387,21 @@ class TelegramMessageQueue:
             func: Función asíncrona a ejecutar (debe ser async)
             *args: Argumentos posicionales para la función
             wait_for_result: Si True, espera y retorna el resultado (default: False)
+            priority: Clase de prioridad PRIORITY_* (default: PRIORITY_STATUS)
+            coalesce_key: Identificador del mensaje editado, p. ej. (chat_id, msg_id).
+                Si ya hay una edición pendiente con la misma clave, se sustituye
+                su contenido por este en lugar de encolar otra (default: None)
+            chat_id: Chat afectado, para aplicar su límite de velocidad y
+                mantener el orden de sus mensajes (default: None, solo límite global)
+            heavy: Operación larga (subida de archivos): va al carril pesado,
+                sin prioridad ni fusión, y su resultado se espera sin límite
+                de tiempo. Solo se reintenta ante FloodWait o errores pasajeros
+                (red, 5xx). Cancelar la espera cancela la operación (default: False)
+            batch_key: Identificador del lote, p. ej. ("delete", chat_id). Las
+                llamadas con el mismo `batch_key` encoladas en `BATCH_WINDOW`
+                se agrupan en una sola: `func(*args, [batch_item, ...], **kwargs)`,
+                cuyo resultado reciben todas (default: None)
+            batch_item: Elemento que aporta esta llamada al lote
             **kwargs: Argumentos nombrados para la función
 
         Returns:
@@ -130,18 +410,135 @@ class TelegramMessageQueue:
         func_name = getattr(func, '__name__', str(func))
         result_future = asyncio.Future() if wait_for_result else None
 
-        debug(f"[QUEUE] Adding to queue: {func_name} (wait_for_result={wait_for_result})")
+        debug(f"[QUEUE] Adding to queue: {func_name} (wait_for_result={wait_for_result}, priority={priority}, heavy={heavy})")
+
+        if heavy:
+            message_data = {
+                'func': func,
+                'args': args,
+                'kwargs': kwargs,
+                'result_futures': [result_future] if result_future else [],
+                'queued_at': time.monotonic(),
+                'priority': priority,
+                'coalesce_key': None,
+                'signature': None,
+                'chat_id': chat_id,
+                'method': flood_control.method_of(func),
+                'heavy': True,
+                'cancelled': False,
+                'task': None
+            }
+            self.heavy_queue.append(message_data)
+            self.heavy_ready.set()
+            debug(f"[QUEUE] Added to heavy lane: {func_name} (heavy queue size: {len(self.heavy_queue)})")
+            if not wait_for_result:
+                return None
+            try:
+                # Una subida grande puede tardar más que el límite de la cola de texto
+                return await result_future
+            except asyncio.CancelledError:
+                # Quien esperaba (p. ej. el botón de cancelar) ya no la quiere: no seguir subiendo
+                message_data['cancelled'] = True
+                if message_data in self.heavy_queue:
+                    self.heavy_queue.remove(message_data)
+                elif message_data['task'] is not None:
+                    message_data['task'].cancel()
+                raise
 
-        await self.queue.put({
-            'func': func,
-            'args': args,
-            'kwargs': kwargs,
-            'result_future': result_future
-        })
+        if batch_key is not None:
+            return await self._add_to_batch(func, args, kwargs, result_future, priority,
+                                            chat_id, batch_key, batch_item)
 
-        debug(f"[QUEUE] Added to queue: {func_name} (queue size: {self.queue.qsize()})")
+        signature = self._signature(args, kwargs) if coalesce_key is not None else None
+        pending = self.pending_edits.get(coalesce_key) if coalesce_key is not None else None
+
+        if pending is None:
+            skip, result = self._already_sent(coalesce_key, signature)
+            if skip:
+                debug(f"[QUEUE] Skipping unchanged edit: {func_name}")
+                return result if wait_for_result else None
+
+        if pending is not None:
+            # Latest wins: la edición pendiente conserva su turno con el contenido nuevo
+            pending.update(func=func, args=args, kwargs=kwargs, signature=signature)
+            if result_future:
+                pending['result_futures'].append(result_future)
+            if priority < pending['priority']:
+                self.queues[pending['priority']].remove(pending)
+                pending['priority'] = priority
+                self.queues[priority].append(pending)
+            debug(f"[QUEUE] Coalesced with pending edit: {func_name}")
+        else:
+            message_data = {
+                'func': func,
+                'args': args,
+                'kwargs': kwargs,
+                'result_futures': [result_future] if result_future else [],
+                'queued_at': time.monotonic(),
+                'priority': priority,
+                'coalesce_key': coalesce_key,
+                'signature': signature,
+                'chat_id': chat_id,
+                'method': flood_control.method_of(func),
+                'heavy': False,
+                'batch_key': None,
+                'ready_at': 0
+            }
+            self.queues[priority].append(message_data)
+            if coalesce_key is not None:
+                self.pending_edits[coalesce_key] = message_data
+            self.not_empty.set()
+
+        debug(f"[QUEUE] Added to queue: {func_name} (queue size: {self.qsize()})")
+
+        return await self._wait_result(func_name, result_future)
+
+    async def _add_to_batch(self, func, args, kwargs, result_future, priority, chat_id,
+                            batch_key, batch_item):
+        """Añade `batch_item` al lote pendiente de `batch_key` (o abre uno nuevo)."""
+        func_name = getattr(func, '__name__', str(func))
+        pending = self.pending_batches.get(batch_key)
+        if pending is not None:
+            pending['batch_items'].append(batch_item)
+            if result_future:
+                pending['result_futures'].append(result_future)
+            if priority < pending['priority']:
+                self.queues[pending['priority']].remove(pending)
+                pending['priority'] = priority
+                self.queues[priority].append(pending)
+            debug(f"[QUEUE] Batched {func_name} ({len(pending['batch_items'])} items)")
+        else:
+            now = time.monotonic()
+            pending = {
+                'func': func,
+                'args': args,
+                'kwargs': kwargs,
+                'result_futures': [result_future] if result_future else [],
+                'queued_at': now,
+                'priority': priority,
+                'coalesce_key': None,
+                'signature': None,
+                'chat_id': chat_id,
+                'method': flood_control.method_of(func),
+                'heavy': False,
+                'batch_key': batch_key,
+                'batch_items': [batch_item],
+                'ready_at': now + BATCH_WINDOW
+            }
+            self.queues[priority].append(pending)
+            self.pending_batches[batch_key] = pending
+            self.not_empty.set()
+            debug(f"[QUEUE] Opened batch for {func_name} (queue size: {self.qsize()})")
+        if len(pending['batch_items']) >= BATCH_MAX_ITEMS:
+            # Lleno: sale ya y lo siguiente abre otro lote
+            self.pending_batches.pop(batch_key, None)
+            pending['ready_at'] = 0
+            self.not_empty.set()
+        return await self._wait_result(func_name, result_future)
 
-        if wait_for_result:
+    async def _wait_result(self, func_name, result_future):
+        """Espera el resultado de un mensaje encolado con wait_for_result=True"""
+        if result_future:
             try:
                 debug(f"[QUEUE] Waiting for result of {func_name} (timeout: 300s)...")
                 result = await asyncio.wait_for(result_future, timeout=300)  # Esperar máximo 5 minutos
@@ -156,8 +553,8 @@ class TelegramMessageQueue:
     async def shutdown(self):
         """Detiene la cola de mensajes de forma ordenada"""
         self.running = False
-        await self.queue.put(None)  # Señal de parada
-        if self.worker_task:
-            await self.worker_task
+        self.not_empty.set()  # Despertar a los workers para que vean la parada
+        self.heavy_ready.set()
+        await asyncio.gather(*self.worker_tasks, *self.heavy_tasks, return_exceptions=True)
         debug("Message queue stopped")
 
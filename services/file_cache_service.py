@@ -0,0 +1,98 @@
+"""
+Caché persistente de ficheros que Telegram ya tiene.
+
+Asocia la huella de un fichero local (ruta, tamaño y mtime) al documento de
+Telegram (id, access_hash, file_reference) que el bot recibió o envió con ese
+mismo contenido, para reenviarlo sin volver a subirlo.
+"""
+import json
+import os
+import time
+
+from telethon.tl.types import Document, InputDocument
+
+from debug import debug, warning
+
+# Nº máximo de entradas; al superarlo se descartan las usadas hace más tiempo.
+_MAX_ENTRIES = 2000
+
+_cache = {}
+_cache_path = None
+
+
+def init(path):
+    """Carga la caché desde `path` (y en adelante la guarda ahí)."""
+    global _cache_path
+    _cache_path = path
+    try:
+        with open(path, "r") as f:
+            _cache.update(json.load(f))
+        debug(f"[FILE_CACHE] Loaded {len(_cache)} cached Telegram file(s)")
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        warning(f"[FILE_CACHE] Could not load file cache {path}: {e}")
+
+
+def _fingerprint(file_path):
+    st = os.stat(file_path)
+    return os.path.realpath(file_path), st.st_size, st.st_mtime_ns
+
+
+def _save():
+    if not _cache_path:
+        return
+    if len(_cache) > _MAX_ENTRIES:
+        for key in sorted(_cache, key=lambda k: _cache[k]["used"])[:len(_cache) - _MAX_ENTRIES]:
+            del _cache[key]
+    tmp_path = f"{_cache_path}.tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump(_cache, f)
+        os.replace(tmp_path, _cache_path)
+    except OSError as e:
+        warning(f"[FILE_CACHE] Could not save file cache: {e}")
+
+
+def get(file_path):
+    """Devuelve el InputDocument de `file_path` si Telegram ya lo tiene y el
+    fichero no ha cambiado desde entonces; None en otro caso."""
+    try:
+        key, size, mtime_ns = _fingerprint(file_path)
+    except OSError:
+        return None
+    entry = _cache.get(key)
+    if not entry or entry["size"] != size or entry["mtime_ns"] != mtime_ns:
+        return None
+    entry["used"] = time.time()
+    return InputDocument(
+        id=entry["id"],
+        access_hash=entry["access_hash"],
+        file_reference=bytes.fromhex(entry["file_reference"]),
+    )
+
+
+def put(file_path, media):
+    """Registra que el contenido actual de `file_path` es el documento `media`."""
+    if not isinstance(media, Document):
+        return  # Solo documentos: las fotos llegan recomprimidas por Telegram
+    try:
+        key, size, mtime_ns = _fingerprint(file_path)
+    except OSError:
+        return
+    _cache[key] = {
+        "size": size,
+        "mtime_ns": mtime_ns,
+        "id": media.id,
+        "access_hash": media.access_hash,
+        "file_reference": media.file_reference.hex(),
+        "used": time.time(),
+    }
+    _save()
+    debug(f"[FILE_CACHE] Cached Telegram file for {os.path.basename(file_path)}")
+
+
+def forget(file_path):
+    """Olvida `file_path` (p. ej. si su referencia de Telegram dejó de valer)."""
+    if _cache.pop(os.path.realpath(file_path), None) is not None:
+        _save()
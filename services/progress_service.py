@@ -0,0 +1,203 @@
+"""
+Servicio de progreso: un único planificador pinta y edita todos los mensajes
+de estado en curso (descargas, subidas, conversiones, extracciones...).
+
+Cada trabajo solo publica contadores baratos con `Job.update()`; el
+planificador decide cuándo repintar según el número de mensajes vivos y el
+presupuesto de ediciones que queda en el último minuto, respeta los FloodWait
+registrados en flood_control y, cuando en un chat hay demasiados trabajos a la
+vez, los agrupa en un único mensaje (panel) en lugar de editar todos.
+"""
+import asyncio
+import collections
+import time
+
+from debug import debug, warning
+from translations import get_text, PARSE_MODE
+from utils import flood_control
+
+TICK = 1.0                  # Segundos entre pasadas del planificador
+MIN_INTERVAL = 3            # Segundos mínimos entre ediciones de un mismo mensaje
+EDITS_PER_MINUTE = 30       # Presupuesto global de ediciones de progreso
+CHAT_EDITS_PER_MINUTE = 20  # Presupuesto por chat (límite de grupos de Telegram)
+DASHBOARD_THRESHOLD = 3     # Con más trabajos que esto en un chat se muestra un panel
+IDLE_TIMEOUT = 300          # Un trabajo sin novedades en este tiempo deja de pintarse
+
+_jobs = {}  # {(chat_id, message_id): Job} trabajos vivos, por orden de llegada
+_edits = collections.deque()  # Instantes de las ediciones del último minuto
+_ticker_task = None
+
+
+def message_key(message):
+    """(chat_id, message_id) de un mensaje de estado."""
+    return (message.chat_id, message.id)
+
+
+class Job:
+    """
+    Progreso de un mensaje de estado.
+
+    `render(counters)` devuelve el texto a mostrar (None = nada todavía) y solo
+    se llama cuando toca repintar. Los contadores `name` y `percent`, si se
+    publican, se usan para la línea del trabajo en el panel. Con `clock=True`
+    el texto depende del tiempo transcurrido: basta un `update()` inicial y el
+    trabajo no caduca por inactividad.
+    """
+
+    def __init__(self, status_message, render, buttons=None, clock=False):
+        self.status_message = status_message
+        self.key = message_key(status_message)
+        self.chat_id = status_message.chat_id
+        self.render = render
+        self.buttons = buttons
+        self.clock = clock
+        self.counters = {}
+        self.updated_at = time.monotonic()
+        self.last_edit = 0
+        self.last_text = None
+        self.editing = None  # Tarea de edición en curso
+        self.closed = False
+
+    def update(self, **counters):
+        """Publica contadores nuevos (no edita nada por sí mismo)."""
+        if self.closed:
+            return
+        self.counters.update(counters)
+        self.updated_at = time.monotonic()
+        if _jobs.get(self.key) is not self:
+            # Nuevo, o retirado antes (edición externa, inactividad): vuelve
+            _jobs[self.key] = self
+            _ensure_ticker()
+
+    def summary(self):
+        name = self.counters.get("name", "...")
+        percent = self.counters.get("percent")
+        if percent is None:
+            return f"• `{name}`"
+        return f"• `{name}` — {float(percent):.0f}%"
+
+
+async def stop(job):
+    """Termina `job` para siempre (esperando a la edición en curso, si la hay)."""
+    if job is None:
+        return
+    job.closed = True
+    await _withdraw(job)
+
+
+async def detach(key):
+    """
+    Retira el trabajo del mensaje `key` porque otra vía va a editarlo o
+    borrarlo. Si el trabajo vuelve a publicar contadores se reanuda.
+    Devuelve True si el mensaje tenía progreso pintado por este servicio.
+    """
+    job = _jobs.get(key)
+    if job is None:
+        return False
+    await _withdraw(job)
+    return job.last_text is not None
+
+
+async def _withdraw(job):
+    if _jobs.get(job.key) is job:
+        del _jobs[job.key]
+    if job.editing is not None and not job.editing.done():
+        try:
+            await job.editing
+        except Exception:
+            pass
+
+
+def _ensure_ticker():
+    global _ticker_task
+    if _ticker_task is None or _ticker_task.done():
+        _ticker_task = asyncio.get_running_loop().create_task(_ticker())
+
+
+async def _ticker():
+    debug(f"[PROGRESS] Ticker started")
+    while _jobs:
+        await asyncio.sleep(TICK)
+        try:
+            _tick()
+        except Exception as e:
+            warning(f"[PROGRESS] Error in progress ticker: {e}")
+    debug(f"[PROGRESS] Ticker stopped (no active jobs)")
+
+
+def _tick():
+    now = time.monotonic()
+    while _edits and now - _edits[0] >= 60:
+        _edits.popleft()
+
+    for job in [job for job in _jobs.values() if not job.clock and now - job.updated_at > IDLE_TIMEOUT]:
+        del _jobs[job.key]
+
+    by_chat = {}
+    for job in _jobs.values():
+        by_chat.setdefault(job.chat_id, []).append(job)
+
+    # Un mensaje por chat en modo panel, uno por trabajo en los demás
+    targets = {
+        chat_id: 1 if len(jobs) > DASHBOARD_THRESHOLD else len(jobs)
+        for chat_id, jobs in by_chat.items()
+    }
+    remaining = EDITS_PER_MINUTE - len(_edits)
+    if remaining <= 0:
+        return
+    # Repartir lo que queda del presupuesto entre los mensajes vivos: con pocos
+    # trabajos se repinta a menudo y con muchos (o poco margen) se espacia
+    interval = max(MIN_INTERVAL, 60 * sum(targets.values()) / remaining)
+
+    for chat_id, jobs in by_chat.items():
+        if flood_control.wait_time("edit", chat_id):
+            continue
+        chat_interval = max(interval, 60 * targets[chat_id] / CHAT_EDITS_PER_MINUTE)
+        if len(jobs) > DASHBOARD_THRESHOLD:
+            # El panel va en el mensaje de un trabajo que sigue en marcha: uno ya
+            # al 100% está acabando y su mensaje se borrará o editará enseguida
+            host = next((job for job in jobs if job.counters.get("percent", 0) < 100), jobs[0])
+            if _due(host, now, chat_interval):
+                text = get_text("progress_dashboard", len(jobs), "\n".join(job.summary() for job in jobs))
+                _edit(host, text, now)
+            continue
+        for job in jobs:
+            if not _due(job, now, chat_interval):
+                continue
+            try:
+                text = job.render(job.counters)
+            except Exception as e:
+                warning(f"[PROGRESS] Error rendering progress: {e}")
+                continue
+            _edit(job, text, now)
+
+
+def _due(job, now, interval):
+    return (job.editing is None or job.editing.done()) and now - job.last_edit >= interval
+
+
+def _edit(job, text, now):
+    if not text or text == job.last_text:
+        return
+    job.last_edit = now
+    job.last_text = text
+    _edits.append(now)
+    job.editing = asyncio.get_running_loop().create_task(_send_edit(job, text))
+
+
+async def _send_edit(job, text):
+    try:
+        if job.buttons is not None:
+            await job.status_message.edit(text, buttons=job.buttons, parse_mode=PARSE_MODE)
+        else:
+            await job.status_message.edit(text, parse_mode=PARSE_MODE)
+    except Exception as edit_error:
+        error_msg = str(edit_error)
+        if "message ID is invalid" in error_msg or "MESSAGE_ID_INVALID" in error_msg:
+            # El mensaje ya no existe: no tiene sentido seguir pintándolo
+            debug(f"[PROGRESS] Status message was deleted, stopping its progress updates")
+            job.closed = True
+            if _jobs.get(job.key) is job:
+                del _jobs[job.key]
+        elif not flood_control.record_error("edit", job.chat_id, edit_error):
+            warning(f"[PROGRESS] Error editing progress message: {edit_error}")
@@ -0,0 +1,116 @@
+"""
+Caché de lo ya averiguado sobre un enlace (descarga directa o no, playlist,
+tipo de contenido), con caducidad.
+
+El mismo enlace se envía a menudo varias veces (lo comparten varios admins,
+o se reenvía tras cancelar); con la caché no se repite la petición HEAD ni el
+sondeo de yt-dlp. La clave es la URL canónica (ver `canonical_url`), así que
+las variantes de un mismo enlace comparten entrada. Las entradas caducan a
+los `ttl` segundos y, por encima del máximo, se descartan las usadas hace más
+tiempo. Si se indica un fichero, la caché sobrevive a los reinicios: los
+cambios se agrupan y se escriben en segundo plano como mucho cada
+`save_delay` segundos, y `flush()` guarda lo pendiente al apagar.
+"""
+import asyncio
+import collections
+import json
+import os
+import threading
+import time
+
+from basic import canonical_url
+from debug import debug, warning
+
+_cache = collections.OrderedDict()  # {clave: {"value", "expires"}}, de menos a más reciente
+_cache_path = None
+_ttl = 0
+_max_entries = 0
+_save_delay = 0
+_save_handle = None  # Guardado programado (asyncio.TimerHandle) pendiente
+_save_lock = threading.Lock()
+
+
+def init(path, ttl, max_entries, save_delay=0):
+    """Fija caducidad, tamaño y retardo de guardado y carga la caché desde
+    `path` (None = solo en memoria)."""
+    global _cache_path, _ttl, _max_entries, _save_delay
+    _cache_path = path
+    _ttl = ttl
+    _max_entries = max_entries
+    _save_delay = save_delay
+    if not path:
+        return
+    try:
+        with open(path, "r") as f:
+            now = time.time()
+            _cache.update((key, entry) for key, entry in json.load(f).items() if entry["expires"] > now)
+        debug(f"[URL_CACHE] Loaded {len(_cache)} cached URL result(s)")
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        warning(f"[URL_CACHE] Could not load URL cache {path}: {e}")
+
+
+def _key(kind, url):
+    return f"{kind}:{canonical_url(url)}"
+
+
+def _save(snapshot):
+    with _save_lock:
+        tmp_path = f"{_cache_path}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, _cache_path)
+        except OSError as e:
+            warning(f"[URL_CACHE] Could not save URL cache: {e}")
+
+
+def _save_in_background():
+    global _save_handle
+    _save_handle = None
+    asyncio.get_running_loop().run_in_executor(None, _save, dict(_cache))
+
+
+def _schedule_save():
+    """Programa un guardado en segundo plano (uno solo por tanda de cambios)."""
+    global _save_handle
+    if not _cache_path or _save_handle is not None:
+        return
+    _save_handle = asyncio.get_running_loop().call_later(_save_delay, _save_in_background)
+
+
+def flush():
+    """Guarda ya los cambios pendientes (al apagar el bot)."""
+    global _save_handle
+    if _save_handle is None:
+        return
+    _save_handle.cancel()
+    _save_handle = None
+    _save(dict(_cache))
+
+
+def get(kind, url):
+    """Resultado de tipo `kind` guardado para `url`, o None si no hay o ha caducado."""
+    key = _key(kind, url)
+    entry = _cache.get(key)
+    if entry is None:
+        return None
+    if entry["expires"] <= time.time():
+        del _cache[key]
+        return None
+    _cache.move_to_end(key)
+    debug(f"[URL_CACHE] Hit for {key}")
+    return entry["value"]
+
+
+def put(kind, url, value):
+    """Guarda `value` (serializable en JSON) como resultado de tipo `kind` para `url`."""
+    if _ttl <= 0:
+        return
+    key = _key(kind, url)
+    _cache[key] = {"value": value, "expires": time.time() + _ttl}
+    _cache.move_to_end(key)
+    while len(_cache) > _max_entries:
+        _cache.popitem(last=False)
+    _schedule_save()
@@ -0,0 +1,230 @@
+"""
+Pool de procesos worker de yt-dlp ya inicializados (ver ytdlp_worker.py).
+
+Lanzar `yt-dlp` en frío para cada sondeo y cada descarga paga otra vez el
+arranque de Python, la importación de yt_dlp y la de sus extractores. Los
+workers lo hacen una sola vez y reciben los trabajos por una tubería local;
+`run()` devuelve un objeto con la misma interfaz que un proceso de asyncio
+(stdout/stderr por líneas, wait, communicate, terminate, returncode), así que
+el resto del bot lo trata igual que al CLI.
+
+Si los workers no pueden arrancar (p. ej. yt_dlp no es importable desde este
+intérprete), `run()` lanza el CLI `yt-dlp` como antes.
+"""
+import asyncio
+import json
+import os
+import sys
+
+from debug import debug, warning, error
+
+_WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "ytdlp_worker.py")
+_READY_TIMEOUT = 60  # segundos máximos de arranque de un worker
+_ABORT_TIMEOUT = 5  # segundos que se espera a que un worker abandone un trabajo
+_MAX_JOBS_PER_WORKER = 50  # Trabajos antes de reciclar un worker (memoria, estado de yt-dlp)
+_STREAM_LIMIT = 64 * 1024 * 1024  # Las líneas de --dump-json pueden ocupar varios MB
+
+_size = 0
+_idle = []  # Workers listos, sin trabajo
+_busy = 0  # Workers con un trabajo en curso
+_spawning = 0
+_disabled = False  # Los workers no arrancan: usar el CLI
+_closing = False
+
+
+class _Worker:
+    def __init__(self, proc):
+        self.proc = proc
+        self.jobs = 0
+
+    def alive(self):
+        return self.proc.returncode is None
+
+
+class YtdlpJob:
+    """Trabajo en curso en un worker, con la interfaz de asyncio.subprocess.Process."""
+
+    def __init__(self, worker):
+        self.worker = worker
+        self.pid = worker.proc.pid
+        self.returncode = None
+        self.stdout = asyncio.StreamReader(limit=_STREAM_LIMIT)
+        self.stderr = asyncio.StreamReader(limit=_STREAM_LIMIT)
+        self._done = asyncio.Event()
+        self._abort_timer = None
+        self._pump = asyncio.create_task(self._read_events())
+
+    async def _read_events(self):
+        proc = self.worker.proc
+        try:
+            async for raw in proc.stdout:
+                message = json.loads(raw)
+                event = message.get("event")
+                if event == "stdout":
+                    self.stdout.feed_data(message["line"].encode() + b"\n")
+                elif event == "stderr":
+                    self.stderr.feed_data(message["line"].encode() + b"\n")
+                elif event == "exit":
+                    self.returncode = message["code"]
+                    break
+            else:
+                # El worker terminó a mitad del trabajo (cancelación o fallo)
+                self.returncode = await proc.wait()
+        except Exception as e:
+            error(f"[YT-DLP POOL] Lost worker {self.pid}: {e}")
+            if proc.returncode is None:
+                proc.kill()
+            self.returncode = await proc.wait()
+        finally:
+            if self._abort_timer is not None:
+                self._abort_timer.cancel()
+            self.stdout.feed_eof()
+            self.stderr.feed_eof()
+            self._done.set()
+            _release(self.worker)
+
+    async def wait(self):
+        await self._done.wait()
+        return self.returncode
+
+    async def communicate(self):
+        stdout, stderr = await asyncio.gather(self.stdout.read(), self.stderr.read())
+        await self.wait()
+        return stdout, stderr
+
+    def terminate(self):
+        """Pide al worker que abandone el trabajo (así vuelve al pool). Si no
+        lo hace en _ABORT_TIMEOUT segundos, se termina el proceso."""
+        if self.returncode is not None or not self.worker.alive() or self._abort_timer is not None:
+            return
+        try:
+            self.worker.proc.stdin.write(b'{"abort": true}\n')
+        except Exception:
+            self.worker.proc.terminate()
+            return
+        self._abort_timer = asyncio.get_running_loop().call_later(_ABORT_TIMEOUT, self._stop_worker)
+
+    def _stop_worker(self):
+        if self.returncode is None and self.worker.alive():
+            warning(f"[YT-DLP POOL] Worker {self.pid} did not abort its job, terminating it")
+            self.worker.proc.terminate()
+
+    def kill(self):
+        if self.returncode is None and self.worker.alive():
+            self.worker.proc.kill()
+
+
+def init(size):
+    """Fija el número de workers que se mantienen listos."""
+    global _size
+    _size = max(0, size)
+
+
+async def start():
+    """Arranca en segundo plano los workers del pool."""
+    _refill()
+
+
+async def close():
+    """Detiene los workers libres (los ocupados se cierran al terminar)."""
+    global _closing
+    _closing = True
+    while _idle:
+        worker = _idle.pop()
+        if worker.alive():
+            worker.proc.stdin.close()
+
+
+async def _spawn():
+    """Lanza un worker y espera a que tenga yt_dlp cargado. None si no arranca."""
+    global _disabled
+    proc = None
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            sys.executable, _WORKER_SCRIPT,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            limit=_STREAM_LIMIT
+        )
+        line = await asyncio.wait_for(proc.stdout.readline(), timeout=_READY_TIMEOUT)
+        if json.loads(line or b"{}").get("event") != "ready":
+            raise RuntimeError(f"worker exited with code {await proc.wait()}")
+        debug(f"[YT-DLP POOL] Worker {proc.pid} ready")
+        return _Worker(proc)
+    except Exception as e:
+        if proc is not None and proc.returncode is None:
+            proc.kill()
+        if not _disabled:
+            warning(f"[YT-DLP POOL] Could not start yt-dlp worker ({e}), falling back to the yt-dlp CLI")
+        _disabled = True
+        return None
+
+
+def _refill():
+    """Repone en segundo plano los workers hasta `_size` (libres u ocupados:
+    los ocupados vuelven al pool al terminar)."""
+    global _spawning
+    missing = _size - len(_idle) - _busy - _spawning
+    if _disabled or _closing or missing <= 0:
+        return
+
+    async def spawn_one():
+        global _spawning
+        try:
+            worker = await _spawn()
+        finally:
+            _spawning -= 1
+        if worker is not None:
+            _idle.append(worker)
+
+    _spawning += missing
+    for _ in range(missing):
+        asyncio.create_task(spawn_one())
+
+
+def _release(worker):
+    global _busy
+    _busy -= 1
+    worker.jobs += 1
+    if worker.alive() and not _closing and worker.jobs < _MAX_JOBS_PER_WORKER and len(_idle) + _busy < _size:
+        _idle.append(worker)
+    else:
+        if worker.alive():
+            worker.proc.stdin.close()  # El worker sale al ver EOF
+        _refill()
+
+
+async def _acquire():
+    global _busy
+    while _idle:
+        worker = _idle.pop()
+        if worker.alive():
+            _busy += 1
+            return worker
+    _refill()  # Reponer los que hayan muerto estando libres
+    if _disabled:
+        return None
+    # Pool vacío (más trabajos simultáneos que workers): uno nuevo, en frío
+    worker = await _spawn()
+    if worker is not None:
+        _busy += 1
+    return worker
+
+
+async def run(args):
+    """
+    Ejecuta `yt-dlp <args>` en un worker del pool (o con el CLI si no hay pool)
+    y devuelve el proceso/trabajo en curso con stdout y stderr en tuberías.
+    """
+    worker = None if _closing else await _acquire()
+    if worker is None:
+        return await asyncio.create_subprocess_exec(
+            "yt-dlp", *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            limit=_STREAM_LIMIT
+        )
+    worker.proc.stdin.write(json.dumps({"argv": list(args)}).encode() + b"\n")
+    await worker.proc.stdin.drain()
+    debug(f"[YT-DLP POOL] Job sent to worker {worker.proc.pid}")
+    return YtdlpJob(worker)
@@ -0,0 +1,127 @@
+"""
+Proceso worker de yt-dlp. Lo arranca ytdlp_service; no se importa desde el bot.
+
+Importa yt_dlp (y sus extractores) una sola vez y después ejecuta trabajos con
+los mismos argumentos que la línea de comandos `yt-dlp`, uno detrás de otro.
+Protocolo por stdin/stdout, un objeto JSON por línea:
+
+    <- {"event": "ready"}                         worker listo para trabajos
+    -> {"argv": [...]}                            ejecutar un trabajo
+    <- {"event": "stdout" | "stderr", "line": s}  salida del trabajo, por líneas
+    -> {"abort": true}                            abandonar el trabajo en curso
+    <- {"event": "exit", "code": n}               fin del trabajo (código de salida)
+
+Abandonar un trabajo deja el worker listo para el siguiente: la siguiente
+línea que escriba yt-dlp lanza KeyboardInterrupt, que yt-dlp trata como una
+interrupción del usuario, y el trabajo sale con -SIGTERM, como el CLI
+terminado. Si yt-dlp no escribe nada (p. ej. esperando a la red), quien lo
+pidió termina el proceso.
+"""
+import json
+import os
+import queue
+import signal
+import sys
+import threading
+
+# El stdout real queda reservado al protocolo: lo que escriban subprocesos
+# (ffmpeg, deno...) en el descriptor 1 va a stderr y no se mezcla con él
+_ipc = os.fdopen(os.dup(1), "w", encoding="utf-8", buffering=1)
+os.dup2(2, 1)
+
+
+_abort = threading.Event()  # Abandono pedido para el trabajo en curso
+
+
+def _send(**message):
+    _ipc.write(json.dumps(message) + "\n")
+    _ipc.flush()
+
+
+class _LineStream:
+    """Sustituto de sys.stdout/sys.stderr que envía la salida línea a línea."""
+
+    encoding = "utf-8"
+
+    def __init__(self, name):
+        self.name = name
+        self.pending = ""
+        self.aborted = False
+
+    def write(self, text):
+        if _abort.is_set():
+            _abort.clear()
+            self.aborted = True
+            raise KeyboardInterrupt
+        *lines, self.pending = (self.pending + text).split("\n")
+        for line in lines:
+            _send(event=self.name, line=line.rstrip("\r"))
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+    def close(self):
+        if self.pending:
+            _send(event=self.name, line=self.pending)
+            self.pending = ""
+
+
+def _run(yt_dlp, argv):
+    out, err = _LineStream("stdout"), _LineStream("stderr")
+    real_stdout, real_stderr = sys.stdout, sys.stderr
+    sys.stdout, sys.stderr = out, err
+    try:
+        yt_dlp.main(argv)
+        code = 0
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            code = e.code or 0
+        else:
+            err.write(f"{e.code}\n")
+            code = 1
+    except Exception as e:
+        err.write(f"ERROR: {type(e).__name__}: {e}\n")
+        code = 1
+    finally:
+        out.close()
+        err.close()
+        sys.stdout, sys.stderr = real_stdout, real_stderr
+    if out.aborted or err.aborted:
+        code = -signal.SIGTERM
+    return code
+
+
+def _read_commands(jobs):
+    """Hilo lector de stdin: encola los trabajos y atiende los abandonos
+    mientras el hilo principal está ocupado con yt-dlp."""
+    for raw in sys.stdin:
+        if not raw.strip():
+            continue
+        command = json.loads(raw)
+        if command.get("abort"):
+            _abort.set()
+        else:
+            jobs.put(command)
+    jobs.put(None)
+
+
+def main():
+    import yt_dlp
+    from yt_dlp.extractor import gen_extractor_classes
+
+    gen_extractor_classes()
+    jobs = queue.Queue()
+    threading.Thread(target=_read_commands, args=(jobs,), daemon=True).start()
+    _send(event="ready")
+    while (job := jobs.get()) is not None:
+        # Un abandono tardío del trabajo anterior llega siempre antes que este
+        _abort.clear()
+        _send(event="exit", code=_run(yt_dlp, job["argv"]))
+
+
+if __name__ == "__main__":
+    main()
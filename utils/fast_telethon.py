@@ -5,81 +5,776 @@ Acelera descargas y subidas abriendo varias conexiones (MTProtoSender)
 simultáneas al mismo datacenter y transfiriendo varios trozos a la vez,
 alcanzando velocidades equivalentes a Pyrogram.
 
+Las conexiones se mantienen en un pool persistente por datacenter
+(`_SenderPool`), compartido por todas las transferencias: la segunda
+transferencia al mismo DC reutiliza las conexiones ya abiertas (y la
+autorización exportada, en DCs ajenos) sin repetir el handshake. Las partes
+de todas las transferencias simultáneas a un DC se reparten sobre las mismas
+conexiones (`_DcScheduler`).
+
 Basado en la implementación de Tulir Asokan / painor (licencia MIT),
 adaptada a Telethon 1.43.x con limpieza de conexiones garantizada.
 """
 import asyncio
+import collections
+import concurrent.futures
 import hashlib
 import inspect
+import json
 import math
+import os
+import random
+import threading
 
-from telethon import utils, helpers
+from telethon import errors, utils, helpers
 from telethon.network import MTProtoSender
 from telethon.tl.alltlobjects import LAYER
-from telethon.tl.functions import InvokeWithLayerRequest
+from telethon.tl.functions import InvokeWithLayerRequest, PingRequest
 from telethon.tl.functions.auth import (
     ExportAuthorizationRequest, ImportAuthorizationRequest,
 )
 from telethon.tl.functions.upload import (
-    GetFileRequest, SaveFilePartRequest, SaveBigFilePartRequest,
+    GetFileHashesRequest, GetFileRequest, SaveFilePartRequest, SaveBigFilePartRequest,
+)
+from telethon.tl.types import (
+    InputFileBig, InputFile, InputPhotoFileLocation, Photo, PhotoSize,
+    PhotoSizeProgressive,
 )
-from telethon.tl.types import InputFileBig, InputFile
 
 
-# Nº máximo de chunks pre-descargados que cada conexión puede mantener en cola
-# esperando a ser escritos a disco. Limita la memoria del pipeline de descarga
-# (memoria ≈ conexiones × _PIPELINE_BUFFER × part_size) y aplica backpressure
-# para que una conexión rápida no se desboque si el disco va lento.
-_PIPELINE_BUFFER = 4
+# Prioridades de las transferencias en el planificador de cada DC: mientras
+# haya partes de una prioridad más alta (número menor) se sirven antes; entre
+# transferencias de la misma prioridad, por turnos.
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
 
+# Presupuesto global por defecto para todas las transferencias simultáneas
+# (ver _TransferGovernor); configurable con configure_governor().
+_DEFAULT_TOTAL_CONNECTIONS = 16
+_DEFAULT_BUFFER_BYTES = 64 * 1024 * 1024
 
-class _DownloadSender:
-    def __init__(self, client, sender, file, offset, limit, stride, count):
-        self.client = client
-        self.sender = sender
-        self.request = GetFileRequest(file, offset=offset, limit=limit)
-        self.stride = stride
-        self.remaining = count
+# Nº de peticiones de parte en vuelo a la vez sobre cada conexión. Con 1 cada
+# conexión es stop-and-wait (una parte por RTT); con varias, MTProto las
+# multiplexa sobre el mismo socket y menos conexiones alcanzan el mismo caudal.
+_INFLIGHT_PER_CONNECTION = 2
 
-    async def next(self):
-        if not self.remaining:
-            return None
-        result = await self.client._call(self.sender, self.request)
-        self.remaining -= 1
-        self.request.offset += self.stride
-        return result.bytes
+# Hilos dedicados a la E/S posicional (pwrite de descargas, pread y md5 de
+# subidas), para no competir con el executor por defecto ni bloquear el event loop.
+_IO_POOL = concurrent.futures.ThreadPoolExecutor(
+    max_workers=8, thread_name_prefix="fast-telethon-io")
+
+# Segundos que una conexión puede quedar ociosa en el pool antes de cerrarse.
+_POOL_IDLE_TIMEOUT = 300
+# Nº máximo de conexiones ociosas que se conservan por datacenter.
+_POOL_MAX_IDLE = 16
+# Si una conexión lleva más de estos segundos ociosa, se comprueba con un ping
+# antes de reutilizarla (una conexión muerta cuesta menos que una transferencia
+# fallida a mitad).
+_POOL_PING_AFTER = 60
+_POOL_PING_TIMEOUT = 10
+# Cada cuántos segundos se persiste el manifiesto de partes de una descarga
+# reanudable (fsync + escritura atómica del bitmap).
+_CHECKPOINT_INTERVAL = 5
+
+# Control adaptativo (AIMD) de las transferencias: cada cuántos segundos se
+# mide el caudal, qué mejora relativa justifica una conexión más y qué caída
+# provoca reducir a la mitad.
+_TUNE_INTERVAL = 2
+_TUNE_GAIN = 0.05
+_TUNE_DROP = 0.3
+# Límites del tamaño de parte aprendido (KB). GetFile admite hasta 1 MB, pero
+# iter_download (método estándar, que comparte manifiesto) solo hasta 512 KB.
+_MIN_PART_KB = 64
+_MAX_PART_KB = 512
+
+# Reintentos por parte: una parte fallida vuelve a la cola (y la toma
+# cualquier conexión sana) tras una espera exponencial; solo si falla
+# _PART_MAX_ATTEMPTS veces se aborta la transferencia entera.
+_PART_MAX_ATTEMPTS = 5
+_PART_RETRY_DELAY = 1
+_PART_RETRY_MAX_DELAY = 30
+# Tiempo máximo de una petición de parte. Holgado porque Telethon reintenta
+# internamente los errores internos (5xx); los FloodWait llegan como error
+# y la parte se repite tras la espera, sin gastar intentos.
+_PART_TIMEOUT = 120
+# Veces que una descarga puede renovar la referencia de su fichero
+# (FILE_REFERENCE_EXPIRED) antes de darse por fallida.
+_MAX_LOCATION_REFRESHES = 3
+# Telegram publica un SHA-256 por cada bloque de 128 KB del fichero
+# (upload.getFileHashes); solo se verifican partes múltiplo de ese tamaño.
+_HASH_BLOCK = 128 * 1024
 
-    def disconnect(self):
-        return self.sender.disconnect()
 
+class _SenderPool:
+    """
+    Pool persistente de conexiones (MTProtoSender) a un datacenter.
 
-class _UploadSender:
-    def __init__(self, client, sender, file_id, part_count, big, index, stride, loop):
+    Las conexiones se piden con `acquire()` y se devuelven con `release()`;
+    las ociosas se cierran tras `_POOL_IDLE_TIMEOUT` segundos. En DCs distintos
+    al de la sesión, la autorización se exporta una sola vez y su auth_key se
+    reutiliza para todas las conexiones siguientes.
+    """
+
+    def __init__(self, client, dc_id):
         self.client = client
-        self.sender = sender
-        self.part_count = part_count
-        if big:
-            self.request = SaveBigFilePartRequest(file_id, index, part_count, b"")
+        self.dc_id = dc_id
+        self.auth_key = (client.session.auth_key
+                         if dc_id == client.session.dc_id else None)
+        self._idle = []  # [(sender, instante en que quedó libre)]
+        self._auth_lock = asyncio.Lock()
+        self._reaper = None
+
+    async def acquire(self):
+        """Devuelve una conexión lista para usar (reutilizada o nueva)."""
+        loop = asyncio.get_running_loop()
+        while self._idle:
+            sender, released_at = self._idle.pop()
+            if not sender.is_connected():
+                await _disconnect_quietly(sender)
+                continue
+            if loop.time() - released_at > _POOL_PING_AFTER:
+                if not await self._ping(sender):
+                    await _disconnect_quietly(sender)
+                    continue
+            return sender
+        return await self._create_sender()
+
+    def release(self, sender, broken=False):
+        """Devuelve `sender` al pool (o lo cierra si está roto o sobra)."""
+        if broken or not sender.is_connected() or len(self._idle) >= _POOL_MAX_IDLE:
+            asyncio.get_running_loop().create_task(_disconnect_quietly(sender))
+            return
+        self._idle.append((sender, asyncio.get_running_loop().time()))
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.get_running_loop().create_task(self._reap_idle())
+
+    async def close(self):
+        """Cierra todas las conexiones ociosas y detiene el reaper."""
+        if self._reaper:
+            self._reaper.cancel()
+            self._reaper = None
+        idle, self._idle = self._idle, []
+        await asyncio.gather(
+            *(_disconnect_quietly(s) for s, _ in idle), return_exceptions=True)
+
+    async def _reap_idle(self):
+        loop = asyncio.get_running_loop()
+        while self._idle:
+            await asyncio.sleep(min(30, _POOL_IDLE_TIMEOUT))
+            now = loop.time()
+            expired = [s for s, t in self._idle if now - t >= _POOL_IDLE_TIMEOUT]
+            self._idle = [(s, t) for s, t in self._idle if now - t < _POOL_IDLE_TIMEOUT]
+            for sender in expired:
+                await _disconnect_quietly(sender)
+
+    async def _ping(self, sender):
+        try:
+            await asyncio.wait_for(
+                sender.send(PingRequest(ping_id=random.getrandbits(63))),
+                _POOL_PING_TIMEOUT)
+            return True
+        except Exception:
+            return False
+
+    async def _connect(self, auth_key):
+        dc = await self.client._get_dc(self.dc_id)
+        sender = MTProtoSender(auth_key, loggers=self.client._log)
+        await sender.connect(self.client._connection(
+            dc.ip_address, dc.port, dc.id,
+            loggers=self.client._log,
+            proxy=self.client._proxy,
+            local_addr=self.client._local_addr,
+        ))
+        return sender
+
+    async def _create_sender(self):
+        if self.auth_key:
+            return await self._connect(self.auth_key)
+        # DC ajeno sin autorización aún: exportarla una sola vez (el lock evita
+        # que varias conexiones creadas a la vez la exporten cada una).
+        async with self._auth_lock:
+            if self.auth_key:
+                return await self._connect(self.auth_key)
+            sender = await self._connect(None)
+            try:
+                auth = await self.client(ExportAuthorizationRequest(self.dc_id))
+                self.client._init_request.query = ImportAuthorizationRequest(
+                    id=auth.id, bytes=auth.bytes)
+                req = InvokeWithLayerRequest(LAYER, self.client._init_request)
+                await sender.send(req)
+            except BaseException:
+                await _disconnect_quietly(sender)
+                raise
+            self.auth_key = sender.auth_key
+            return sender
+
+
+async def _disconnect_quietly(sender):
+    try:
+        await sender.disconnect()
+    except Exception:
+        pass
+
+
+_pools = {}
+
+
+def _get_pool(client, dc_id):
+    key = (id(client), dc_id)
+    pool = _pools.get(key)
+    if pool is None or pool.client is not client:
+        pool = _pools[key] = _SenderPool(client, dc_id)
+    return pool
+
+
+async def close_pools():
+    """Cierra todas las conexiones persistentes (llamar al apagar el bot)."""
+    pools = list(_pools.values())
+    _pools.clear()
+    await asyncio.gather(*(p.close() for p in pools), return_exceptions=True)
+
+
+# Ajustes aprendidos por DC: {"<dc>": {"connections", "rate"}} para el
+# planificador y {"<dc>:<download|upload>": {"part_size_kb", "rate"}} por
+# sentido. Se persisten en JSON si se llama a configure_tuning().
+_tuning = {}
+_tuning_path = None
+_tuning_lock = threading.Lock()
+
+
+def configure_tuning(path):
+    """Carga (y en adelante guarda en `path`) los ajustes aprendidos por DC
+    para que sobrevivan a reinicios."""
+    global _tuning_path
+    _tuning_path = path
+    try:
+        with open(path, "r") as f:
+            _tuning.update(json.load(f))
+    except (OSError, ValueError):
+        pass  # Sin ajustes (o corruptos): se vuelven a aprender
+
+
+def _save_tuning(snapshot):
+    with _tuning_lock:
+        tmp_path = f"{_tuning_path}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, _tuning_path)
+        except OSError:
+            pass  # No persistir no impide transferir; se reaprende
+
+
+def _download_part_size(file_size, dc_id):
+    remembered = _tuning.get(f"{dc_id}:download", {}).get("part_size_kb")
+    return (remembered or utils.get_appropriated_part_size(file_size)) * 1024
+
+
+class _TransferGovernor:
+    """
+    Reparte un presupuesto global de conexiones y de bytes en memoria entre
+    todos los consumidores activos: las conexiones entre los planificadores de
+    cada DC (_DcScheduler) y la memoria entre las transferencias en curso.
+
+    Cada consumidor registrado tiene derecho a una parte igual del presupuesto
+    de su tipo (todo, si está solo); al empezar o terminar otros, su cuota se
+    recalcula y las conexiones sobrantes se retiran al acabar su parte en
+    curso. El total de conexiones nunca supera el presupuesto: un planificador
+    nuevo espera a que los demás liberen al menos una.
+    """
+
+    class Job:
+        def __init__(self, kind):
+            self.kind = kind
+            self.connections = 0
+            self.buffered = 0
+
+    def __init__(self, connections, buffer_bytes):
+        self.connections = connections
+        self.buffer_bytes = buffer_bytes
+        self.jobs = set()
+        self._changed = None
+
+    @property
+    def changed(self):
+        # Creada bajo demanda para que pertenezca al event loop en uso
+        if self._changed is None:
+            self._changed = asyncio.Condition()
+        return self._changed
+
+    def register(self, kind):
+        """Registra un consumidor de "connections" o de "buffer"."""
+        job = self.Job(kind)
+        self.jobs.add(job)
+        return job
+
+    def _count(self, kind):
+        return max(1, sum(1 for j in self.jobs if j.kind == kind))
+
+    async def unregister(self, job):
+        self.jobs.discard(job)
+        await self._notify()
+
+    def connection_limit(self, job):
+        return max(1, self.connections // self._count("connections"))
+
+    def _buffer_limit(self):
+        return max(1, self.buffer_bytes // self._count("buffer"))
+
+    def _free_connections(self, job):
+        used = sum(j.connections for j in self.jobs)
+        return min(self.connections - used, self.connection_limit(job) - job.connections)
+
+    def try_acquire_connections(self, job, count):
+        granted = max(0, min(count, self._free_connections(job)))
+        job.connections += granted
+        return granted
+
+    async def acquire_connections(self, job, count):
+        """Concede hasta `count` conexiones, esperando a que haya al menos una."""
+        async with self.changed:
+            await self.changed.wait_for(lambda: self._free_connections(job) > 0)
+            return self.try_acquire_connections(job, count)
+
+    async def release_connections(self, job, count):
+        job.connections -= count
+        await self._notify()
+
+    async def reserve(self, job, nbytes):
+        """Reserva `nbytes` de buffer; una transferencia sin nada reservado
+        siempre puede reservar (garantiza que todas avanzan)."""
+        async with self.changed:
+            await self.changed.wait_for(lambda: job.buffered == 0 or (
+                job.buffered + nbytes <= self._buffer_limit()
+                and sum(j.buffered for j in self.jobs) + nbytes <= self.buffer_bytes))
+            job.buffered += nbytes
+
+    async def release(self, job, nbytes):
+        job.buffered -= nbytes
+        await self._notify()
+
+    async def _notify(self):
+        async with self.changed:
+            self.changed.notify_all()
+
+
+_governor = _TransferGovernor(_DEFAULT_TOTAL_CONNECTIONS, _DEFAULT_BUFFER_BYTES)
+
+
+def configure_governor(max_connections, buffer_bytes):
+    """Fija el presupuesto global de conexiones y de bytes en memoria que
+    comparten todas las transferencias paralelas simultáneas."""
+    _governor.connections = max(1, max_connections)
+    _governor.buffer_bytes = max(1, buffer_bytes)
+
+
+def _classify_part_error(e):
+    """Devuelve (reintentable, conexión_rota) para el error de una parte."""
+    if isinstance(e, (ConnectionError, OSError, asyncio.TimeoutError,
+                      errors.InvalidBufferError)):
+        return True, True
+    if isinstance(e, (errors.FloodWaitError, errors.ServerError, errors.TimedOutError)):
+        return True, False
+    if isinstance(e, errors.RPCError):
+        # Errores de la petición (referencia caducada, ubicación inválida...):
+        # reintentarla no va a cambiar nada
+        return False, False
+    return True, False
+
+
+async def _call_part(client, sender, request):
+    return await asyncio.wait_for(client._call(sender, request), _PART_TIMEOUT)
+
+
+class _CorruptPartError(ValueError):
+    """Una parte descargada no coincide con el hash publicado por Telegram.
+    Es reintentable: la parte vuelve a pedirse (quizá por otra conexión)."""
+
+
+def _part_matches(data, offset, hashes):
+    """Comprueba `data` (que empieza en `offset`) contra los FileHash de sus
+    bloques. Se ejecuta en _IO_POOL: hashlib libera el GIL."""
+    for h in hashes:
+        start = h.offset - offset
+        if hashlib.sha256(data[start:start + h.limit]).digest() != h.hash:
+            return False
+    return True
+
+
+class _AdaptiveController:
+    """
+    Control AIMD del nº de conexiones activas de un _DcScheduler.
+
+    Cada _TUNE_INTERVAL segundos mide el caudal: mientras añadir una conexión
+    mejore el caudal se sigue sumando una (aumento aditivo); si la última no
+    aportó se retira y se mantiene un tiempo; si el caudal se hunde o hay
+    errores se reduce a la mitad (decremento multiplicativo). Al quedar
+    ocioso, el mejor nº de conexiones se recuerda por DC.
+    """
+
+    def __init__(self, loop, key, start, maximum):
+        self.loop = loop
+        self.key = key
+        self.maximum = max(1, maximum)
+        self.target = min(max(1, start), self.maximum)
+        self.errors = 0
+        self.best_rate = 0
+        self.best_target = self.target
+        self._started = loop.time()
+        self._window_start = self._started
+        self._window_bytes = 0
+        self._last_rate = 0
+        self._increased = False
+        self._hold_until = 0
+
+    def record(self, nbytes):
+        self._window_bytes += nbytes
+
+    def on_error(self):
+        self.errors += 1
+        self._decrease()
+
+    def _decrease(self):
+        self.target = max(1, self.target // 2)
+        self._increased = False
+        self._hold_until = self.loop.time() + 2 * _TUNE_INTERVAL
+
+    def tick(self, active):
+        """Actualiza y devuelve el objetivo de conexiones; `active` es el nº
+        de conexiones realmente en uso."""
+        now = self.loop.time()
+        elapsed = now - self._window_start
+        if elapsed < _TUNE_INTERVAL:
+            return self.target
+        rate = self._window_bytes / elapsed
+        self._window_start = now
+        self._window_bytes = 0
+        if rate > self.best_rate:
+            self.best_rate = rate
+            self.best_target = active
+        if self._last_rate and rate < self._last_rate * (1 - _TUNE_DROP):
+            self._decrease()
+        elif self._increased and rate < self._last_rate * (1 + _TUNE_GAIN):
+            # La última conexión añadida no aportó: se retira y se espera
+            self.target = max(1, self.target - 1)
+            self._increased = False
+            self._hold_until = now + 3 * _TUNE_INTERVAL
+        elif now >= self._hold_until and self.target < self.maximum and active >= self.target:
+            self.target += 1
+            self._increased = True
         else:
-            self.request = SaveFilePartRequest(file_id, index, b"")
-        self.stride = stride
-        self.previous = None
+            self._increased = False
+        self.target = min(self.target, self.maximum)
+        self._last_rate = rate
+        return self.target
+
+    def finish(self):
+        """Guarda el mejor nº de conexiones para la próxima vez en este DC."""
+        if self.loop.time() - self._started < 2 * _TUNE_INTERVAL:
+            return  # demasiado corto para ser representativo
+        connections = max(1, self.best_target // 2) if self.errors else self.best_target
+        _tuning[self.key] = {"connections": connections, "rate": int(self.best_rate)}
+        _persist_tuning(self.loop)
+
+
+def _remember_part_size(loop, key, part_size_kb, min_part_kb, rate, failed):
+    """Ajusta el tamaño de parte de la próxima transferencia (`key` =
+    "<dc>:<download|upload>"): más grande tras una transferencia limpia al
+    menos tan rápida como la anterior, más pequeño tras errores."""
+    previous = _tuning.get(key, {})
+    if failed:
+        part_kb = max(min_part_kb, part_size_kb // 2)
+    elif rate >= previous.get("rate", 0) * 0.9:
+        part_kb = min(_MAX_PART_KB, part_size_kb * 2)
+    else:
+        part_kb = part_size_kb
+    _tuning[key] = {
+        "part_size_kb": part_kb,
+        "rate": int(max(rate, previous.get("rate", 0) * 0.5)),
+    }
+    _persist_tuning(loop)
+
+
+def _persist_tuning(loop):
+    if _tuning_path:
+        loop.run_in_executor(_IO_POOL, _save_tuning, dict(_tuning))
+
+
+class _Stream:
+    """
+    Partes pendientes de una transferencia enviada a un _DcScheduler.
+    `process(sender, part)` transfiere una parte por la conexión `sender` y
+    devuelve los bytes transferidos.
+    """
+
+    def __init__(self, loop, parts, process, file_size, max_connections,
+                 inflight, priority):
         self.loop = loop
+        self.pending = collections.deque(parts)
+        self.process = process
+        self.file_size = file_size
+        self.max_connections = max(1, max_connections)
+        self.inflight = max(1, inflight)
+        self.priority = priority
+        self.attempts = collections.Counter()
+        self.retries = set()
+        self.in_flight = 0
+        self.transferred = 0  # Bytes de las partes ya completadas
+        self.errors = 0
+        self.error = None
+        self.closed = False
+        self.started = loop.time()
+        self.finished = loop.create_future()
+        self.notify = lambda: None  # Lo fija el planificador al recibirlo
+
+    def has_work(self):
+        return bool(self.pending) and not self.closed
+
+    def requeue(self, part, delay):
+        async def _requeue():
+            await asyncio.sleep(delay)
+            if not self.closed:
+                self.pending.appendleft(part)
+                self.notify()
 
-    async def next(self, data):
-        if self.previous:
-            await self.previous
-        self.previous = self.loop.create_task(self._next(data))
+        task = self.loop.create_task(_requeue())
+        self.retries.add(task)
+        task.add_done_callback(self._retry_done)
 
-    async def _next(self, data):
-        self.request.bytes = data
-        await self.client._call(self.sender, self.request)
-        self.request.file_part += self.stride
+    def _retry_done(self, task):
+        self.retries.discard(task)
+        self.check_finished()
 
-    async def disconnect(self):
-        if self.previous:
-            await self.previous
-        return await self.sender.disconnect()
+    def close(self, error=None):
+        """Deja de repartir partes (por error o cancelación); `finished` se
+        resuelve cuando terminen las que ya están en vuelo."""
+        if self.closed:
+            return
+        self.closed = True
+        self.error = error
+        self.pending.clear()
+        for task in list(self.retries):
+            task.cancel()
+        self.check_finished()
+
+    def check_finished(self):
+        if self.finished.done() or self.in_flight or self.pending or self.retries:
+            return
+        if self.error:
+            self.finished.set_exception(self.error)
+        else:
+            self.finished.set_result(None)
+
+
+class _DcScheduler:
+    """
+    Planificador de partes compartido por todas las transferencias (descargas
+    y subidas) a un mismo datacenter.
+
+    Cada transferencia envía sus partes como un _Stream y todas se sirven
+    sobre el mismo conjunto de conexiones: cada conexión ejecuta varios
+    carriles que toman la siguiente parte de la transferencia a la que le toca
+    (round-robin entre las de mayor prioridad), así que el caudal total lo
+    marca el ancho de banda disponible y no cuántas conexiones abrió cada
+    fichero. El nº de conexiones lo ajusta _AdaptiveController, limitado por
+    la cuota del gobernador global; se toman del pool cuando hace falta y
+    vuelven a él al quedarse sin trabajo.
+
+    Una parte fallida vuelve a la cola de su transferencia tras una espera
+    exponencial para que la tome otra conexión; si el error indica que la
+    conexión está rota, esta se retira (se cierra) y se reemplaza por otra
+    del pool. Una transferencia solo falla si una parte agota
+    _PART_MAX_ATTEMPTS o el error no es reintentable.
+    """
+
+    def __init__(self, client, dc_id):
+        self.client = client
+        self.dc_id = dc_id
+        self.pool = _get_pool(client, dc_id)
+        self.streams = []
+        self.senders = []
+        self.lanes = {}  # {task: sender}
+        self.broken = set()
+        self.controller = None
+        self.job = None
+        self._supervisor = None
+        self._wakeup = None
+        self._turn = 0
+
+    async def submit(self, stream):
+        """Encola `stream` y espera a que todas sus partes estén transferidas."""
+        self.streams.append(stream)
+        stream.notify = self._notify
+        stream.check_finished()  # transferencia vacía
+        if self._supervisor is None:
+            self._wakeup = asyncio.Event()
+            self._supervisor = stream.loop.create_task(self._supervise())
+        self._notify()
+        try:
+            await asyncio.shield(stream.finished)
+        except asyncio.CancelledError:
+            # Esperar a las partes en vuelo: el llamador cerrará el fichero
+            stream.close()
+            await asyncio.gather(stream.finished, return_exceptions=True)
+            raise
+        finally:
+            self.streams.remove(stream)
+
+    def _notify(self):
+        if self._wakeup:
+            self._wakeup.set()
+
+    def _allowed(self):
+        return min(self.controller.target, _governor.connection_limit(self.job))
+
+    def _next_part(self, sender):
+        if (sender in self.broken or sender not in self.senders
+                or self.senders.index(sender) >= self._allowed()):
+            return None  # conexión rota o sobrante: se retira
+        ready = [s for s in self.streams if s.has_work()]
+        if not ready:
+            return None
+        top = min(s.priority for s in ready)
+        ready = [s for s in ready if s.priority == top]
+        stream = ready[self._turn % len(ready)]
+        self._turn += 1
+        return stream, stream.pending.popleft()
+
+    async def _lane(self, sender):
+        while True:
+            item = self._next_part(sender)
+            if item is None:
+                return
+            stream, part = item
+            stream.in_flight += 1
+            try:
+                size = await stream.process(sender, part)
+                stream.transferred += size
+                self.controller.record(size)
+            except Exception as e:
+                self._part_failed(stream, sender, part, e)
+            finally:
+                stream.in_flight -= 1
+                stream.check_finished()
+
+    def _part_failed(self, stream, sender, part, e):
+        retryable, sender_broken = _classify_part_error(e)
+        if sender_broken:
+            self.broken.add(sender)
+        if sender_broken or isinstance(e, errors.FloodWaitError):
+            self.controller.on_error()
+            stream.errors += 1
+        if stream.closed:
+            return
+        if not isinstance(e, errors.FloodWaitError):
+            stream.attempts[part] += 1
+        if not retryable or stream.attempts[part] >= _PART_MAX_ATTEMPTS:
+            stream.close(e)
+            return
+        delay = min(_PART_RETRY_MAX_DELAY,
+                    _PART_RETRY_DELAY * 2 ** (stream.attempts[part] - 1))
+        if isinstance(e, errors.FloodWaitError):
+            delay = max(delay, e.seconds)
+        stream.requeue(part, delay)
+
+    async def _grow(self, granted):
+        senders = await asyncio.gather(
+            *(self.pool.acquire() for _ in range(granted)), return_exceptions=True)
+        failure = None
+        loop = asyncio.get_running_loop()
+        lanes = max((s.inflight for s in self.streams), default=_INFLIGHT_PER_CONNECTION)
+        for sender in senders:
+            if isinstance(sender, BaseException):
+                failure = sender
+                await _governor.release_connections(self.job, 1)
+                continue
+            self.senders.append(sender)
+            for _ in range(lanes):
+                self.lanes[loop.create_task(self._lane(sender))] = sender
+        if failure and not self.senders:
+            # Sin ninguna conexión no hay nada que hacer: fallan todas
+            for stream in self.streams:
+                stream.close(failure)
+
+    async def _retire(self, sender):
+        self.senders.remove(sender)
+        self.pool.release(sender, broken=sender in self.broken)
+        self.broken.discard(sender)
+        await _governor.release_connections(self.job, 1)
+
+    async def _supervise(self):
+        loop = asyncio.get_running_loop()
+        if not self.streams:
+            # Las transferencias que lo lanzaron ya acabaron (p. ej. vacías)
+            # antes de que llegara a ejecutarse
+            self._supervisor = None
+            return
+        first = self.streams[0]
+        key = str(self.dc_id)
+        start = _tuning.get(key, {}).get("connections") or \
+            _ParallelTransferrer._connection_count(first.file_size, first.max_connections)
+        self.controller = _AdaptiveController(loop, key, start, first.max_connections)
+        self.job = _governor.register("connections")
+        try:
+            while self.streams or self.lanes:
+                self._wakeup.clear()
+                working = [s for s in self.streams if s.has_work()]
+                if working:
+                    # Con la cola vacía (cola final) el caudal no es representativo
+                    self.controller.maximum = max(s.max_connections for s in self.streams)
+                    self.controller.tick(len(self.senders))
+                    wanted = min(self._allowed(), sum(len(s.pending) for s in working)) \
+                        - len(self.senders)
+                    if wanted > 0:
+                        if self.senders:
+                            granted = _governor.try_acquire_connections(self.job, wanted)
+                        else:
+                            granted = await _governor.acquire_connections(self.job, wanted)
+                        if granted:
+                            await self._grow(granted)
+                wakeup = loop.create_task(self._wakeup.wait())
+                finished, _ = await asyncio.wait(
+                    [*self.lanes, wakeup], timeout=_TUNE_INTERVAL,
+                    return_when=asyncio.FIRST_COMPLETED)
+                wakeup.cancel()
+                for task in finished:
+                    sender = self.lanes.pop(task, None)
+                    if sender is not None and sender not in self.lanes.values():
+                        # Conexión retirada, rota o sin trabajo: al pool (o cerrada)
+                        await self._retire(sender)
+        except BaseException as e:
+            for stream in self.streams:
+                stream.close(e if isinstance(e, Exception) else None)
+            raise
+        finally:
+            # Capturar el estado antes de ceder el control: una transferencia
+            # nueva puede arrancar ya otro supervisor
+            self._supervisor = None
+            job, controller = self.job, self.controller
+            lanes, self.lanes = self.lanes, {}
+            senders, self.senders = self.senders, []
+            self.broken = set()
+            for task in lanes:
+                task.cancel()
+            await asyncio.gather(*lanes, return_exceptions=True)
+            for sender in senders:
+                self.pool.release(sender, broken=True)
+            await _governor.release_connections(job, len(senders))
+            await _governor.unregister(job)
+            if controller:
+                controller.finish()
+
+
+_schedulers = {}
+
+
+def _get_scheduler(client, dc_id):
+    key = (id(client), dc_id)
+    scheduler = _schedulers.get(key)
+    if scheduler is None or scheduler.client is not client:
+        scheduler = _schedulers[key] = _DcScheduler(client, dc_id)
+    return scheduler
 
 
 class _ParallelTransferrer:
@@ -87,18 +782,8 @@ class _ParallelTransferrer:
         self.client = client
         self.loop = asyncio.get_running_loop()
         self.dc_id = dc_id or client.session.dc_id
-        self.auth_key = (None if dc_id and client.session.dc_id != dc_id
-                         else client.session.auth_key)
-        self.senders = None
-        self.upload_ticker = 0
-
-    async def _cleanup(self):
-        if self.senders:
-            await asyncio.gather(
-                *(s.disconnect() for s in self.senders),
-                return_exceptions=True,
-            )
-        self.senders = None
+        self.scheduler = _get_scheduler(client, self.dc_id)
+        self.job = None
 
     @staticmethod
     def _connection_count(file_size, max_count, full_size=100 * 1024 * 1024):
@@ -106,116 +791,288 @@ class _ParallelTransferrer:
             return max_count
         return max(1, math.ceil((file_size / full_size) * max_count))
 
-    async def _create_sender(self):
-        dc = await self.client._get_dc(self.dc_id)
-        sender = MTProtoSender(self.auth_key, loggers=self.client._log)
-        await sender.connect(self.client._connection(
-            dc.ip_address, dc.port, dc.id,
-            loggers=self.client._log,
-            proxy=self.client._proxy,
-            local_addr=self.client._local_addr,
-        ))
-        if not self.auth_key:
-            auth = await self.client(ExportAuthorizationRequest(self.dc_id))
-            self.client._init_request.query = ImportAuthorizationRequest(
-                id=auth.id, bytes=auth.bytes)
-            req = InvokeWithLayerRequest(LAYER, self.client._init_request)
-            await sender.send(req)
-            self.auth_key = sender.auth_key
-        return sender
+    async def _transfer(self, kind, parts, process, file_size, max_connections,
+                        inflight, priority, part_size, min_part_kb):
+        """Envía las partes al planificador del DC como un _Stream con su
+        propia cuota de memoria, y aprende el tamaño de parte al terminar."""
+        stream = _Stream(self.loop, parts, process, file_size, max_connections,
+                         inflight, priority)
+        failed = False
+        cancelled = False
+        try:
+            await self.scheduler.submit(stream)
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        except Exception:
+            failed = True
+            raise
+        finally:
+            # Una transferencia cancelada no dice nada del tamaño de parte
+            elapsed = self.loop.time() - stream.started
+            if not cancelled and (failed or elapsed >= 2 * _TUNE_INTERVAL):
+                _remember_part_size(
+                    self.loop, f"{self.dc_id}:{kind}", part_size // 1024, min_part_kb,
+                    stream.transferred / max(elapsed, 1e-3), failed or stream.errors > 0)
 
-    async def _create_download_sender(self, file, index, part_size, stride, count):
-        return _DownloadSender(
-            self.client, await self._create_sender(), file,
-            index * part_size, part_size, stride, count)
-
-    async def _create_upload_sender(self, file_id, part_count, big, index, stride):
-        return _UploadSender(
-            self.client, await self._create_sender(), file_id,
-            part_count, big, index, stride, self.loop)
-
-    async def _init_download(self, connections, file, part_count, part_size):
-        minimum, remainder = divmod(part_count, connections)
-
-        def get_part_count():
-            nonlocal remainder
-            if remainder > 0:
-                remainder -= 1
-                return minimum + 1
-            return minimum
-
-        first = _DownloadSender(
-            self.client, await self._create_sender(), file,
-            0, part_size, connections * part_size, get_part_count())
-        rest = await asyncio.gather(*(
-            self._create_download_sender(
-                file, i, part_size, connections * part_size, get_part_count())
-            for i in range(1, connections)))
-        self.senders = [first, *rest]
-
-    async def download(self, file, file_size, max_connections, part_size_kb=None):
-        connections = self._connection_count(file_size, max_connections)
-        part_size = (part_size_kb or utils.get_appropriated_part_size(file_size)) * 1024
-        part_count = math.ceil(file_size / part_size)
-        await self._init_download(connections, file, part_count, part_size)
+    async def download(self, file, file_size, max_connections, fd,
+                       progress_callback=None, part_size_kb=None, manifest=None,
+                       inflight=_INFLIGHT_PER_CONNECTION, priority=PRIORITY_NORMAL,
+                       refresh_location=None, verify=False):
+        """
+        Descarga `file` escribiendo cada parte directamente en su offset de
+        `fd` (pwrite), sin orden global: las partes se reparten entre las
+        conexiones del planificador del DC (compartidas con el resto de
+        transferencias) a medida que quedan libres, de modo que una conexión
+        lenta no frena a las demás y las rápidas hacen más partes. Termina
+        cuando el bitmap de partes está completo.
+
+        Con `manifest` (PartManifest) se omiten las partes ya completadas en
+        intentos anteriores y el bitmap se persiste periódicamente (tras un
+        fsync del fichero), de modo que una descarga interrumpida se reanuda.
+
+        Si Telegram rota la referencia del fichero a mitad de descarga y hay
+        `refresh_location` (corrutina que devuelve un InputFileLocation
+        nuevo), se pide una sola vez para todas las conexiones y la parte
+        fallida se repite con ella, sin perder las ya descargadas.
+
+        Con `verify` cada parte se comprueba, antes de escribirla, contra los
+        SHA-256 por bloque de upload.getFileHashes (pedidos bajo demanda y
+        compartidos entre conexiones); una parte corrupta se vuelve a pedir
+        ella sola. Si Telegram no da hashes para el fichero, o el tamaño de
+        parte no es múltiplo de _HASH_BLOCK, se descarga sin verificar.
+        """
+        if manifest:
+            part_size = manifest.part_size
+            done = manifest.done
+        else:
+            part_size = part_size_kb * 1024 if part_size_kb else \
+                _download_part_size(file_size, self.dc_id)
+            done = bytearray(math.ceil(file_size / part_size))
+        part_count = len(done)
+        parts = [p for p in range(part_count) if not done[p]]
+        downloaded = manifest.completed_bytes() if manifest else 0
+        if not parts:
+            return downloaded
+        verify = verify and part_size % _HASH_BLOCK == 0
+
+        # Fichero preasignado (disperso) para poder escribir en cualquier offset.
+        await self.loop.run_in_executor(_IO_POOL, os.ftruncate, fd, file_size)
 
-        # Pipeline continuo: cada conexión descarga sus partes sin esperar a las
-        # demás y las va depositando en su propia cola acotada (backpressure). El
-        # consumidor las recoge en orden global estricto (round-robin por índice
-        # de parte), por lo que el fichero se reconstruye byte a byte igual que
-        # en el modo secuencial. La conexión i atiende las partes i, i+N, i+2N…,
-        # exactamente las que pide queues[part % connections].
-        queues = [asyncio.Queue(maxsize=_PIPELINE_BUFFER) for _ in self.senders]
+        # Backpressure: cada parte reserva su tamaño en el presupuesto de
+        # memoria del gobernador desde que se pide hasta que está en disco, así
+        # que un disco lento frena la descarga en lugar de llenar la RAM.
+        writes = set()
+        submitted = set()  # pwrite ya entregados a _IO_POOL y aún sin terminar
+        checkpoint = None
+        last_checkpoint = self.loop.time()
 
-        async def _producer(sender, queue):
+        def _save_manifest():
+            # Snapshot antes del fsync: todo lo marcado ya está escrito, así
+            # que tras el fsync es seguro darlo por persistido.
+            snapshot = bytes(done)
+            os.fsync(fd)
+            manifest.save(snapshot)
+
+        async def _write(part, data):
+            nonlocal downloaded, checkpoint, last_checkpoint
+            # Cancelar la espera no detiene un pwrite que ya corre en su hilo:
+            # se blinda y queda en `submitted` para esperarlo antes de salir
+            pending = _IO_POOL.submit(os.pwrite, fd, data, part * part_size)
+            submitted.add(pending)
+            try:
+                await asyncio.shield(asyncio.wrap_future(pending, loop=self.loop))
+                submitted.discard(pending)
+            finally:
+                await _governor.release(self.job, part_size)
+            done[part] = 1
+            downloaded += len(data)
+            if (manifest and (checkpoint is None or checkpoint.done())
+                    and self.loop.time() - last_checkpoint >= _CHECKPOINT_INTERVAL):
+                last_checkpoint = self.loop.time()
+                checkpoint = self.loop.run_in_executor(_IO_POOL, _save_manifest)
+            if progress_callback:
+                r = progress_callback(downloaded, file_size)
+                if inspect.isawaitable(r):
+                    await r
+
+        location = file
+        refreshing = None
+        refreshes = 0
+
+        async def _refresh(stale):
+            # Una sola renovación aunque fallen a la vez partes de varias
+            # conexiones: todas esperan a la misma y reintentan con el resultado.
+            nonlocal location, refreshing, refreshes
+            if location is not stale:
+                return True  # Otra conexión ya la renovó
+            if refreshing is None:
+                if refreshes >= _MAX_LOCATION_REFRESHES:
+                    return False
+                refreshes += 1
+                refreshing = self.loop.create_task(refresh_location())
+            task = refreshing
+            try:
+                fresh = await asyncio.shield(task)
+            finally:
+                if refreshing is task and task.done():
+                    refreshing = None
+            if location is stale:
+                location = fresh
+            return True
+
+        async def _call(sender, build):
+            # `build(location)` crea la petición; si la referencia caducó se
+            # renueva y se repite con la nueva
+            used = location
+            try:
+                return await _call_part(self.client, sender, build(used))
+            except (errors.FileReferenceExpiredError, errors.FileReferenceInvalidError):
+                if not refresh_location or not await _refresh(used):
+                    raise
+                return await _call_part(self.client, sender, build(location))
+
+        hashes = {}  # {offset: FileHash, o None si Telegram no lo da}
+        hash_requests = {}  # {offset: task}
+
+        async def _fetch_hashes(sender, offset):
+            nonlocal verify
             try:
-                while True:
-                    data = await sender.next()
-                    if not data:
-                        break
-                    await queue.put(data)
-            except asyncio.CancelledError:
+                result = await _call(sender, lambda loc: GetFileHashesRequest(loc, offset))
+            except errors.RPCError:
+                verify = False  # Sin hashes para este fichero: sin verificación
+                return
+            for h in result:
+                hashes.setdefault(h.offset, h)
+            hashes.setdefault(offset, None)
+
+        async def _part_hashes(sender, part):
+            offsets = range(part * part_size,
+                            min(file_size, (part + 1) * part_size), _HASH_BLOCK)
+            while verify:
+                missing = next((o for o in offsets if o not in hashes), None)
+                if missing is None:
+                    found = [hashes[o] for o in offsets]
+                    return None if None in found else found
+                task = hash_requests.get(missing)
+                if task is None:
+                    task = self.loop.create_task(_fetch_hashes(sender, missing))
+                    hash_requests[missing] = task
+                    task.add_done_callback(lambda _, o=missing: hash_requests.pop(o, None))
+                await asyncio.shield(task)
+            return None
+
+        # GetFile va sin `cdn_supported`: las cuentas de bot no pueden usar
+        # upload.getCdnFile, así que Telegram no redirige a sus DC de CDN y
+        # sirve siempre desde el DC de origen (de ahí las conexiones paralelas).
+        async def _fetch(sender, part):
+            await _governor.reserve(self.job, part_size)
+            try:
+                offset = part * part_size
+                result = await _call(sender, lambda loc: GetFileRequest(
+                    loc, offset=offset, limit=part_size))
+                data = result.bytes
+                expected = min(part_size, file_size - part * part_size)
+                if len(data) != expected:
+                    raise ValueError(
+                        f"Part {part} returned {len(data)} of {expected} bytes")
+                if verify:
+                    part_hashes = await _part_hashes(sender, part)
+                    if part_hashes and not await self.loop.run_in_executor(
+                            _IO_POOL, _part_matches, data, offset, part_hashes):
+                        raise _CorruptPartError(f"Part {part} failed hash verification")
+            except BaseException:
+                await _governor.release(self.job, part_size)
                 raise
-            except BaseException as exc:
-                # Propagar el fallo al consumidor (activará el fallback estándar).
-                await queue.put(exc)
-
-        producers = [
-            self.loop.create_task(_producer(s, q))
-            for s, q in zip(self.senders, queues)
-        ]
+            task = self.loop.create_task(_write(part, data))
+            writes.add(task)
+            task.add_done_callback(writes.discard)
+            return len(data)
+
+        self.job = _governor.register("buffer")
         try:
-            for part in range(part_count):
-                item = await queues[part % connections].get()
-                if isinstance(item, BaseException):
-                    raise item
-                yield item
+            # Solo una parte que agota sus reintentos aborta la descarga entera
+            # (el llamador recurrirá al método estándar, reanudando).
+            await self._transfer(
+                "download", parts, _fetch, file_size, max_connections, inflight,
+                priority, part_size, _MIN_PART_KB)
+            while writes:
+                await asyncio.gather(*list(writes))
         finally:
-            for producer in producers:
-                producer.cancel()
-            await asyncio.gather(*producers, return_exceptions=True)
-            await self._cleanup()
-
-    async def init_upload(self, file_id, file_size, max_connections, part_size_kb=None):
-        connections = self._connection_count(file_size, max_connections)
-        part_size = (part_size_kb or utils.get_appropriated_part_size(file_size)) * 1024
+            for task in writes:
+                task.cancel()
+            await asyncio.gather(*writes, return_exceptions=True)
+            # El llamador cierra `fd` al volver: se anulan los pwrite que aún no
+            # han empezado y se espera a los que están en marcha
+            running = [p for p in submitted if not p.cancel()]
+            await asyncio.gather(
+                *(asyncio.wrap_future(p, loop=self.loop) for p in running),
+                return_exceptions=True)
+            await _governor.unregister(self.job)
+            if manifest:
+                # Checkpoint final, también si falló: lo ya escrito no se repite.
+                if checkpoint:
+                    await asyncio.gather(checkpoint, return_exceptions=True)
+                await self.loop.run_in_executor(_IO_POOL, _save_manifest)
+
+        if not all(done):
+            raise ValueError(
+                f"Incomplete parallel download: {sum(done)} of {part_count} parts")
+        return downloaded
+
+    async def upload(self, file_id, fd, file_size, max_connections,
+                     progress_callback=None, part_size_kb=None,
+                     inflight=_INFLIGHT_PER_CONNECTION, priority=PRIORITY_NORMAL):
+        """
+        Sube el fichero `fd` como `file_id`. Igual que en la descarga, las
+        partes se reparten entre las conexiones del planificador del DC y
+        cada una se lee con pread en su offset (en _IO_POOL) justo antes de
+        enviarla, así que las lecturas van en paralelo y sin buffer intermedio.
+        Devuelve (part_count, is_large).
+        """
+        # Telegram limita el nº de partes, así que la parte nunca puede ser
+        # menor que la que propone Telethon para el tamaño del fichero.
+        min_part_kb = utils.get_appropriated_part_size(file_size)
+        remembered_kb = _tuning.get(f"{self.dc_id}:upload", {}).get("part_size_kb", 0)
+        part_size = (part_size_kb or max(min_part_kb, remembered_kb)) * 1024
         part_count = math.ceil(file_size / part_size)
         is_large = file_size > 10 * 1024 * 1024
-        first = _UploadSender(
-            self.client, await self._create_sender(), file_id,
-            part_count, is_large, 0, connections, self.loop)
-        rest = await asyncio.gather(*(
-            self._create_upload_sender(file_id, part_count, is_large, i, connections)
-            for i in range(1, connections)))
-        self.senders = [first, *rest]
-        return part_size, part_count, is_large
+        uploaded = 0
 
-    async def upload(self, part):
-        await self.senders[self.upload_ticker].next(part)
-        self.upload_ticker = (self.upload_ticker + 1) % len(self.senders)
+        async def _send(sender, part):
+            nonlocal uploaded
+            offset = part * part_size
+            length = min(part_size, file_size - offset)
+            await _governor.reserve(self.job, part_size)
+            try:
+                data = await self.loop.run_in_executor(
+                    _IO_POOL, os.pread, fd, length, offset)
+                if len(data) != length:
+                    raise ValueError(
+                        f"Short read on part {part}: {len(data)} of {length} bytes")
+                if is_large:
+                    request = SaveBigFilePartRequest(file_id, part, part_count, data)
+                else:
+                    request = SaveFilePartRequest(file_id, part, data)
+                if not await _call_part(self.client, sender, request):
+                    raise ValueError(f"Part {part} was not saved by the server")
+            finally:
+                await _governor.release(self.job, part_size)
+            uploaded += length
+            if progress_callback:
+                r = progress_callback(uploaded, file_size)
+                if inspect.isawaitable(r):
+                    await r
+            return length
 
-    async def finish_upload(self):
-        await self._cleanup()
+        self.job = _governor.register("buffer")
+        try:
+            await self._transfer(
+                "upload", range(part_count), _send, file_size, max_connections,
+                inflight, priority, part_size, min_part_kb)
+        finally:
+            await _governor.unregister(self.job)
+        return part_count, is_large
 
 
 def connection_count(file_size, max_connections, full_size=100 * 1024 * 1024):
@@ -224,23 +1081,63 @@ def connection_count(file_size, max_connections, full_size=100 * 1024 * 1024):
     return _ParallelTransferrer._connection_count(file_size, max_connections, full_size)
 
 
-async def download_file(client, location, out, max_connections, progress_callback=None):
-    """Descarga `location` (Document/Photo) en el stream `out` usando varias
-    conexiones paralelas. `location` debe exponer `.size`."""
-    size = location.size
-    dc_id, input_location = utils.get_input_location(location)
+def part_size_for(file_size, dc_id=None):
+    """Tamaño de parte (bytes) que usará la descarga paralela de `file_size`
+    desde `dc_id` (el aprendido para ese DC, si lo hay). Es el que debe usarse
+    al crear un PartManifest nuevo para reanudar."""
+    return _download_part_size(file_size, dc_id)
+
+
+def _photo_size_bytes(size):
+    if isinstance(size, PhotoSizeProgressive):
+        return max(size.sizes, default=0)
+    if isinstance(size, PhotoSize):
+        return size.size
+    return 0  # Miniaturas incrustadas (stripped/cached/path): no se descargan
+
+
+def _file_location(media):
+    """Devuelve (dc_id, InputFileLocation, tamaño) de un Document o de la
+    versión más grande de un Photo (Telethon toma la última de `sizes`, que no
+    siempre es la mayor)."""
+    if isinstance(media, Photo):
+        largest = max(media.sizes or [], key=_photo_size_bytes, default=None)
+        if largest is None or not _photo_size_bytes(largest):
+            raise ValueError("Photo has no downloadable size")
+        return media.dc_id, InputPhotoFileLocation(
+            id=media.id,
+            access_hash=media.access_hash,
+            file_reference=media.file_reference,
+            thumb_size=largest.type,
+        ), _photo_size_bytes(largest)
+    dc_id, input_location = utils.get_input_location(media)
+    return dc_id, input_location, media.size
+
+
+async def download_file(client, location, out, max_connections, progress_callback=None,
+                        manifest=None, inflight=_INFLIGHT_PER_CONNECTION,
+                        priority=PRIORITY_NORMAL, refresh=None, verify=False):
+    """Descarga `location` (Document, o Photo en su tamaño más grande) en el
+    fichero abierto `out` (modo binario escribible) usando varias conexiones
+    paralelas. Las partes se escriben en su offset según llegan, así que `out`
+    debe ser un fichero real (con `fileno()`), no un stream.
+    Con `manifest` solo se descargan las partes que faltan; `inflight` es el
+    nº de partes pedidas a la vez por conexión y `priority` (PRIORITY_*) el
+    orden frente a otras transferencias al mismo DC. `refresh` (corrutina sin
+    argumentos que devuelve el Document/Photo de nuevo, p. ej. releyendo el
+    mensaje) permite continuar si la referencia del fichero caduca, y con
+    `verify` cada parte se comprueba contra los hashes de Telegram."""
+    dc_id, input_location, size = _file_location(location)
     transferrer = _ParallelTransferrer(client, dc_id)
-    loop = asyncio.get_running_loop()
-    downloaded = 0
-    async for chunk in transferrer.download(input_location, size, max_connections):
-        # Escribir en un hilo para no bloquear el event loop (importante con
-        # varias descargas concurrentes y/o sistemas de ficheros lentos).
-        await loop.run_in_executor(None, out.write, chunk)
-        downloaded += len(chunk)
-        if progress_callback:
-            r = progress_callback(downloaded, size)
-            if inspect.isawaitable(r):
-                await r
+
+    async def _refresh_location():
+        return _file_location(await refresh())[1]
+
+    out.flush()
+    downloaded = await transferrer.download(
+        input_location, size, max_connections, out.fileno(), progress_callback,
+        manifest=manifest, inflight=inflight, priority=priority,
+        refresh_location=_refresh_location if refresh else None, verify=verify)
     # Verificación de integridad: si faltan bytes, fallar para que el llamador
     # recurra al método estándar en lugar de guardar un fichero truncado.
     if downloaded != size:
@@ -250,42 +1147,39 @@ async def download_file(client, location, out, max_connections, progress_callbac
     return out
 
 
-async def upload_file(client, file, file_size, max_connections, progress_callback=None):
-    """Sube el stream binario `file` con varias conexiones paralelas y devuelve
-    el handle (InputFile/InputFileBig) listo para `client.send_file(file=...)`."""
-    file_id = helpers.generate_random_long()
+def _md5_file(fd, file_size, chunk_size=1024 * 1024):
     hash_md5 = hashlib.md5()
-    uploader = _ParallelTransferrer(client)
-    part_size, part_count, is_large = await uploader.init_upload(
-        file_id, file_size, max_connections)
+    offset = 0
+    while offset < file_size:
+        data = os.pread(fd, min(chunk_size, file_size - offset), offset)
+        if not data:
+            break
+        hash_md5.update(data)
+        offset += len(data)
+    return hash_md5.hexdigest()
+
+
+async def upload_file(client, file, file_size, max_connections, progress_callback=None,
+                      inflight=_INFLIGHT_PER_CONNECTION, priority=PRIORITY_NORMAL):
+    """Sube el fichero abierto `file` (modo binario, con `fileno()`) con varias
+    conexiones paralelas y devuelve el handle (InputFile/InputFileBig) listo
+    para `client.send_file(file=...)`. Cada conexión lee sus propias partes con
+    pread; el md5 (solo ficheros pequeños) se calcula en paralelo en un hilo."""
+    file_id = helpers.generate_random_long()
+    fd = file.fileno()
     loop = asyncio.get_running_loop()
-    buffer = bytearray()
-    uploaded = 0
+    md5_future = None
+    if file_size <= 10 * 1024 * 1024:
+        md5_future = loop.run_in_executor(_IO_POOL, _md5_file, fd, file_size)
+    uploader = _ParallelTransferrer(client)
     try:
-        while True:
-            # Leer en un hilo para no bloquear el event loop (importante con
-            # sistemas de ficheros lentos como bind mounts en Docker/Mac).
-            data = await loop.run_in_executor(None, file.read, part_size)
-            if not data:
-                break
-            uploaded += len(data)
-            if progress_callback:
-                r = progress_callback(uploaded, file_size)
-                if inspect.isawaitable(r):
-                    await r
-            if not is_large:
-                hash_md5.update(data)
-            if len(buffer) == 0 and len(data) == part_size:
-                await uploader.upload(data)
-                continue
-            buffer.extend(data)
-            while len(buffer) >= part_size:
-                await uploader.upload(bytes(buffer[:part_size]))
-                del buffer[:part_size]
-        if len(buffer) > 0:
-            await uploader.upload(bytes(buffer))
-    finally:
-        await uploader.finish_upload()
+        part_count, is_large = await uploader.upload(
+            file_id, fd, file_size, max_connections, progress_callback,
+            inflight=inflight, priority=priority)
+    except BaseException:
+        if md5_future:
+            await asyncio.gather(md5_future, return_exceptions=True)
+        raise
     if is_large:
         return InputFileBig(file_id, part_count, "upload")
-    return InputFile(file_id, part_count, "upload", hash_md5.hexdigest())
+    return InputFile(file_id, part_count, "upload", await md5_future)
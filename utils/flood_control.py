@@ -0,0 +1,93 @@
+"""
+Control global de FloodWait compartido por la cola de mensajes y las
+ediciones directas (progreso de transferencias y descargas de URL).
+
+Cuando Telegram responde con FloodWaitError, se anota hasta cuándo dura la
+penalización para ese método y chat. Cualquier llamada posterior por otra vía
+consulta `wait_time()` antes de hacerse y se aplaza (la cola) o se omite (una
+actualización de progreso) en lugar de volver a golpear la API y alargar la
+penalización.
+
+El cliente se usa con `flood_sleep_threshold = 0`: Telethon no duerme ningún
+FloodWait por su cuenta, así que todos llegan a quien hizo la llamada y se
+registran aquí. Las llamadas directas (fuera de la cola) pasan por `call()`.
+"""
+import asyncio
+import time
+
+from telethon import errors
+
+from debug import warning
+
+# Familia de método de Telegram de cada función que se llama a través de la
+# cola o directamente: las penalizaciones son por método, no por función.
+_METHODS = {
+    "edit": "edit",
+    "reply": "send",
+    "respond": "send",
+    "send_message": "send",
+    "send_file": "send",
+    "delete": "delete",
+    "delete_messages": "delete",
+    "answer": "answer",
+}
+
+_MAX_FLOOD_RETRIES = 5  # FloodWait seguidos que `call()` espera antes de rendirse
+
+_deadlines = {}  # {(método, chat_id o None): instante (monotónico) en que termina}
+
+
+def method_of(func):
+    """Familia de método de Telegram a la que pertenece `func`."""
+    name = getattr(func, "__name__", str(func))
+    return _METHODS.get(name, name)
+
+
+def record(method, chat_id, seconds):
+    """Anota una penalización de `seconds` para `method` en `chat_id`
+    (None = en todos los chats)."""
+    deadline = time.monotonic() + seconds
+    key = (method, chat_id)
+    if deadline > _deadlines.get(key, 0):
+        _deadlines[key] = deadline
+        warning(f"[FLOOD] {method} blocked for {seconds}s (chat: {chat_id})")
+
+
+def record_error(method, chat_id, error):
+    """Registra `error` si es un FloodWaitError. Devuelve True si lo era."""
+    if isinstance(error, errors.FloodWaitError):
+        record(method, chat_id, error.seconds)
+        return True
+    return False
+
+
+def wait_time(method, chat_id=None):
+    """Segundos que quedan de penalización para `method` en `chat_id`
+    (0 si se puede llamar ya)."""
+    now = time.monotonic()
+    remaining = 0
+    for key in ((method, chat_id), (method, None)):
+        deadline = _deadlines.get(key)
+        if deadline is None:
+            continue
+        if deadline <= now:
+            del _deadlines[key]
+        else:
+            remaining = max(remaining, deadline - now)
+    return remaining
+
+
+async def call(method, chat_id, func, *args, **kwargs):
+    """Llama a `func(*args, **kwargs)` respetando las penalizaciones de
+    `method` en `chat_id`: espera la que esté activa y, si Telegram responde
+    con FloodWait, la anota, la espera y repite la llamada."""
+    for attempt in range(_MAX_FLOOD_RETRIES):
+        remaining = wait_time(method, chat_id)
+        if remaining:
+            await asyncio.sleep(remaining)
+        try:
+            return await func(*args, **kwargs)
+        except errors.FloodWaitError as e:
+            if attempt == _MAX_FLOOD_RETRIES - 1:
+                raise
+            record(method, chat_id, e.seconds)
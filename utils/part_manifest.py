@@ -0,0 +1,110 @@
+"""
+Manifiesto de partes completadas de una descarga (fichero sidecar `.parts`).
+
+Permite reanudar una descarga de Telegram tras un timeout, un error, el paso
+al método estándar o incluso un reinicio del bot: solo se vuelven a pedir las
+partes que no constan como completadas.
+"""
+import base64
+import json
+import os
+
+from debug import debug, warning
+
+
+class PartManifest:
+    """
+    Bitmap de partes completadas de `data_path`, persistido en
+    `<data_path>.parts`. Solo es válido para el mismo fichero remoto
+    (`file_id`) y tamaño; si no coinciden se descarta. Un manifiesto existente
+    conserva su tamaño de parte aunque el sugerido haya cambiado.
+    """
+
+    def __init__(self, data_path, file_id, size, part_size):
+        self.data_path = data_path
+        self.path = f"{data_path}.parts"
+        self.file_id = file_id
+        self.size = size
+        self.part_size = part_size
+        self.part_count = max(1, -(-size // part_size))
+        self.done = bytearray(self.part_count)
+
+    @classmethod
+    def load(cls, data_path, file_id, size, part_size):
+        """Carga el manifiesto existente si corresponde al mismo fichero o
+        crea uno vacío con `part_size` (descartando datos parciales que no le
+        correspondan)."""
+        manifest = cls(data_path, file_id, size, part_size)
+        try:
+            with open(manifest.path, "r") as f:
+                data = json.load(f)
+            if (data.get("file_id") == file_id and data.get("size") == size
+                    and isinstance(data.get("part_size"), int) and data["part_size"] > 0
+                    and os.path.exists(data_path)):
+                if data["part_size"] != part_size:
+                    manifest = cls(data_path, file_id, size, data["part_size"])
+                done = base64.b64decode(data["done"])
+                if len(done) == manifest.part_count:
+                    manifest.done = bytearray(done)
+                    debug(f"[RESUME] Resuming {os.path.basename(data_path)}: "
+                          f"{manifest.completed_parts()}/{manifest.part_count} parts already downloaded")
+                    return manifest
+            debug(f"[RESUME] Stale manifest for {os.path.basename(data_path)}, starting over")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            warning(f"[RESUME] Could not read manifest {manifest.path}: {e}")
+        # Sin manifiesto válido, cualquier dato parcial existente no es fiable
+        if os.path.exists(data_path):
+            os.remove(data_path)
+        return manifest
+
+    def is_done(self, part):
+        return bool(self.done[part])
+
+    def mark(self, part):
+        self.done[part] = 1
+
+    def completed_parts(self):
+        return sum(self.done)
+
+    def completed_bytes(self):
+        last = self.part_count - 1
+        total = self.completed_parts() * self.part_size
+        if self.done[last]:
+            total -= self.part_count * self.part_size - self.size
+        return total
+
+    def contiguous_parts(self):
+        """Nº de partes completadas de forma contigua desde el principio."""
+        try:
+            return self.done.index(0)
+        except ValueError:
+            return self.part_count
+
+    def is_complete(self):
+        return all(self.done)
+
+    def save(self, done=None):
+        """Persiste el bitmap (o la instantánea `done`) de forma atómica
+        (fichero temporal + rename)."""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({
+                "file_id": self.file_id,
+                "size": self.size,
+                "part_size": self.part_size,
+                "done": base64.b64encode(bytes(self.done if done is None else done)).decode("ascii"),
+            }, f)
+        os.replace(tmp_path, self.path)
+
+    def remove(self, with_data=False):
+        """Elimina el manifiesto (y opcionalmente los datos parciales)."""
+        paths = [self.path, f"{self.path}.tmp"]
+        if with_data:
+            paths.append(self.data_path)
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
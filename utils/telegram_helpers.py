@@ -4,7 +4,25 @@ y evitar rate limiting.
 
 Las dependencias (message_queue y bot) deben inyectarse llamando a
 `init(message_queue, bot)` antes de usar cualquiera de las funciones safe_*.
+
+Cada función elige una prioridad por defecto en la cola: lo que responde
+directamente a una acción del usuario (responder, contestar un botón o
+editar/borrar el mensaje del propio evento) va primero; las ediciones de
+mensajes de estado después, y el borrado de esos mensajes al final. Todas
+aceptan `priority=` para forzar otra.
+
+También indican el chat afectado, para que la cola aplique su límite de
+velocidad y mantenga el orden de sus mensajes (salvo `safe_answer`: contestar
+un botón no publica nada en el chat y no debe esperar a sus ediciones).
+
+Editar o borrar un mensaje con progreso en curso (progress_service) retira
+antes su trabajo de progreso, para que un repintado tardío no pise el texto nuevo.
 """
+from telethon import events
+from telethon.events.common import EventCommon
+
+from message_queue import PRIORITY_INTERACTIVE, PRIORITY_STATUS, PRIORITY_BACKGROUND
+from services import progress_service
 
 _message_queue = None
 _bot = None
@@ -17,36 +35,78 @@ def init(message_queue, bot):
     _bot = bot
 
 
-async def safe_edit(message, *args, wait_for_result=False, **kwargs):
-    """Edita un mensaje usando la cola para evitar rate limiting"""
-    return await _message_queue.add_message(message.edit, *args, wait_for_result=wait_for_result, **kwargs)
+def _priority_for(target, default):
+    """Las acciones sobre el propio evento del usuario son interactivas."""
+    return PRIORITY_INTERACTIVE if isinstance(target, EventCommon) else default
 
 
-async def safe_reply(event, *args, wait_for_result=False, **kwargs):
-    """Responde a un evento usando la cola para evitar rate limiting"""
-    return await _message_queue.add_message(event.reply, *args, wait_for_result=wait_for_result, **kwargs)
+def _chat_key(entity):
+    """Id del chat destino si se pasó como id (si es una entidad, sin límite por chat)."""
+    return entity if isinstance(entity, int) else None
 
 
-async def safe_respond(event, *args, wait_for_result=False, **kwargs):
-    """Responde a un evento usando event.respond y la cola para evitar rate limiting"""
-    return await _message_queue.add_message(event.respond, *args, wait_for_result=wait_for_result, **kwargs)
+def _message_key(target):
+    """(chat_id, message_id) del mensaje que editaría/borraría `target`."""
+    if isinstance(target, events.CallbackQuery.Event):
+        return (target.chat_id, target.message_id)
+    return (target.chat_id, target.id)
 
 
-async def safe_answer(event, *args, wait_for_result=False, **kwargs):
-    """Responde a un callback query usando event.answer y la cola para evitar rate limiting"""
-    return await _message_queue.add_message(event.answer, *args, wait_for_result=wait_for_result, **kwargs)
+async def safe_edit(message, *args, wait_for_result=False, priority=None, **kwargs):
+    """
+    Edita un mensaje usando la cola para evitar rate limiting. Las ediciones
+    del mismo mensaje se fusionan en la cola (solo se envía la más reciente)
+    y las que no cambian nada respecto a la última enviada se descartan.
+    """
+    if priority is None:
+        priority = _priority_for(message, PRIORITY_STATUS)
+    key = _message_key(message)
+    if await progress_service.detach(key):
+        # El progreso se editó sin pasar por la cola: su último contenido ya no vale
+        _message_queue.forget_message(key)
+    return await _message_queue.add_message(
+        message.edit, *args, wait_for_result=wait_for_result, priority=priority,
+        coalesce_key=key, chat_id=message.chat_id, **kwargs
+    )
+
+
+async def safe_reply(event, *args, wait_for_result=False, priority=PRIORITY_INTERACTIVE, **kwargs):
+    """Responde a un evento usando la cola para evitar rate limiting"""
+    return await _message_queue.add_message(event.reply, *args, wait_for_result=wait_for_result, priority=priority, chat_id=event.chat_id, **kwargs)
 
 
-async def safe_delete(message, *args, wait_for_result=False, **kwargs):
-    """Elimina un mensaje usando la cola para evitar rate limiting"""
-    return await _message_queue.add_message(message.delete, *args, wait_for_result=wait_for_result, **kwargs)
+async def safe_respond(event, *args, wait_for_result=False, priority=PRIORITY_INTERACTIVE, **kwargs):
+    """Responde a un evento usando event.respond y la cola para evitar rate limiting"""
+    return await _message_queue.add_message(event.respond, *args, wait_for_result=wait_for_result, priority=priority, chat_id=event.chat_id, **kwargs)
 
 
-async def safe_send_message(chat_id, *args, wait_for_result=False, **kwargs):
+async def safe_answer(event, *args, wait_for_result=False, priority=PRIORITY_INTERACTIVE, **kwargs):
+    """Responde a un callback query usando event.answer y la cola para evitar rate limiting"""
+    return await _message_queue.add_message(event.answer, *args, wait_for_result=wait_for_result, priority=priority, **kwargs)
+
+
+async def safe_delete(message, *args, wait_for_result=False, priority=None, **kwargs):
+    """Elimina un mensaje usando la cola para evitar rate limiting. Los borrados
+    del mismo chat encolados casi a la vez se agrupan en una sola llamada."""
+    if priority is None:
+        priority = _priority_for(message, PRIORITY_BACKGROUND)
+    key = _message_key(message)
+    await progress_service.detach(key)
+    _message_queue.forget_message(key)
+    if args or kwargs:
+        return await _message_queue.add_message(message.delete, *args, wait_for_result=wait_for_result, priority=priority, chat_id=message.chat_id, **kwargs)
+    return await _message_queue.add_message(
+        _bot.delete_messages, await message.get_input_chat(), wait_for_result=wait_for_result,
+        priority=priority, chat_id=message.chat_id, batch_key=("delete", message.chat_id), batch_item=key[1]
+    )
+
+
+async def safe_send_message(chat_id, *args, wait_for_result=False, priority=PRIORITY_STATUS, **kwargs):
     """Envía un mensaje usando la cola para evitar rate limiting"""
-    return await _message_queue.add_message(_bot.send_message, chat_id, *args, wait_for_result=wait_for_result, **kwargs)
+    return await _message_queue.add_message(_bot.send_message, chat_id, *args, wait_for_result=wait_for_result, priority=priority, chat_id=_chat_key(chat_id), **kwargs)
 
 
-async def safe_send_file(chat_id, *args, wait_for_result=False, **kwargs):
-    """Envía un archivo usando la cola para evitar rate limiting"""
-    return await _message_queue.add_message(_bot.send_file, chat_id, *args, wait_for_result=wait_for_result, **kwargs)
+async def safe_send_file(chat_id, *args, wait_for_result=False, priority=PRIORITY_STATUS, **kwargs):
+    """Envía un archivo usando el carril de operaciones pesadas de la cola, para
+    que la subida no bloquee el resto de mensajes"""
+    return await _message_queue.add_message(_bot.send_file, chat_id, *args, wait_for_result=wait_for_result, priority=priority, chat_id=_chat_key(chat_id), heavy=True, **kwargs)